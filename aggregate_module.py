@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import parallel_module
+
+
+# ==============================
+# 🔹 トピック別の集計状態の保存（追記モード用）
+# ==============================
+# 実行のたびに、トピックごとの集計状態（件数・スコアの合計・しきい値以上の件数・最優秀アイデア）と
+# 処理済みの row_number の上限（ウォーターマーク）を保存しておく。
+# 次の実行では、ウォーターマークより大きい row_number の行だけを集計して足し込む。
+AGGREGATE_DIR = os.path.join(".cache", "aggregates")
+
+_STATE_FILE = "state.json"
+_DEPTHS = ("1", "2")
+
+
+class AggregateState:
+    """
+    保存済みの集計状態。
+    signature: トピック構成・マッピング・採点モデルの指紋（変わったら作り直し）
+    watermark: 処理済みの row_number の上限
+    n_rows / n_topic_rows: ウォーターマーク以下のデータ行数・トピック割り当て行数（増減したら作り直し）
+    assignments: ウォーターマーク以下の行のトピック割り当ての指紋（assignment_hash。変わったら作り直し）
+    frames: {"1": Broad の集計状態, "2": Medium の集計状態}（nomic_module.topic_states の形）
+    """
+
+    def __init__(self, signature, watermark, n_rows, n_topic_rows, frames, updated_at=None, assignments=None):
+        self.signature = signature
+        self.watermark = watermark
+        self.n_rows = n_rows
+        self.n_topic_rows = n_topic_rows
+        self.assignments = assignments
+        self.frames = frames
+        self.updated_at = updated_at
+
+
+def signature(df_meta, columns, model):
+    """
+    トピック構成（再クラスタリングで変わる）・列マッピング・採点モデルの指紋。
+    これが前回と違えば、保存済みの集計状態は使えない。
+    """
+    topics = df_meta[["depth", "topic_id", "topic_depth_1", "topic_depth_2"]].astype(str)
+    topics = topics.sort_values(list(topics.columns)).to_numpy().tolist()
+    payload = json.dumps(
+        {"topics": topics, "columns": list(columns), "model": model.to_dict()},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def assignment_hash(df_topics, topic_rows, watermark):
+    """
+    row_number がウォーターマーク以下の行の (row_number, Broad, Medium) の割り当ての指紋（行の並び順によらない）。
+    トピックの定義が同じままでも、Atlas が既存の行を別のトピックに付け替えたら変わる。
+    """
+    below = topic_rows <= watermark
+    assigned = pd.DataFrame({
+        "row_number": topic_rows[below],
+        "topic_depth_1": df_topics["topic_depth_1"].to_numpy()[below].astype(str),
+        "topic_depth_2": df_topics["topic_depth_2"].to_numpy()[below].astype(str),
+    }).sort_values(["row_number", "topic_depth_1", "topic_depth_2"], kind="stable")
+    hashed = pd.util.hash_pandas_object(assigned, index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def row_numbers(df):
+    """row_number を float64 の配列で（数値にできない値は NaN）"""
+    return pd.to_numeric(df["row_number"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _state_path(state_key, state_dir):
+    return os.path.join(state_dir, hashlib.sha1(str(state_key).encode("utf-8")).hexdigest())
+
+
+def load_state(state_key, state_dir=AGGREGATE_DIR):
+    """保存済みの集計状態（無い・読めなければ None）"""
+    path = _state_path(state_key, state_dir)
+    try:
+        with open(os.path.join(path, _STATE_FILE), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        frames = {
+            depth: pd.read_parquet(os.path.join(path, f"depth_{depth}.parquet")).set_index("topic")
+            for depth in _DEPTHS
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    for frame in frames.values():
+        frame.index = frame.index.astype(object)
+    return AggregateState(
+        info["signature"], info["watermark"], info["n_rows"], info["n_topic_rows"], frames, info.get("updated_at"),
+        info.get("assignments"),
+    )
+
+
+def save_state(state_key, state, state_dir=AGGREGATE_DIR):
+    """集計状態を保存する（一時ディレクトリに書いてから置き換える）"""
+    path = _state_path(state_key, state_dir)
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for depth in _DEPTHS:
+        frame = state.frames[depth].rename_axis("topic").reset_index()
+        frame.to_parquet(os.path.join(tmp, f"depth_{depth}.parquet"), index=False)
+    state.updated_at = datetime.now(timezone.utc).isoformat()
+    with open(os.path.join(tmp, _STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "key": str(state_key),
+            "signature": state.signature,
+            "watermark": state.watermark,
+            "n_rows": state.n_rows,
+            "n_topic_rows": state.n_topic_rows,
+            "assignments": state.assignments,
+            "updated_at": state.updated_at,
+        }, f, ensure_ascii=False)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+def stale_reason(state, sig, data_rows, topic_rows, df_topics):
+    """
+    保存済みの状態に追記できない理由（追記できるなら None）。
+    data_rows / topic_rows は今回のデータ・トピック割り当ての row_number（row_numbers の結果）。
+    """
+    if state is None:
+        return "no saved aggregates"
+    if np.isnan(data_rows).any() or np.isnan(topic_rows).any():
+        return "row_number is not numeric"
+    if state.signature != sig:
+        return "topics, column mapping or scoring model changed"
+    if (
+        int((data_rows <= state.watermark).sum()) != state.n_rows
+        or int((topic_rows <= state.watermark).sum()) != state.n_topic_rows
+    ):
+        return "rows at or below the watermark changed"
+    if state.assignments != assignment_hash(df_topics, topic_rows, state.watermark):
+        return "topic assignments of processed rows changed"
+    return None
+
+
+# ==============================
+# 🔹 集計状態のマージ
+# ==============================
+
+def fold(old, new, additive):
+    """
+    トピックごとの集計状態 old に new を足し込む（{"1": frame, "2": frame} 同士）。
+    additive の列は合計し、最優秀アイデアは「合計スコア最大・同点は row_number の小さい方」を選ぶ
+    （parallel_module.merge_partials と同じ規則）。それ以外の列は選ばれた最優秀アイデアの値を持ち越す。
+    """
+    merged = {}
+    for depth in _DEPTHS:
+        a, b = old[depth], new[depth]
+        names = a.index.union(b.index)
+        keys, stats, best_total, best_row = parallel_module.merge_partials([
+            (names.get_indexer(frame.index), frame[additive].to_numpy(dtype=np.float64),
+             frame["best_total"].to_numpy(dtype=np.float64), frame["best_row"].to_numpy(dtype=np.float64))
+            for frame in (a, b)
+        ])
+        frame = pd.DataFrame(stats, columns=additive, index=pd.Index(names[keys], dtype=object))
+        frame["best_total"] = best_total
+        frame["best_row"] = best_row
+
+        # 最優秀アイデアの表示用の値は、選ばれた行を持っていた側から取る
+        payload = [col for col in a.columns if col not in additive and col not in ("best_total", "best_row")]
+        candidates = pd.concat([a, b])[["best_row"] + payload]
+        candidates = candidates.set_index("best_row", append=True)
+        candidates = candidates[~candidates.index.duplicated()]
+        picked = candidates.reindex(pd.MultiIndex.from_arrays([frame.index, frame["best_row"]]))
+        for col in payload:
+            frame[col] = picked[col].to_numpy()
+        merged[depth] = frame[a.columns]
+    return merged
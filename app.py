@@ -1,4 +1,6 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
+import altair as alt
 import nomic
 from nomic import AtlasDataset
 import gspread
@@ -6,13 +8,140 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 import sheet_module
 import nomic_module
+import job_module
+import snapshot_module
+import history_module
+import search_module
+import schema_module
+import scoring_module
+import xlsx_module
+import map_module
+import store_module
 
 import re
 import json
+import os
+import uuid
 
 # ===================================
 # 関数
 # ===================================
+def job_key(kind):
+    """セッションごとのジョブキー（再実行時に同じジョブへ再接続する）"""
+    return (st.session_state.session_id, kind)
+
+
+def collect_finished_job(state_key, on_done):
+    """終了したジョブの結果をセッションに反映し、表示用メッセージを残す"""
+    job = job_module.get_runner().get(st.session_state.get(state_key))
+    if job is None or not job.finished:
+        return
+    st.session_state[state_key] = None
+    if job.status == "done":
+        st.session_state[f"{state_key}_notice"] = ("success", on_done(job.result))
+    elif job.status == "failed":
+        st.session_state[f"{state_key}_notice"] = ("error", f"❌ {job.error}")
+    else:
+        st.session_state[f"{state_key}_notice"] = ("warning", "⏹ Cancelled")
+
+
+def mapped_columns():
+    """Setting のマッピング (n, f, m, t, s, c)"""
+    return (
+        st.session_state.novelty_score,
+        st.session_state.feasibility_score,
+        st.session_state.marketability_score,
+        st.session_state.title,
+        st.session_state.summary,
+        st.session_state.category,
+    )
+
+
+def scoring_model():
+    """Setting の採点モデル（ScoringModel）"""
+    return scoring_module.get_model(st.session_state.scoring_model)
+
+
+def session_frames():
+    """
+    このセッションで取得したマップのフレーム (meta, topics, data)。未取得なら (None, None, None)。
+    フレーム本体はプロセス共有のストアにあり、セッションはキー（map_key）だけを持つ。
+    ストアから消えていれば（同時に開かれているマップが多すぎた場合など）未取得に戻す。
+    """
+    frames = nomic_module.map_frames(st.session_state.map_key)
+    if frames is None:
+        st.session_state.map_key = None
+        return None, None, None
+    return frames
+
+
+def apply_download_result(result):
+    st.session_state.map_key = result["map_key"]
+    # 実際の列名に合わせて補正したマッピングを Setting に反映
+    (
+        st.session_state.novelty_score,
+        st.session_state.feasibility_score,
+        st.session_state.marketability_score,
+        st.session_state.title,
+        st.session_state.summary,
+        st.session_state.category,
+    ) = result["columns"]
+    st.session_state.schema_report = result["schema_report"]
+    st.session_state.dataset_fields = result["dataset_fields"]
+    st.session_state.data_key = None
+    st.session_state.map_pyramid = None
+    return f"✅ Data fetched successfully from '{st.session_state.nomic_map_url}'"
+
+
+def apply_full_data_result(result):
+    st.session_state.data_key = result["data_key"]
+    return "✅ All fields fetched; Data CSV is ready"
+
+
+def apply_output_result(result):
+    st.session_state.df_master = result["df_master"]
+    st.session_state.xlsx_bytes = None
+    st.session_state.schema_report = result["schema_report"]
+    return f"✅ Data exported to '{st.session_state.output_sheet_name or 'unspecified sheet'}'"
+
+
+@st.fragment(run_every=1.0)
+def job_progress(state_key):
+    """実行中ジョブの進捗表示（この部分だけを1秒ごとに再描画）"""
+    job = job_module.get_runner().get(st.session_state.get(state_key))
+    if job is None:
+        return
+    if job.finished:
+        st.rerun()
+    snap = job.snapshot()
+    st.progress(snap["progress"], text=f"{snap['stage'] or 'queued'}: {snap['message']} ({snap['elapsed']}s)")
+    if st.button("Cancel", key=f"cancel_{state_key}", disabled=job.cancel_requested):
+        job.cancel()
+
+
+def rerun_tab():
+    """タブ（フラグメント）の中の操作なら、そのタブだけを再実行する"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        # アプリ全体の実行中に呼ばれた場合は全体を再実行
+        st.rerun()
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def frame_csv(map_key, name, _df):
+    """ストアのフレームの CSV（マップ・フレームごとに一度だけエンコードする）"""
+    return _df.to_csv(index=False).encode("utf-8-sig")
+
+
+def show_job(state_key):
+    """ジョブの結果メッセージ、または実行中なら進捗を表示"""
+    notice = st.session_state.pop(f"{state_key}_notice", None)
+    if notice:
+        kind, text = notice
+        getattr(st, kind)(text)
+    if st.session_state.get(state_key):
+        job_progress(state_key)
 
 
 # ===================================
@@ -35,6 +164,8 @@ default_state = {
     "nomic_map_url": "",
     "output_sheet_url": "",
     "output_sheet_name": "シート1",
+    "output_idea_sheet_name": "アイデア一覧",
+    "output_crosstab_sheet_name": "カテゴリー×トピック",
     "design_sheet_id": "",
     "design_sheet_name": "",
     "setting_category_col": "",
@@ -43,7 +174,25 @@ default_state = {
     "marketability_score":"marketability_score",
     "title":"title",
     "summary":"summary",
-    "category":"category"
+    "category":"category",
+    "keywords_enabled": True,
+    "dedup_enabled": False,
+    "dedup_threshold": 0.95,
+    "compute_workers": 0,
+    "append_enabled": False,
+    "template_enabled": False,
+    "scoring_model": scoring_module.default_model_dict(),
+    "diff_sheet_name": "差分",
+    "download_job_id": None,
+    "schema_report": None,
+    "dataset_fields": None,
+    "data_key": None,
+    "data_job_id": None,
+    "output_job_id": None,
+    "map_key": None,
+    "map_pyramid": None,
+    "map_view": None,
+    "map_zoom": 0,
 
 }
 
@@ -51,6 +200,14 @@ for key, value in default_state.items():
     if key not in st.session_state:
         st.session_state[key] = value
 
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# バックグラウンドで終わったジョブの結果を、どのタブにいても反映する
+collect_finished_job("download_job_id", apply_download_result)
+collect_finished_job("data_job_id", apply_full_data_result)
+collect_finished_job("output_job_id", apply_output_result)
+
 
 # ===================================
 # ヘッダー
@@ -80,6 +237,9 @@ st.markdown(f"""
 tabs = {
     "nomic": "Nomic",
     "output": "Output",
+    "map": "Map",
+    "search": "Search",
+    "history": "History",
     "setting": "Setting"
 }
 
@@ -94,158 +254,526 @@ with col1:
 
 
 # ===================================
-# メインコンテンツ
+# タブ（フラグメント）
 # ===================================
-with col2:
-    st.markdown("<div class='content'>", unsafe_allow_html=True)
-    page = st.session_state.page
+@st.fragment
+def nomic_tab():
+    """Nomicタブ（操作してもこのタブだけを再実行する）"""
+    st.markdown("<h2>Nomic</h2>", unsafe_allow_html=True)
+    st.session_state.nomic_api_token = st.text_input("API Token", value=st.session_state.nomic_api_token)
+    st.session_state.nomic_domain = st.text_input("Domain", value=st.session_state.nomic_domain)
+    st.session_state.nomic_map_url = st.text_input("Map URL", value=st.session_state.nomic_map_url)
+
+    if st.button("Download data"):
+        # --- Nomicデータ取得（バックグラウンド実行・実行中なら再接続） ---
+        job = job_module.get_runner().submit(
+            job_key("download"),
+            "Download data",
+            job_module.DOWNLOAD_STAGES,
+            job_module.run_download,
+            st.session_state.nomic_api_token,
+            st.session_state.nomic_domain,
+            st.session_state.nomic_map_url,
+            mapped_columns(),
+            scoring_model().extra_fields(),
+        )
+        st.session_state.download_job_id = job.id
+
+    show_job("download_job_id")
+
+    # --- 列マッピングの確認結果 ---
+    report = st.session_state.schema_report
+    if report is not None:
+        if schema_module.has_issues(report):
+            st.warning(f"Column mapping: {schema_module.summarize(report)}")
+        with st.expander("Column mapping", expanded=schema_module.has_issues(report)):
+            st.dataframe(report, use_container_width=True, hide_index=True)
+
+    # --- 共有マップストア（全セッションで1つ。予算を超えた分はディスクに書き出して memory-map） ---
+    store = store_module.get_store()
+    with st.expander("Shared map store"):
+        st.caption(
+            f"Resident {store.resident_bytes() / 1024 / 1024:.1f} MB / budget {store.budget_bytes / 1024 / 1024:.0f} MB"
+        )
+        st.dataframe(store.stats(), use_container_width=True, hide_index=True)
 
-    # ---- Nomicタブ ----
-    if page == "nomic":
-        st.markdown("<h2>Nomic</h2>", unsafe_allow_html=True)
-        st.session_state.nomic_api_token = st.text_input("API Token", value=st.session_state.nomic_api_token)
-        st.session_state.nomic_domain = st.text_input("Domain", value=st.session_state.nomic_domain)
-        st.session_state.nomic_map_url = st.text_input("Map URL", value=st.session_state.nomic_map_url)
+    # --- ダウンロードボタン群 ---
+    df_meta, df_topics, df_data = session_frames()
+    if df_meta is not None:
 
-        if st.button("Download data"):
-            # --- Nomicデータ取得 ---
-            df_meta, df_topics, df_data, err = nomic_module.get_data(
-                st.session_state.nomic_api_token,
-                st.session_state.nomic_domain,
-                st.session_state.nomic_map_url
-            )
+        col1, col2, col3 = st.columns(3)
 
-            if err or df_meta is None:
-                st.error(f"❌ Failed to fetch Nomic data: {err}")
-            else:
-                st.success(f"✅ Data fetched successfully from '{st.session_state.nomic_map_url}'")
-
-                # --- セッションに保存（再ダウンロード対応） ---
-                st.session_state.df_meta = df_meta
-                st.session_state.df_topics = df_topics
-                st.session_state.df_data = df_data
-
-        # --- ダウンロードボタン群 ---
-        if (
-            "df_meta" in st.session_state
-            and st.session_state.df_meta is not None
-            and "df_topics" in st.session_state
-            and st.session_state.df_topics is not None
-            and "df_data" in st.session_state
-            and st.session_state.df_data is not None
-        ):
-
-            col1, col2, col3 = st.columns(3)
-
-            with col1:
-                st.download_button(
-                    label="Meta CSV",
-                    data=st.session_state.df_meta.to_csv(index=False).encode("utf-8-sig"),
-                    file_name="meta.csv",
-                    mime="text/csv",
-                )
+        with col1:
+            st.download_button(
+                label="Meta CSV",
+                data=frame_csv(st.session_state.map_key, "meta", df_meta),
+                file_name="meta.csv",
+                mime="text/csv",
+            )
 
-            with col2:
-                st.download_button(
-                    label="Topics CSV",
-                    data=st.session_state.df_meta.to_csv(index=False).encode("utf-8-sig"),
-                    file_name="topics.csv",
-                    mime="text/csv",
-                )
+        with col2:
+            st.download_button(
+                label="Topics CSV",
+                data=frame_csv(st.session_state.map_key, "topics", df_topics),
+                file_name="topics.csv",
+                mime="text/csv",
+            )
 
-            with col3:
+        with col3:
+            # ダウンロード済みのデータはマッピングした列だけなので、全列はバックグラウンドのジョブで取り直す。
+            # フレームは共有ストア、CSV はそのキーごとのキャッシュにあり、セッションはキーだけを持つ
+            full = nomic_module.map_frames(st.session_state.data_key)
+            if full is None:
+                st.session_state.data_key = None
+                if st.button("Prepare Data CSV (all fields)", disabled=bool(st.session_state.data_job_id)):
+                    job = job_module.get_runner().submit(
+                        job_key("full_data"),
+                        "Prepare Data CSV",
+                        job_module.FULL_DATA_STAGES,
+                        job_module.run_full_data,
+                        st.session_state.nomic_api_token,
+                        st.session_state.nomic_domain,
+                        st.session_state.nomic_map_url,
+                    )
+                    st.session_state.data_job_id = job.id
+                    rerun_tab()
+            else:
                 st.download_button(
                     label="Data CSV",
-                    data=st.session_state.df_meta.to_csv(index=False).encode("utf-8-sig"),
+                    data=frame_csv(st.session_state.data_key, "data", full[2]),
                     file_name="data.csv",
                     mime="text/csv",
                 )
-
-    # ---- Outputタブ ----
-    elif page == "output":
-        st.markdown("<h2>Output</h2>", unsafe_allow_html=True)
-        service_email = "bot82410120@ideaflow-landscape.iam.gserviceaccount.com"
-
-        st.markdown(
-            f"""
-            <div style="padding:12px; border-radius:8px; background:#333; margin-bottom:16px;">
-                <p style="margin-bottom:8px;">
-                    出力を行う前に、以下のメールアドレスをスプレッドシートの共有設定に追加し、<b>編集者権限</b>を付与してください。
-                </p>
-                <div style="display:flex; align-items:center; gap:8px;">
-                    <input type="text" value="{service_email}" id="svcMail" readonly
-                        style="flex:1; padding:6px 10px; border:1px solid #ccc; border-radius:6px; background:white;">
-                </div>
+            show_job("data_job_id")
+
+
+@st.fragment
+def output_tab():
+    """Outputタブ（操作してもこのタブだけを再実行する）"""
+    st.markdown("<h2>Output</h2>", unsafe_allow_html=True)
+    service_email = "bot82410120@ideaflow-landscape.iam.gserviceaccount.com"
+
+    st.markdown(
+        f"""
+        <div style="padding:12px; border-radius:8px; background:#333; margin-bottom:16px;">
+            <p style="margin-bottom:8px;">
+                出力を行う前に、以下のメールアドレスをスプレッドシートの共有設定に追加し、<b>編集者権限</b>を付与してください。
+            </p>
+            <div style="display:flex; align-items:center; gap:8px;">
+                <input type="text" value="{service_email}" id="svcMail" readonly
+                    style="flex:1; padding:6px 10px; border:1px solid #ccc; border-radius:6px; background:white;">
             </div>
-            """,
-            unsafe_allow_html=True,
+        </div>
+        """,
+        unsafe_allow_html=True,
+    )
+    st.session_state.output_sheet_url = st.text_input("Sheet URL", value=st.session_state.output_sheet_url)
+    st.session_state.output_sheet_name = st.text_input("Sheet Name", value=st.session_state.output_sheet_name)
+
+    # Run button
+    if st.button("Run Output"):
+        with open("./design/defalte.json", "r", encoding="utf-8") as f:
+            style_config = json.load(f)
+
+        # --- 取得 → 計算 → シート書き込み（バックグラウンド実行・実行中なら再接続） ---
+        service_account_info = json.loads(st.secrets["google_service_account"]["value"])
+        job = job_module.get_runner().submit(
+            job_key("output"),
+            "Run Output",
+            job_module.OUTPUT_STAGES,
+            job_module.run_output,
+            st.session_state.nomic_api_token,
+            st.session_state.nomic_domain,
+            st.session_state.nomic_map_url,
+            mapped_columns(),
+            st.session_state.output_sheet_url,
+            st.session_state.output_sheet_name,
+            service_account_info,
+            style_config,
+            dedup_threshold=st.session_state.dedup_threshold if st.session_state.dedup_enabled else None,
+            keywords=st.session_state.keywords_enabled,
+            workers=st.session_state.compute_workers or None,
+            model=st.session_state.scoring_model,
+            append=st.session_state.append_enabled,
+            template=st.session_state.template_enabled,
+        )
+        st.session_state.output_job_id = job.id
+
+    show_job("output_job_id")
+
+    # --- ドライラン：送るリクエストと件数・クォータ見積もり（通信なし） ---
+    if st.button("Dry run"):
+        with open("./design/defalte.json", "r", encoding="utf-8") as f:
+            style_config = json.load(f)
+        df_master = st.session_state.get("df_master")
+        df_meta, df_topics, df_data = session_frames()
+        if df_master is None and df_data is not None:
+            df_master = nomic_module.prepare_master_dataframe(
+                df_meta,
+                df_topics,
+                df_data,
+                *mapped_columns(),
+                keywords=st.session_state.keywords_enabled,
+                model=st.session_state.scoring_model,
+            )
+        if df_master is None:
+            st.warning("Download data or run Output first.")
+        else:
+            plan, plan_err = sheet_module.write_sheet(
+                None, st.session_state.output_sheet_name, None, df_master, style_config, dry_run=True,
+                template=st.session_state.template_enabled,
+            )
+            if plan_err:
+                st.error(f"❌ Dry run failed: {plan_err}")
+            else:
+                st.session_state.dry_run_plan = plan
+
+    plan = st.session_state.get("dry_run_plan")
+    if plan:
+        totals = plan["totals"]
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("API calls", totals["http_calls"])
+        c2.metric("Requests", totals["requests"])
+        c3.metric("Payload", f"{totals['payload_bytes'] / 1024:,.0f} KB")
+        c4.metric("Quota minutes", totals["estimated_quota_minutes"])
+        for warning in plan["warnings"]:
+            st.warning(warning)
+        st.dataframe(
+            [{k: v for k, v in step.items() if k != "request_types"} for step in plan["steps"]],
+            hide_index=True, use_container_width=True,
+        )
+        st.download_button(
+            label="Dry run JSON",
+            data=json.dumps(plan, ensure_ascii=False, indent=1).encode("utf-8"),
+            file_name="dry_run.json",
+            mime="application/json",
         )
-        st.session_state.output_sheet_url = st.text_input("Sheet URL", value=st.session_state.output_sheet_url)
-        st.session_state.output_sheet_name = st.text_input("Sheet Name", value=st.session_state.output_sheet_name)
 
-        # Run button
-        if st.button("Run Output"):
-            # --- Nomicデータ取得 ---
-            df_master, err = nomic_module.create_nomic_dataset(
+
+    # --- アイデア単位のエクスポート（チャンク単位で再開可能） ---
+    st.session_state.output_idea_sheet_name = st.text_input(
+        "Idea Sheet Name", value=st.session_state.output_idea_sheet_name
+    )
+    if st.button("Export Ideas"):
+        _, df_topics, df_data = session_frames()
+        if df_data is None:
+            _, df_topics, df_data, err = nomic_module.get_data(
+                st.session_state.nomic_api_token,
+                st.session_state.nomic_domain,
+                st.session_state.nomic_map_url,
+                mapped_columns(),
+                scoring_model().extra_fields(),
+            )
+        else:
+            err = None
+
+        if err or df_data is None:
+            st.error(f"❌ Failed to fetch Nomic data: {err}")
+        else:
+            df_ideas = nomic_module.build_idea_table(df_topics, df_data)
+            progress = st.progress(0.0, text="Exporting ideas...")
+            service_account_info = json.loads(st.secrets["google_service_account"]["value"])
+            sheet_url, sheet_err = sheet_module.export_idea_sheet(
+                st.session_state.output_sheet_url,
+                st.session_state.output_idea_sheet_name,
+                service_account_info,
+                df_ideas,
+                on_progress=lambda done, total: progress.progress(done / total, text=f"Chunk {done}/{total}"),
+            )
+            if sheet_err:
+                st.error(f"❌ Failed to export ideas (rerun to resume): {sheet_err}")
+            else:
+                st.success(f"✅ {len(df_ideas)} ideas exported to '{st.session_state.output_idea_sheet_name}'")
+
+    # --- カテゴリー × トピックのクロス集計（件数・平均スコアのヒートマップ） ---
+    st.session_state.output_crosstab_sheet_name = st.text_input(
+        "Cross-tab Sheet Name", value=st.session_state.output_crosstab_sheet_name
+    )
+    if st.button("Export Cross-tab"):
+        df_meta, df_topics, df_data = session_frames()
+        if df_data is None:
+            df_meta, df_topics, df_data, err = nomic_module.get_data(
                 st.session_state.nomic_api_token,
                 st.session_state.nomic_domain,
                 st.session_state.nomic_map_url,
-                st.session_state.novelty_score,
-                st.session_state.feasibility_score,
-                st.session_state.marketability_score,
-                st.session_state.title,
-                st.session_state.summary,
-                st.session_state.category,
+                mapped_columns(),
+                scoring_model().extra_fields(),
             )
+        else:
+            err = None
 
+        if err or df_data is None:
+            st.error(f"❌ Failed to fetch Nomic data: {err}")
+        else:
             with open("./design/defalte.json", "r", encoding="utf-8") as f:
                 style_config = json.load(f)
+            n, f, m, _, _, c = mapped_columns()
+            df_cross = nomic_module.build_category_crosstab(
+                df_meta, df_topics, df_data, n, f, m, c, model=st.session_state.scoring_model,
+            )
+            service_account_info = json.loads(st.secrets["google_service_account"]["value"])
+            with st.spinner("Exporting cross-tab..."):
+                sheet_url, sheet_err = sheet_module.write_crosstab_sheet(
+                    st.session_state.output_sheet_url,
+                    st.session_state.output_crosstab_sheet_name,
+                    service_account_info,
+                    df_cross,
+                    style_config,
+                )
+            if sheet_err:
+                st.error(f"❌ Failed to export cross-tab: {sheet_err}")
+            else:
+                st.success(
+                    f"✅ Cross-tab ({len(df_cross)} topics × {(len(df_cross.columns) - 4) // 2} categories) "
+                    f"exported to '{st.session_state.output_crosstab_sheet_name}'"
+                )
 
-            if err or df_master is None:
-                st.error(f"❌ Failed to fetch Nomic data: {err}")
+    # --- XLSX ファイルとして出力（サービスアカウント・共有設定は不要） ---
+    if st.session_state.get("df_master") is not None:
+        _, df_topics, df_data = session_frames()
+        include_ideas = st.checkbox(
+            "Include idea sheet in XLSX",
+            value=False,
+            disabled=df_data is None,
+        )
+        if st.button("Build XLSX"):
+            with open("./design/defalte.json", "r", encoding="utf-8") as f:
+                style_config = json.load(f)
+            df_ideas = None
+            if include_ideas:
+                df_ideas = nomic_module.build_idea_table(df_topics, df_data)
+            with st.spinner("Building XLSX..."):
+                xlsx_bytes, xlsx_err = xlsx_module.export_xlsx(
+                    st.session_state.df_master,
+                    style_config,
+                    df_ideas=df_ideas,
+                    master_sheet_name=st.session_state.output_sheet_name or "シート1",
+                    idea_sheet_name=st.session_state.output_idea_sheet_name or "アイデア一覧",
+                )
+            if xlsx_err:
+                st.error(f"❌ Failed to build XLSX: {xlsx_err}")
             else:
-                # --- Google Sheets 書き込み ---
+                st.session_state.xlsx_bytes = xlsx_bytes
+        if st.session_state.get("xlsx_bytes"):
+            st.download_button(
+                label="Download XLSX",
+                data=st.session_state.xlsx_bytes,
+                file_name=f"{nomic_module.extract_map_name(st.session_state.nomic_map_url) or 'nomic_map'}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+
+        # --- データプレビュー ---
+    if "df_master" in st.session_state and st.session_state.df_master is not None:
+        st.dataframe(st.session_state.df_master.head(20))
+
+
+@st.fragment
+def map_tab():
+    """Mapタブ（操作してもこのタブだけを再実行する）"""
+    st.markdown("<h2>Map</h2>", unsafe_allow_html=True)
+    _, df_topics, df_data = session_frames()
+    if df_data is None:
+        st.info("Download data on the Nomic tab first.")
+    else:
+        # --- 2D 投影（密度ピラミッドを一度だけ作り、表示範囲ごとに数千マークだけ描く） ---
+        if st.button("Load map view"):
+            with st.spinner("Fetching 2D projection..."):
+                try:
+                    df_points = nomic_module.fetch_map_points(
+                        st.session_state.nomic_api_token,
+                        st.session_state.nomic_domain,
+                        st.session_state.nomic_map_url,
+                    )
+                    if len(df_points) != len(df_data):
+                        raise ValueError(f"Projection ({len(df_points)} rows) does not match data ({len(df_data)} rows)")
+                    broad = df_data[["row_number"]].merge(
+                        df_topics[["row_number", "topic_depth_1"]].drop_duplicates("row_number"),
+                        on="row_number", how="left",
+                    )["topic_depth_1"].fillna("")
+                    st.session_state.map_pyramid = map_module.build_pyramid(df_points["x"], df_points["y"], broad)
+                    st.session_state.map_view = None
+                except Exception as e:
+                    st.error(f"❌ Failed to load map: {e}")
+
+        pyramid = st.session_state.map_pyramid
+        if pyramid is not None:
+            view = st.session_state.map_view or pyramid.bounds
+            marks, level, n_inside = map_module.query(pyramid, view)
+            st.caption(
+                f"{n_inside:,} ideas in view · {len(marks):,} marks · "
+                + ("individual points" if level is None else f"density level {level} + outliers")
+                + " · drag a box to zoom"
+            )
+            zoom = alt.selection_interval(name="zoom", encodings=["x", "y"])
+            chart = alt.Chart(marks).mark_circle(opacity=0.7).encode(
+                x=alt.X("x:Q", scale=alt.Scale(domain=[view[0], view[1]]), axis=None),
+                y=alt.Y("y:Q", scale=alt.Scale(domain=[view[2], view[3]]), axis=None),
+                size=alt.Size("count:Q", scale=alt.Scale(range=[10, 400]), legend=None),
+                color=alt.Color("topic:N", scale=alt.Scale(scheme="category20"), title="Broad topic"),
+                tooltip=[alt.Tooltip("topic:N", title="Broad topic"), alt.Tooltip("count:Q", title="Ideas")],
+            ).add_params(zoom).properties(height=520)
+            # ズームのたびにキーを変えて、前の選択範囲を持ち越さない
+            event = st.altair_chart(
+                chart, use_container_width=True, on_select="rerun", key=f"map_chart_{st.session_state.map_zoom}"
+            )
+            selected = (event.selection or {}).get("zoom") if event else None
+            if selected and selected.get("x") and selected.get("y"):
+                st.session_state.map_view = (
+                    min(selected["x"]), max(selected["x"]), min(selected["y"]), max(selected["y"])
+                )
+                st.session_state.map_zoom += 1
+                rerun_tab()
+            if st.session_state.map_view is not None and st.button("Reset zoom"):
+                st.session_state.map_view = None
+                st.session_state.map_zoom += 1
+                rerun_tab()
+
+        # --- トピックのツリーマップ（面積 = アイデア数） ---
+        df_counts = st.session_state.get("df_master")
+        if df_counts is None:
+            df_counts = map_module.topic_counts(df_topics)
+        tree = map_module.treemap_frame(df_counts)
+        if not tree.empty:
+            base = alt.Chart(tree).encode(
+                x=alt.X("x:Q", axis=None), x2="x2", y=alt.Y("y:Q", axis=None, scale=alt.Scale(reverse=True)), y2="y2",
+            )
+            rects = base.mark_rect(stroke="white", strokeWidth=1).encode(
+                color=alt.Color("broad:N", scale=alt.Scale(scheme="category20"), legend=None),
+                opacity=alt.condition(alt.datum.depth == "1", alt.value(0.3), alt.value(0.85)),
+                tooltip=[alt.Tooltip("broad:N", title="Broad"), alt.Tooltip("topic:N", title="Topic"),
+                         alt.Tooltip("count:Q", title="アイデア数")],
+            )
+            labels = alt.Chart(tree[tree["depth"] == "2"]).transform_calculate(
+                cx="(datum.x + datum.x2) / 2", cy="(datum.y + datum.y2) / 2"
+            ).mark_text(fontSize=10, color="white", clip=True).encode(
+                x=alt.X("cx:Q", axis=None), y=alt.Y("cy:Q", axis=None, scale=alt.Scale(reverse=True)), text="topic:N",
+            )
+            st.altair_chart((rects + labels).properties(height=420), use_container_width=True)
+
+
+@st.fragment
+def search_tab():
+    """Searchタブ（操作してもこのタブだけを再実行する）"""
+    st.markdown("<h2>Search</h2>", unsafe_allow_html=True)
+    st.caption("Download data on the Nomic tab to build or refresh the index for the map.")
+    query = st.text_input("Search ideas", key="search_query")
+    if query:
+        df_hits = search_module.search(
+            st.session_state.nomic_map_url, query, limit=100, domain=st.session_state.nomic_domain
+        )
+        st.write(f"{len(df_hits)} ideas")
+        st.dataframe(df_hits, hide_index=True)
+
+
+@st.fragment
+def history_tab():
+    """Historyタブ（操作してもこのタブだけを再実行する）"""
+    st.markdown("<h2>History</h2>", unsafe_allow_html=True)
+
+    # --- トピック指標の推移 ---
+    df_maps = history_module.list_maps()
+    if not df_maps.empty:
+        st.markdown("<h3>Trends</h3>", unsafe_allow_html=True)
+        map_id = st.selectbox("Map", df_maps["map_id"].tolist())
+        df_topics_hist = history_module.list_topics(map_id)
+        metrics = history_module.list_metrics(map_id)
+        if not df_topics_hist.empty and metrics:
+            topic_options = list(df_topics_hist.itertuples(index=False, name=None))
+            depth, topic = st.selectbox(
+                "Topic", topic_options, format_func=lambda x: f"{'Broad' if x[0] == '1' else 'Medium'}: {x[1]}"
+            )
+            metric = st.selectbox(
+                "Metric", metrics, index=metrics.index("平均スコア") if "平均スコア" in metrics else 0
+            )
+            last_n = st.number_input("Last runs", min_value=2, max_value=200, value=10)
+            df_trend = history_module.trend(map_id, depth, topic, metric, last_n=last_n)
+            st.line_chart(df_trend, x="created_at", y="value")
+
+    st.markdown("<h3>Compare snapshots</h3>", unsafe_allow_html=True)
+    snapshots = snapshot_module.list_snapshots()
+
+    if len(snapshots) < 2:
+        st.info("Run Output at least twice to compare snapshots.")
+    else:
+        labels = {s["id"]: f"{s['created_at'][:19]}  {s.get('label') or s.get('map_url', '')}" for s in snapshots}
+        ids = [s["id"] for s in snapshots]
+        old_id = st.selectbox("Old snapshot", ids, index=1, format_func=labels.get)
+        new_id = st.selectbox("New snapshot", ids, index=0, format_func=labels.get)
+
+        if st.button("Compare"):
+            st.session_state.snapshot_diff = snapshot_module.diff_snapshots(old_id, new_id)
+
+        if st.session_state.get("snapshot_diff") is not None:
+            df_diff, df_moved = st.session_state.snapshot_diff
+            st.markdown("**Topic changes**")
+            st.dataframe(df_diff[df_diff["状態"] != "unchanged"])
+            if df_moved is not None:
+                st.markdown(f"**Moved ideas** ({len(df_moved)})")
+                st.dataframe(df_moved.head(1000))
+
+            st.session_state.diff_sheet_name = st.text_input(
+                "Diff Sheet Name", value=st.session_state.diff_sheet_name
+            )
+            if st.button("Write diff to sheet"):
                 service_account_info = json.loads(st.secrets["google_service_account"]["value"])
-                sheet_url, sheet_err = sheet_module.write_sheet(
+                _, sheet_err = sheet_module.write_table_sheet(
                     st.session_state.output_sheet_url,
-                    st.session_state.output_sheet_name,
+                    st.session_state.diff_sheet_name,
                     service_account_info,
-                    df_master,
-                    style_config
+                    df_diff,
                 )
-
+                if not sheet_err and df_moved is not None:
+                    _, sheet_err = sheet_module.write_table_sheet(
+                        st.session_state.output_sheet_url,
+                        f"{st.session_state.diff_sheet_name} (moved)",
+                        service_account_info,
+                        df_moved,
+                    )
                 if sheet_err:
                     st.error(f"❌ Failed to export to Google Sheets: {sheet_err}")
                 else:
-                    st.session_state.df_master = df_master
-                    st.success(f"✅ Data exported to '{st.session_state.output_sheet_name or 'unspecified sheet'}'")
-
-
-            # --- データプレビュー ---
-        if "df_master" in st.session_state and st.session_state.df_master is not None:
-            st.dataframe(st.session_state.df_master.head(20))
-
-    elif page == "setting":
-        st.markdown("<h2>Setting</h2>", unsafe_allow_html=True)
-
-        # 各パラメータの選択肢リスト
-        options_title = ['title', 'タイトル', 'その他']
-        options_summary = ['summary', '概要', 'その他']
-        options_category = ['category', 'アイデアカテゴリー', 'その他']
-        options_novelty = ['novelty_score', '新規性スコア', 'novelty_score_', 'その他']
-        options_feasibility = ['feasibility_score', '実現可能性スコア', 'feasibility_score_', 'その他']
-        options_marketability = ['marketability_score', '市場性スコア', 'marketability_score_', 'その他']
-
-        # ---------------------------
-        # 選択値を session_state から復元（初回だけ None）
-        # ---------------------------
-        title_default = st.session_state.get("title", options_title[0])
-        summary_default = st.session_state.get("summary", options_summary[0])
-        category_default = st.session_state.get("category", options_category[0])
-        novelty_default = st.session_state.get("novelty_score", options_novelty[0])
-        feasibility_default = st.session_state.get("feasibility_score", options_feasibility[0])
-        marketability_default = st.session_state.get("marketability_score", options_marketability[0])
-
+                    st.success(f"✅ Diff exported to '{st.session_state.diff_sheet_name}'")
+
+
+@st.fragment
+def setting_tab():
+    """Settingタブ（操作してもこのタブだけを再実行する）"""
+    st.markdown("<h2>Setting</h2>", unsafe_allow_html=True)
+
+    # 各パラメータの選択肢リスト
+    options_title = ['title', 'タイトル', 'その他']
+    options_summary = ['summary', '概要', 'その他']
+    options_category = ['category', 'アイデアカテゴリー', 'その他']
+    options_novelty = ['novelty_score', '新規性スコア', 'novelty_score_', 'その他']
+    options_feasibility = ['feasibility_score', '実現可能性スコア', 'feasibility_score_', 'その他']
+    options_marketability = ['marketability_score', '市場性スコア', 'marketability_score_', 'その他']
+
+    # ダウンロード済みならデータセットのフィールドも選択肢に加える（「その他」の直前）
+    _, _, df_data = session_frames()
+    if st.session_state.get("dataset_fields") or df_data is not None:
+        data_columns = [
+            str(col) for col in (st.session_state.get("dataset_fields") or df_data.columns)
+            if col != "row_number"
+        ]
+        for options in (options_title, options_summary, options_category,
+                        options_novelty, options_feasibility, options_marketability):
+            options[-1:-1] = [col for col in data_columns if col not in options]
+
+    # ---------------------------
+    # 選択値を session_state から復元（初回だけ None）
+    # ---------------------------
+    title_default = st.session_state.get("title", options_title[0])
+    summary_default = st.session_state.get("summary", options_summary[0])
+    category_default = st.session_state.get("category", options_category[0])
+    novelty_default = st.session_state.get("novelty_score", options_novelty[0])
+    feasibility_default = st.session_state.get("feasibility_score", options_feasibility[0])
+    marketability_default = st.session_state.get("marketability_score", options_marketability[0])
+
+    # ---------------------------
+    # 変更は「Apply settings」でまとめて反映する（入力のたびに再実行しない）。
+    # 「その他」の自由入力・類似度のしきい値は、選択を反映したあとに表示される
+    # ---------------------------
+    with st.form("setting_form", border=False):
         # ---------------------------
         # 「その他」を選んだ場合のみ自由入力を表示
         # ---------------------------
@@ -297,11 +825,106 @@ with col2:
             marketability_value = marketability_score_selected
         st.session_state.marketability_score = marketability_value
 
+        # ---------------------------
+        # 採点モデル（基準・重み・しきい値）。role の基準は上のマッピングの列、column の基準はその列を使う
+        # ---------------------------
+        if 'scoring_model_text' not in st.session_state:
+            st.session_state.scoring_model_text = json.dumps(st.session_state.scoring_model, ensure_ascii=False, indent=2)
+        model_text = st.text_area('Scoring model (JSON)', height=300, key='scoring_model_text')
+        model, model_err = scoring_module.parse_model(model_text)
+        if model_err:
+            st.error(f"❌ Scoring model not applied: {model_err}")
+        else:
+            st.session_state.scoring_model = model.to_dict()
+            bound = model.bind(*mapped_columns()[:3])
+            st.dataframe(
+                [
+                    {"基準": cr.label, "列": col, "重み": cr.weight, "しきい値": cr.threshold}
+                    for cr, col in zip(model.criteria, bound)
+                ],
+                hide_index=True, use_container_width=True,
+            )
+            st.caption(f"合計スコア = Σ 重み × スコア / 優秀アイデア: 合計 {model.total_threshold:g} 点以上")
+
+        # ---------------------------
+        # キーワード列にタイトル・概要からの特徴語を追記
+        # ---------------------------
+        st.session_state.keywords_enabled = st.checkbox(
+            'Add distinctive terms to キーワード', value=st.session_state.keywords_enabled
+        )
+
+        # ---------------------------
+        # 近似重複の検出（埋め込みの追加ダウンロードが必要）
+        # ---------------------------
+        st.session_state.dedup_enabled = st.checkbox(
+            'Detect near-duplicate ideas', value=st.session_state.dedup_enabled
+        )
+        if st.session_state.dedup_enabled:
+            st.session_state.dedup_threshold = st.slider(
+                'Duplicate similarity threshold', min_value=0.80, max_value=1.00,
+                value=float(st.session_state.dedup_threshold), step=0.01,
+            )
+
+        # ---------------------------
+        # マスターテーブル計算の並列度（0 = 従来の逐次計算）
+        # ---------------------------
+        st.session_state.compute_workers = int(st.number_input(
+            'Compute worker processes (0 = off)', min_value=0, max_value=os.cpu_count() or 1,
+            value=min(int(st.session_state.compute_workers), os.cpu_count() or 1), step=1,
+        ))
+
+        # ---------------------------
+        # 追記モード：前回の集計状態に、新しく追加されたアイデア（row_number が前回より大きい行）だけを足し込む。
+        # トピックが再クラスタリングされたときは自動で全件から作り直す
+        # ---------------------------
+        st.session_state.append_enabled = st.checkbox(
+            'Incremental append mode (fold only new ideas into saved topic aggregates)',
+            value=st.session_state.append_enabled,
+        )
+
+        # ---------------------------
+        # テンプレート出力：書式を適用した非表示のテンプレートシートを一度だけ作り、出力ごとに複製して値だけを書き込む。
+        # 書き込み先のシートは複製に置き換わる（シートIDが変わる）
+        # ---------------------------
+        st.session_state.template_enabled = st.checkbox(
+            'Template export (clone a pre-styled hidden sheet, then write values only)',
+            value=st.session_state.template_enabled,
+        )
+
+        st.form_submit_button("Apply settings", type="primary")
+
+    if st.button('Reset scoring model'):
+        st.session_state.scoring_model = scoring_module.default_model_dict()
+        st.session_state.pop('scoring_model_text', None)
+        rerun_tab()
+
+
+# ===================================
+# メインコンテンツ
+# ===================================
+pages = {
+    "nomic": nomic_tab,
+    "output": output_tab,
+    "map": map_tab,
+    "search": search_tab,
+    "history": history_tab,
+    "setting": setting_tab,
+}
+
+with col2:
+    st.markdown("<div class='content'>", unsafe_allow_html=True)
+    pages[st.session_state.page]()
+
 # ===================================
 # 外部CSSを読み込む
 # ===================================
-def local_css(file_name):
+@st.cache_resource
+def read_css(file_name):
     with open(file_name, encoding="utf-8") as f:
-        st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        return f.read()
+
+
+def local_css(file_name):
+    st.markdown(f"<style>{read_css(file_name)}</style>", unsafe_allow_html=True)
 
 local_css("style.css")
@@ -0,0 +1,71 @@
+import importlib.metadata
+
+from nomic.dataset import AtlasProjection
+
+
+# ==============================
+# 🔹 nomic の非公開 API の窓口
+# ==============================
+# タイルの再開可能なダウンロードと取得の下準備は、AtlasProjection / AtlasMapData の非公開の属性
+# （_manifest・_manifest_tb・_download_sidecar・_has_unique_id_field）に頼っている。
+# これらに触るのはこのモジュールだけにし、確認済みの版で属性がそろっているときだけ使う。
+# それ以外の版では supported() が False になり、呼び出し側は公開 API だけで取得する
+# （タイルは nomic 自身のダウンロード、取得の並行化はしない）。
+
+# 非公開の属性の使い方を確認した nomic の版（先頭一致）
+TESTED_NOMIC_VERSIONS = ("3.6.",)
+
+_PROJECTION_ATTRS = ("_manifest", "_download_sidecar", "tile_destination")
+
+
+def _nomic_version():
+    try:
+        return importlib.metadata.version("nomic")
+    except importlib.metadata.PackageNotFoundError:
+        return ""
+
+
+NOMIC_VERSION = _nomic_version()
+_SUPPORTED = NOMIC_VERSION.startswith(TESTED_NOMIC_VERSIONS) and all(
+    hasattr(AtlasProjection, name) for name in _PROJECTION_ATTRS
+)
+if not _SUPPORTED:
+    print(f"⚠️ nomic {NOMIC_VERSION or '(unknown)'} is not a tested version; "
+          "using the public API only (no resumable tiles, sequential fetch)")
+
+
+def supported():
+    """非公開の属性を使ってよいか（確認済みの版で、AtlasProjection に属性がそろっている）"""
+    return _SUPPORTED
+
+
+def manifest_keys(projection):
+    """タイル一覧（manifest）のキーのリスト。manifest が無ければダウンロードする"""
+    return projection._manifest["key"].to_pylist()
+
+
+def reset_manifest(projection):
+    """読み込み済みの manifest を忘れさせる（タイルのキャッシュを捨てたあとに呼ぶ。未確認の版では何もしない）"""
+    if _SUPPORTED and hasattr(projection, "_manifest_tb"):
+        projection._manifest_tb = None
+
+
+def install_sidecar_downloader(projection, download):
+    """
+    projection のタイル取得（トピック・データ・埋め込みが使う _download_sidecar）を
+    download(sidecar_name, overwrite=False) に差し替える。戻り値は nomic と同じくタイルのパスのリスト
+    """
+    projection._download_sidecar = download
+
+
+def prime(map_data, topics):
+    """
+    トピックとデータの両方が使う遅延取得（manifest・datum_id）を呼び出し側のスレッドで済ませておく。
+    datum_id が無ければ何もしない（トピック・データ側でそれぞれ合成IDにフォールバックする）。
+    """
+    map_data._manifest
+    if getattr(topics, "_has_unique_id_field", False):
+        try:
+            map_data._download_sidecar("datum_id", overwrite=False)
+        except ValueError:
+            pass
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+# ==============================
+# 🔹 埋め込みベクトルの前処理
+# ==============================
+
+def normalize_embeddings(embeddings) -> np.ndarray:
+    """
+    埋め込みを連続した float32 行列にし、各行を L2 正規化する（1回だけ行う）。
+    以降は内積＝コサイン類似度として扱える。ノルム0の行はそのまま0ベクトル。
+    """
+    emb = np.array(embeddings, dtype=np.float32, order="C", copy=True)
+    norms = np.linalg.norm(emb, axis=1)
+    norms[norms == 0] = 1.0
+    emb /= norms[:, None]
+    return emb
+
+
+# ==============================
+# 🔹 近似重複クラスタの検出
+# ==============================
+
+# 類似度ブロック1枚あたりのメモリ上限（float32 の B×g 行列）
+SIMILARITY_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def _similar_pairs(x: np.ndarray, threshold: float, block_bytes: int):
+    """
+    x（正規化済み g×d）の中で類似度 >= threshold となるペア (i < j) を返す。
+    行ブロックごとに x[b:b+B] @ x[b:].T を計算し、メモリは block_bytes 程度に収める。
+    """
+    g = len(x)
+    rows_per_block = max(1, block_bytes // (4 * max(1, g)))
+    left, right = [], []
+    for start in range(0, g, rows_per_block):
+        stop = min(g, start + rows_per_block)
+        sims = x[start:stop] @ x[start:].T          # (B, g - start)
+        i, j = np.nonzero(sims >= threshold)
+        # 対角（自分自身）とそれより左（i >= j）は除外
+        keep = j > i
+        left.append(i[keep] + start)
+        right.append(j[keep] + start)
+    if not left:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(left), np.concatenate(right)
+
+
+def _connected_labels(n: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """ペアで結ばれた要素に、連結成分内の最小インデックスをラベルとして付ける"""
+    labels = np.arange(n)
+    if len(left) == 0:
+        return labels
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        before = labels.copy()
+        np.minimum.at(labels, left, low)
+        np.minimum.at(labels, right, low)
+        # ポインタジャンプで一気に代表へ寄せる
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+        if np.array_equal(labels, before):
+            return labels
+
+
+def find_duplicate_clusters(
+    embeddings: np.ndarray,
+    groups,
+    *,
+    rows=None,
+    threshold: float = 0.95,
+    block_bytes: int = SIMILARITY_BLOCK_BYTES,
+) -> np.ndarray:
+    """
+    グループ（トピック）ごとに近似重複のクラスタを求める。
+
+    Args:
+        embeddings: normalize_embeddings 済みの (n, d) 行列
+        groups: 長さ m のグループラベル（同じラベル内でのみ比較する）
+        rows: groups の各要素に対応する embeddings の行位置（None なら 0..n-1 で m == n）
+        threshold: コサイン類似度のしきい値
+
+    Returns:
+        長さ m のクラスタラベル（クラスタ内で最小の groups 上の位置）。重複が無い要素は自分の位置。
+    """
+    rows = np.arange(len(embeddings)) if rows is None else np.asarray(rows)
+    m = len(rows)
+    labels = np.arange(m)
+    codes, _ = _factorize(groups)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    for members in np.split(order, bounds):
+        if len(members) < 2:
+            continue
+        # 行列全体は並べ替えず、そのグループの行だけを取り出す（コピーは1グループ分）
+        x = embeddings[rows[members]]
+        left, right = _similar_pairs(x, threshold, block_bytes)
+        local = _connected_labels(len(members), left, right)
+        labels[members] = members[local]
+    return labels
+
+
+def _factorize(values):
+    values = np.asarray(values, dtype=object)
+    uniques, codes = np.unique(values.astype(str), return_inverse=True)
+    return codes, uniques
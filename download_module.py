@@ -0,0 +1,207 @@
+import json
+import os
+import random
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+from pyarrow import ipc
+
+import atlas_module
+
+
+# ==============================
+# 🔹 タイル単位の再開可能なダウンロード
+# ==============================
+# Atlas のデータはタイル（quadtree の1ファイル）ごとに配信される。
+# 1タイルずつリトライ付きでダウンロードし、完了したタイルはローカルに残す。
+# 途中で失敗しても、次の取得では残っているタイルを飛ばして続きから再開する。
+DOWNLOAD_THREADS = 4
+DOWNLOAD_ATTEMPTS = 5
+BACKOFF_BASE = 1.0      # 秒。1回目の再試行までの待ち時間（以降は倍々）
+BACKOFF_MAX = 30.0
+TIMEOUT = (10, 120)     # (接続, 読み込み) 秒
+CHUNK_BYTES = 1 << 20
+
+# 再試行するステータス（それ以外の 4xx は再試行しても無駄なのですぐ失敗にする）
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+_STATE_FILE = "download_state.json"
+
+
+def _is_complete(path):
+    """ローカルのタイルが読める feather として揃っているか"""
+    try:
+        ipc.open_file(path).schema
+        return True
+    except Exception:
+        return False
+
+
+def _backoff(attempt):
+    """attempt 回目の失敗後の待ち時間（指数バックオフ＋ゆらぎ）"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def download_tile(session, url, path, attempts=DOWNLOAD_ATTEMPTS):
+    """
+    1タイルをダウンロードする。一時ファイルに書いてから検証し、揃ったときだけ本来のパスに置き換える
+    （途中で切れても壊れたタイルは残らない）。
+    接続断・タイムアウト・429/5xx・読めない feather は待ってから再試行する。
+    """
+    path = Path(path)
+    part = path.with_name(path.name + ".part")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for attempt in range(1, attempts + 1):
+        try:
+            with session.get(url, stream=True, timeout=TIMEOUT) as res:
+                res.raise_for_status()
+                with open(part, "wb") as fh:
+                    for chunk in res.iter_content(CHUNK_BYTES):
+                        fh.write(chunk)
+            if not _is_complete(part):
+                raise ValueError(f"Incomplete tile received from {url}")
+            os.replace(part, path)
+            return path
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                requests.HTTPError, ValueError) as e:
+            part.unlink(missing_ok=True)
+            retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in _RETRY_STATUS
+            if not retryable or attempt == attempts:
+                raise
+            time.sleep(_backoff(attempt))
+
+
+def _session(projection):
+    session = requests.Session()
+    session.headers.update(projection.dataset.header)
+    return session
+
+
+def _tile_url(projection, name):
+    return (
+        projection.dataset.atlas_api_path
+        + f"/v1/project/{projection.dataset.id}/index/projection/{projection.id}/quadtree/{name}"
+    )
+
+
+def ensure_manifest(projection):
+    """タイル一覧（manifest.feather）をリトライ付きで用意する（すでにあれば何もしない）"""
+    path = projection.tile_destination / "manifest.feather"
+    if not _is_complete(path):
+        with _session(projection) as session:
+            download_tile(session, _tile_url(projection, "manifest.feather"), path)
+    return path
+
+
+def download_sidecar(projection, sidecar_name, overwrite=False):
+    """
+    AtlasProjection._download_sidecar の置き換え（戻り値も同じくタイルのパスのリスト。atlas_module 経由で差し込む）。
+    ローカルに揃っているタイルは飛ばし、残りをスレッドプールでダウンロードする。
+    失敗したタイルがあれば、済んだ件数を添えて RuntimeError（済んだタイルは次回そのまま使う）。
+    """
+    ensure_manifest(projection)
+    suffix = f"{sidecar_name}.feather" if sidecar_name else "feather"
+    paths = [projection.tile_destination / f"{key}.{suffix}" for key in atlas_module.manifest_keys(projection)]
+    pending = [p for p in paths if overwrite or not _is_complete(p)]
+    if not pending:
+        return paths
+
+    label = sidecar_name or "data"
+    errors = []
+    with _session(projection) as session, ThreadPoolExecutor(DOWNLOAD_THREADS) as pool:
+        futures = {
+            pool.submit(download_tile, session, _tile_url(projection, p.relative_to(projection.tile_destination).as_posix()), p): p
+            for p in pending
+        }
+        for future, path in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+
+    done = len(paths) - len(errors)
+    print(f"📦 Tiles '{label}': {len(paths) - len(pending)} cached, {len(pending) - len(errors)} downloaded, {len(errors)} failed")
+    if errors:
+        raise RuntimeError(
+            f"Downloaded {done}/{len(paths)} '{label}' tiles; the rest failed ({errors[0]}). "
+            "Completed tiles are kept locally — run again to resume."
+        )
+    return paths
+
+
+class _TileCache:
+    """1つのタイルディレクトリを使っている取得の数と、その版"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = None
+        self.users = 0
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _check_version(projection, version):
+    """データ件数などの版が前回と違えば、古いタイルを捨てる（tile_cache の中、他に使っている取得が無いときだけ呼ぶ）"""
+    root = Path(projection.tile_destination)
+    state_path = root / _STATE_FILE
+    try:
+        previous = json.loads(state_path.read_text()).get("version")
+    except (OSError, ValueError):
+        previous = None
+    if previous is not None and previous != version:
+        shutil.rmtree(root, ignore_errors=True)
+        atlas_module.reset_manifest(projection)
+    root.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps({"version": version}))
+
+
+@contextmanager
+def tile_cache(projection, version=None):
+    """
+    projection のタイルディレクトリ（~/.nomic/cache/<projection>）を使う間、版を固定する。
+    同じ版の取得（取得列の違うデータ・座標・埋め込み）は同時に使える。
+    違う版の取得は、使っている取得が全部抜けるまで待ってから古いタイルを捨てる
+    （読んでいる最中のタイルを消したり、版の混ざったタイルを読んだりしない）。
+    """
+    root = Path(projection.tile_destination)
+    with _caches_lock:
+        cache = _caches.setdefault(root, _TileCache())
+    with cache.cond:
+        if version is not None:
+            cache.cond.wait_for(lambda: cache.users == 0 or cache.version == version)
+            if cache.users == 0:
+                _check_version(projection, version)
+                cache.version = version
+        cache.users += 1
+    try:
+        yield projection
+    finally:
+        with cache.cond:
+            cache.users -= 1
+            cache.cond.notify_all()
+
+
+@contextmanager
+def resumable(projection, version=None):
+    """
+    projection のタイル取得（トピック・データ・埋め込みが使う _download_sidecar）を
+    リトライ付き・再開可能なものに差し替え、tile_cache の中で使う。version が前回と違えばキャッシュを作り直す。
+    nomic が確認済みの版でなければ（atlas_module.supported）差し替えず、nomic 自身のダウンロードを使う。
+
+        with download_module.resumable(projection, version):
+            frames = get_map_data(projection, fields)
+    """
+    with tile_cache(projection, version):
+        if atlas_module.supported():
+            ensure_manifest(projection)
+            atlas_module.install_sidecar_downloader(
+                projection,
+                lambda sidecar_name, overwrite=False: download_sidecar(projection, sidecar_name, overwrite),
+            )
+        yield projection
@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import nomic_module
+
+
+# ==============================
+# 🔹 マスターテーブルの履歴（SQLite）
+# ==============================
+HISTORY_DB = os.path.join(".cache", "history.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at  TEXT NOT NULL,
+    map_id      TEXT NOT NULL,
+    map_url     TEXT,
+    columns     TEXT,
+    snapshot_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_map ON runs (map_id, run_id);
+
+-- マスターテーブルを縦持ちで保存（1行 = 1トピック × 1列）
+CREATE TABLE IF NOT EXISTS topic_metrics (
+    run_id  INTEGER NOT NULL REFERENCES runs (run_id),
+    map_id  TEXT NOT NULL,
+    depth   TEXT NOT NULL,
+    topic   TEXT NOT NULL,
+    metric  TEXT NOT NULL,
+    value   REAL,
+    text    TEXT
+);
+-- 「トピックXの指標Yの直近N回」をインデックスの範囲走査だけで返す
+CREATE INDEX IF NOT EXISTS idx_metrics_trend ON topic_metrics (map_id, depth, topic, metric, run_id);
+"""
+
+# トピック名として使う列（depth ごと）
+_TOPIC_COLUMN = {"1": "Nomic Topic: Broad", "2": "Nomic Topic: Medium"}
+_KEY_COLUMNS = ["depth", "topic_id", "Nomic Topic: Broad", "Nomic Topic: Medium"]
+
+
+@contextmanager
+def _connect(db_path):
+    """スキーマを用意した接続（ブロックを抜けるとコミットして閉じる）"""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _to_long(df_master):
+    """マスターテーブル → (depth, topic, metric, value, text) の縦持ち"""
+    df = df_master.copy()
+    df["depth"] = df["depth"].astype(str)
+    df["topic"] = ""
+    for depth, col in _TOPIC_COLUMN.items():
+        rows = df["depth"] == depth
+        df.loc[rows, "topic"] = df.loc[rows, col].astype(str)
+
+    metrics = [c for c in df_master.columns if c not in _KEY_COLUMNS]
+    long = df[["depth", "topic"] + metrics].astype({m: str for m in metrics}).melt(
+        id_vars=["depth", "topic"], var_name="metric", value_name="text"
+    )
+    # "12.5%" のような比率も数値として持つ
+    long["value"] = pd.to_numeric(long["text"].str.rstrip("%"), errors="coerce")
+    return long[["depth", "topic", "metric", "value", "text"]]
+
+
+def record_run(df_master, map_url, columns=None, snapshot_id=None, domain=None, db_path=HISTORY_DB):
+    """
+    計算済みのマスターテーブルを実行メタデータとともに追記し、run_id を返す。
+    map_id は "<domain>/<map_name>"（nomic_module.map_key。追記モードの集計状態と同じキー）。
+    """
+    map_id = nomic_module.map_key(domain, map_url)
+    long = _to_long(df_master)
+    with _connect(db_path) as conn:
+        cur = conn.execute(
+            "INSERT INTO runs (created_at, map_id, map_url, columns, snapshot_id) VALUES (?, ?, ?, ?, ?)",
+            (
+                datetime.now(timezone.utc).isoformat(),
+                map_id,
+                map_url,
+                json.dumps(list(columns or []), ensure_ascii=False),
+                snapshot_id,
+            ),
+        )
+        run_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO topic_metrics (run_id, map_id, depth, topic, metric, value, text) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (run_id, map_id, d, t, m, None if pd.isna(v) else float(v), x)
+                for d, t, m, v, x in long.itertuples(index=False, name=None)
+            ),
+        )
+    return run_id
+
+
+# ==============================
+# 🔹 トレンドの問い合わせ
+# ==============================
+
+def list_maps(db_path=HISTORY_DB):
+    """記録のあるマップと実行回数"""
+    with _connect(db_path) as conn:
+        return pd.read_sql_query(
+            "SELECT map_id, COUNT(*) AS runs, MAX(created_at) AS last_run FROM runs GROUP BY map_id ORDER BY last_run DESC",
+            conn,
+        )
+
+
+def list_topics(map_id, db_path=HISTORY_DB):
+    """マップの最新実行に含まれるトピック (depth, topic)"""
+    with _connect(db_path) as conn:
+        return pd.read_sql_query(
+            """
+            SELECT DISTINCT depth, topic FROM topic_metrics
+            WHERE run_id = (SELECT MAX(run_id) FROM runs WHERE map_id = ?)
+            ORDER BY depth, topic
+            """,
+            conn,
+            params=(map_id,),
+        )
+
+
+def list_metrics(map_id, db_path=HISTORY_DB):
+    """マップの最新実行で数値として記録された指標"""
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """
+            SELECT DISTINCT metric FROM topic_metrics
+            WHERE run_id = (SELECT MAX(run_id) FROM runs WHERE map_id = ?) AND value IS NOT NULL
+            """,
+            (map_id,),
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def trend(map_id, depth, topic, metric, last_n=10, db_path=HISTORY_DB):
+    """
+    トピックの指標の推移（古い順）。
+    例: trend(map_id, "1", "Education", "新規性平均スコア", last_n=10)
+    """
+    with _connect(db_path) as conn:
+        df = pd.read_sql_query(
+            """
+            SELECT m.run_id, r.created_at, m.value
+            FROM topic_metrics AS m JOIN runs AS r ON r.run_id = m.run_id
+            WHERE m.map_id = ? AND m.depth = ? AND m.topic = ? AND m.metric = ?
+            ORDER BY m.run_id DESC
+            LIMIT ?
+            """,
+            conn,
+            params=(map_id, str(depth), topic, metric, int(last_n)),
+        )
+    df["created_at"] = pd.to_datetime(df["created_at"])
+    return df.iloc[::-1].reset_index(drop=True)
@@ -0,0 +1,365 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import history_module
+import nomic_module
+import schema_module
+import scoring_module
+import search_module
+import sheet_module
+import snapshot_module
+
+
+# ==============================
+# 🔹 バックグラウンドジョブ
+# ==============================
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされたときに処理を中断するための例外"""
+
+
+class Job:
+    """
+    実行中のパイプライン1件分の状態。
+    ワーカースレッドが update() で進捗を書き込み、スクリプト側は snapshot() で読む。
+    """
+
+    def __init__(self, key, name, stages):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.name = name
+        self.stages = list(stages)
+        self.stage = None
+        self.stage_progress = 0.0
+        self.message = ""
+        self.status = "queued"      # queued / running / done / failed / cancelled
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.stage_times = {}
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._stage_started = None
+
+    # ---- ワーカー側 ----
+    def start_stage(self, stage, message=""):
+        self.check_cancelled()
+        now = time.time()
+        with self._lock:
+            if self.stage is not None:
+                self.stage_times[self.stage] = round(now - self._stage_started, 2)
+            self.stage = stage
+            self.stage_progress = 0.0
+            self.message = message
+            self._stage_started = now
+
+    def update(self, progress=None, message=None):
+        """現在のステージ内の進捗（0〜1）とメッセージを更新"""
+        self.check_cancelled()
+        with self._lock:
+            if progress is not None:
+                self.stage_progress = max(0.0, min(1.0, float(progress)))
+            if message is not None:
+                self.message = message
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    # ---- スクリプト側 ----
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def snapshot(self):
+        """表示用の進捗（全体進捗はステージ数で按分）"""
+        with self._lock:
+            done_stages = self.stages.index(self.stage) if self.stage in self.stages else 0
+            overall = (done_stages + self.stage_progress) / max(1, len(self.stages))
+            if self.status == "done":
+                overall = 1.0
+            return {
+                "id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "stage": self.stage,
+                "stage_progress": self.stage_progress,
+                "progress": overall,
+                "message": self.message,
+                "error": self.error,
+                "elapsed": round((self.finished_at or time.time()) - (self.started_at or time.time()), 1),
+                "stage_times": dict(self.stage_times),
+            }
+
+
+class JobRunner:
+    """
+    プロセス全体で共有するジョブ実行器。
+    同じ key のジョブが実行中なら新しく始めずにそのジョブを返す（再実行時の再接続）。
+    """
+
+    def __init__(self, max_workers=8, keep_finished=200):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._keep_finished = keep_finished
+
+    def submit(self, key, name, stages, fn, *args, **kwargs):
+        """fn(job, *args, **kwargs) をバックグラウンドで実行する"""
+        with self._lock:
+            active_id = self._active.get(key)
+            if active_id and not self._jobs[active_id].finished:
+                return self._jobs[active_id]
+
+            job = Job(key, name, stages)
+            self._jobs[job.id] = job
+            self._active[key] = job.id
+            self._prune()
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, key):
+        """key に対応する最新のジョブ（実行中・終了済みを問わない）"""
+        with self._lock:
+            job_id = self._active.get(key)
+            return self._jobs.get(job_id) if job_id else None
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            if job.cancel_requested:
+                job.status = "cancelled"
+            else:
+                job.error = str(e)
+                job.status = "failed"
+                traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
+            if job.stage is not None and job._stage_started is not None:
+                job.stage_times[job.stage] = round(job.finished_at - job._stage_started, 2)
+
+    def _prune(self):
+        """終了済みジョブを古い順に捨てる（実行中のものは残す）"""
+        finished = [j for j in self._jobs.values() if j.finished]
+        overflow = len(finished) - self._keep_finished
+        if overflow <= 0:
+            return
+        finished.sort(key=lambda j: j.finished_at or 0)
+        for j in finished[:overflow]:
+            self._jobs.pop(j.id, None)
+            if self._active.get(j.key) == j.id:
+                self._active.pop(j.key, None)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> JobRunner:
+    """プロセス共有の JobRunner（Streamlit の再実行をまたいで同じものを返す）"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
+
+
+# ==============================
+# 🔹 パイプライン
+# ==============================
+
+DOWNLOAD_STAGES = ["fetch", "schema", "index"]
+FULL_DATA_STAGES = ["fetch"]
+OUTPUT_STAGES = ["fetch", "compute", "write"]
+
+
+def run_download(job, token, domain, map_url, columns, extra_fields=()):
+    """
+    Nomic からデータを取得し、列マッピングを確認して検索インデックスを更新する（Download data ボタン）。
+    結果の columns は実際の列名に合わせて補正したマッピング。extra_fields は採点モデルが使う追加の列。
+    """
+    job.start_stage("fetch", "Fetching Nomic data...")
+    # ログインとデータセットの取得は1回だけ（フィールド一覧とフレームの取得で使い回す）
+    opened = nomic_module.open_map(token, domain, map_url)
+    dataset_fields = nomic_module.get_dataset_fields(token, domain, map_url, opened=opened)
+    # マッピングした列だけを取得する（全列は Data CSV を作るときだけ）。
+    # フレームはプロセス共有のストアに置き、セッションにはそのキーだけを持たせる
+    map_key = nomic_module.fetch_map_handle(token, domain, map_url, columns, extra_fields, opened=opened)
+    frames = nomic_module.map_frames(map_key)
+    if frames is None:
+        raise RuntimeError("Failed to fetch Nomic data: map was evicted from the shared store")
+    df_meta, df_topics, df_data = frames
+    job.update(1.0, f"Fetched {len(df_data)} rows × {len(df_data.columns)} of {len(dataset_fields)} fields "
+                    f"[{nomic_module.format_timings(nomic_module.last_fetch_timings(map_url))}]")
+
+    job.start_stage("schema", "Checking column mapping...")
+    columns, schema_report = schema_module.resolve_columns(df_data, columns, available=dataset_fields)
+    n, f, m, t, s, c = columns
+    scores = schema_module.score_matrix(df_data, n, f, m)
+    job.update(1.0, schema_module.summarize(schema_report))
+
+    job.start_stage("index", "Updating search index...")
+    added, removed = search_module.update_index(
+        map_url, df_topics, schema_module.typed_frame(df_data, scores), t, s, c, n, f, m, domain=domain
+    )
+    job.update(1.0, f"Search index: +{added} / -{removed}")
+    return {
+        "map_key": map_key,
+        "columns": columns, "schema_report": schema_report, "dataset_fields": dataset_fields,
+    }
+
+
+def run_full_data(job, token, domain, map_url):
+    """
+    全フィールドのデータを取得する（Data CSV 用）。フレームは Download と同じくプロセス共有のストアに置き、
+    同じマップ・版なら全セッションで1つを共有する。結果はそのキーだけ（CSV はキーごとに一度だけ作る）。
+    """
+    job.start_stage("fetch", "Fetching all fields...")
+    handle = nomic_module.fetch_map_handle(token, domain, map_url)
+    frames = nomic_module.map_frames(handle)
+    if frames is None:
+        raise RuntimeError("Failed to fetch Nomic data: map was evicted from the shared store")
+    job.update(1.0, f"Fetched {len(frames[2])} rows × {len(frames[2].columns)} fields")
+    return {"data_key": handle}
+
+
+# Run Output のうちデータに依存しない段（シートの準備・埋め込みの取得）を並行に進める小さな実行器の大きさ
+PIPELINE_WORKERS = 3
+
+
+def _timed(fn, *args, **kwargs):
+    """(結果, 経過秒)"""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - started
+
+
+def _stage_result(future, label):
+    """並行して進めた段の結果（失敗していれば何の段かを添えて RuntimeError）"""
+    try:
+        return future.result()
+    except Exception as e:
+        raise RuntimeError(f"{label}: {e}") from e
+
+
+def _discard_snapshot(saved):
+    """書き込みに失敗したときに、並行して保存したスナップショットを消す（まだ始まっていなければ取り消す）"""
+    if saved.cancel():
+        return
+    try:
+        snapshot_module.delete_snapshot(saved.result())
+    except Exception:
+        pass
+
+
+def run_output(job, token, domain, map_url, columns, spreadsheet_url, sheet_name,
+               service_account_info, style_config, dedup_threshold=None, keywords=False, workers=None,
+               model=None, append=False, template=False):
+    """
+    取得 → マスターデータ計算 → シート書き込み（Run Output ボタン）。model は採点モデルの定義。
+    append=True なら前回の集計状態に新しい行だけを足し込む（nomic_module.append_master_dataframe）。
+    template=True なら書式済みのテンプレートワークシートを複製して値だけを書き込む（sheet_module.template_steps）。
+
+    データに依存しない段は小さな実行器で並行に進める：
+      シートの準備（認証・ワークシートを開く・書式手順の組み立て。シートはまだ変えない）と埋め込みの取得は
+      Nomic の取得・計算と同時に、スナップショットの保存はシートの書き込みと同時に行う。
+    履歴は書き込みが成功してから記録し、書き込みが失敗・キャンセルされたらスナップショットも消す。
+    """
+    model = scoring_module.get_model(model)
+    pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="output")
+    try:
+        prepared = pool.submit(
+            _timed, sheet_module.prepare_sheet, spreadsheet_url, sheet_name, service_account_info, style_config,
+            template=template,
+        )
+        embeddings = None
+        if dedup_threshold is not None:
+            embeddings = pool.submit(nomic_module.fetch_map_embeddings, token, domain, map_url)
+
+        job.start_stage("fetch", "Fetching Nomic data (preparing sheet in parallel)...")
+        df_meta, df_topics, df_data, err = nomic_module.get_data(
+            token, domain, map_url, columns, model.extra_fields()
+        )
+        if err or df_meta is None:
+            raise RuntimeError(f"Failed to fetch Nomic data: {err}")
+        # シートを開けないなら計算する前に止める
+        if prepared.done():
+            _stage_result(prepared, "Failed to open Google Sheet")
+        columns, schema_report = schema_module.resolve_columns(df_data, columns)
+        n, f, m, t, s, c = columns
+        job.update(0.3, schema_module.summarize(schema_report))
+        if embeddings is not None:
+            job.update(0.5, "Fetching embeddings...")
+            embeddings = _stage_result(embeddings, "Failed to fetch embeddings")
+
+        job.start_stage("compute", "Computing master table...")
+        if append:
+            df_master, info = nomic_module.append_master_dataframe(
+                df_meta, df_topics, df_data, n, f, m, t, s, c, nomic_module.map_key(domain, map_url),
+                embeddings=embeddings, dedup_threshold=dedup_threshold, keywords=keywords, workers=workers,
+                model=model,
+            )
+            job.update(1.0, f"{info['mode'].capitalize()}: {info['new_rows']} new row(s)"
+                            + (f" ({info['reason']})" if info["reason"] else ""))
+        else:
+            df_master = nomic_module.prepare_master_dataframe(
+                df_meta, df_topics, df_data, n, f, m, t, s, c,
+                embeddings=embeddings, dedup_threshold=dedup_threshold, keywords=keywords, workers=workers,
+                model=model,
+            )
+
+        saved = pool.submit(
+            snapshot_module.save_snapshot, df_master, df_topics, map_url=map_url,
+            meta={"columns": list(columns), "scoring_model": model.to_dict()},
+        )
+
+        job.start_stage("write", "Writing to Google Sheets...")
+        try:
+            waited = time.time()
+            prepared, prepare_seconds = _stage_result(prepared, "Failed to open Google Sheet")
+            waited = time.time() - waited
+            job.update(0.0, f"Sheet prepared in {prepare_seconds:.1f}s ({waited:.1f}s waited after compute)")
+            sheet_url, sheet_err = sheet_module.write_sheet(
+                spreadsheet_url, sheet_name, service_account_info, df_master, style_config,
+                on_step=lambda done, total: job.update(done / total), prepared=prepared,
+            )
+            if sheet_err is not None:
+                raise RuntimeError(f"Failed to export to Google Sheets: {sheet_err}")
+        except BaseException:
+            _discard_snapshot(saved)
+            raise
+        snapshot_id = _stage_result(saved, "Failed to save snapshot")
+        history_module.record_run(df_master, map_url, columns, snapshot_id, domain=domain)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return {
+        "df_master": df_master, "sheet_url": sheet_url, "snapshot_id": snapshot_id,
+        "schema_report": schema_report,
+    }
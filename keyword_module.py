@@ -0,0 +1,119 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+# ==============================
+# 🔹 トークナイズ（日本語対応）
+# ==============================
+
+# 文書の区切り（レコード区切り文字。NFKC 正規化でも変化しない）
+_DOC_SEP = "\x1e"
+
+# 英数字は単語、カタカナは連続部分をそのまま、漢字は重なりのある2文字（bigram）。
+# ひらがなは助詞・活用語尾が大半なので対象外。
+_TOKEN_RE = re.compile(
+    r"(\x1e|[a-z][a-z0-9\-]+|[ァ-ヴー]{2,})"
+    r"|(?=([一-龯々]{2}))"
+)
+
+_STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have in into is it its of on or that the their this to was were
+will with we our you your can more new based using use used such than also which these those other
+""".split())
+
+
+def tokenize_corpus(texts):
+    """
+    テキスト列をまとめてトークナイズし、単語IDに変換する。
+    全文を区切り文字で連結して正規表現を1回だけ走らせ、各トークンの文書番号を区切りの累積数から求める。
+
+    欠損（None / NaN / pd.NA）は空の文書として扱う（"nan" や "<NA>" を単語にしない）。
+
+    Returns:
+        (doc_ids, term_ids, vocab) … doc_ids と term_ids は同じ長さ
+    """
+    texts = pd.Series(texts, dtype=object).fillna("")
+    joined = _DOC_SEP.join(str(t).replace(_DOC_SEP, " ") for t in texts)
+    joined = unicodedata.normalize("NFKC", joined).lower()
+    found = _TOKEN_RE.findall(joined)
+
+    vocab_index = {_DOC_SEP: 0}
+    get = vocab_index.setdefault
+    ids = np.fromiter((get(a or b, len(vocab_index)) for a, b in found), dtype=np.int64, count=len(found))
+    vocab = np.array(list(vocab_index), dtype=object)
+
+    # 区切り（ID 0）で文書番号を進め、区切りとストップワードを落とす
+    doc_ids = np.cumsum(ids == 0)
+    dropped = np.fromiter((w in _STOP_WORDS for w in vocab), dtype=bool, count=len(vocab))
+    dropped[0] = True
+    keep = ~dropped[ids]
+    return doc_ids[keep], ids[keep], vocab
+
+
+# ==============================
+# 🔹 疎な単語行列と特徴語
+# ==============================
+
+def build_term_matrix(texts):
+    """
+    文書×単語の疎行列を COO 形式（doc, term）で作る。同じ文書内の重複は1回と数える。
+
+    Returns:
+        (docs, terms, vocab)
+    """
+    doc_ids, term_ids, vocab = tokenize_corpus(texts)
+    n_terms = len(vocab)
+    key = np.unique(doc_ids * n_terms + term_ids)
+    return key // n_terms, key % n_terms, vocab
+
+
+def distinctive_terms(docs, terms, vocab, doc_groups, *, top_k=8, min_df=2):
+    """
+    グループ（トピック）ごとの特徴語を、全体と比べたグループ内の出現比率の偏りで求める。
+    グループ×単語の件数は、(group, term) キーの np.unique による疎な集計で作る（トピックごとのループなし）。
+
+    Args:
+        docs, terms, vocab: build_term_matrix の結果
+        doc_groups: 文書ごとのグループラベル（欠損は対象外）
+        top_k: グループあたりの語数
+        min_df: これ未満の文書にしか出ない語は除外
+
+    Returns:
+        {グループラベル: [語, ...]}
+    """
+    group_codes, groups = pd.factorize(pd.Series(doc_groups), use_na_sentinel=True)
+    if len(docs) == 0 or len(groups) == 0:
+        return {}
+
+    g = group_codes[docs]
+    valid = g >= 0
+    g, t = g[valid], terms[valid]
+
+    n_terms = len(vocab)
+    key, counts = np.unique(g.astype(np.int64) * n_terms + t, return_counts=True)
+    cell_group, cell_term = key // n_terms, key % n_terms
+
+    # 単語ごとの全体件数・グループごとの総件数
+    term_total = np.bincount(cell_term, weights=counts, minlength=n_terms)
+    group_total = np.bincount(cell_group, weights=counts, minlength=len(groups))
+
+    # グループ内比率 × log(グループ内比率 / 全体比率)：どのトピックにも出る語は 0 に近づく
+    tf = counts / group_total[cell_group]
+    base = term_total[cell_term] / group_total.sum()
+    score = tf * np.log(tf / base)
+    score[(counts < min_df) | (score <= 0)] = -np.inf
+
+    # グループ昇順・スコア降順に並べ、各グループの先頭 top_k を取る
+    order = np.lexsort((-score, cell_group))
+    cell_group, cell_term, score = cell_group[order], cell_term[order], score[order]
+    starts = np.searchsorted(cell_group, np.arange(len(groups)))
+    rank = np.arange(len(cell_group)) - starts[cell_group]
+    pick = (rank < top_k) & np.isfinite(score)
+
+    result = {label: [] for label in groups}
+    for grp, term in zip(cell_group[pick], cell_term[pick]):
+        result[groups[grp]].append(vocab[term])
+    return result
@@ -0,0 +1,469 @@
+"""
+app.py の負荷試験。Streamlit の AppTest でセッションを同時にいくつも動かし、
+1つのアプリのインスタンスで何人のアナリストをさばけるかを見る。
+
+Nomic と Google Sheets は通信しない偽物に差し替える（遅延は引数で指定）：
+  Nomic  … ログイン・データセット取得に --nomic-latency 秒、マップのダウンロードに --download-seconds 秒かかり、
+            --rows 行の合成マップを返す
+  Sheets … ワークシートを開く・API 呼び出し1回ごとに --sheets-latency 秒かかり、リクエストは記録するだけ
+
+各セッションは Nomic（Download data）→ Output（Run Output）→ Setting（Apply settings）を順に操作する。
+セッション数ごとに、操作（スクリプトの再実行1回）の p50 / p95 レイテンシ・スループット・
+セッションあたりのメモリを表にする。
+
+実行のしかたは2通り：
+  既定（1プロセス）… 全セッションが1つのアプリのインスタンス（共有ストア・相乗り・ジョブの実行器）を使う。
+      AppTest はスクリプトの実行を同時に1つしか動かせないので、操作は1つずつ順に流れる。
+      レイテンシは他のセッションとの競合を含まない（serialized_*、待ち時間は queue_p95_ms）。
+      メモリはプロセス全体の増減をセッション数で割った目安（approx_*、GC 次第で負にもなる）。
+  --processes … セッションごとに別プロセス（別の AppTest ランタイム）で同時に動かす。
+      レイテンシは CPU を取り合った状態の値、メモリはセッションを終えた時点の各プロセスの常駐メモリ
+      （アプリ1つ＋セッション1つ分。セッションだけの増分は state_per_session_mb）。
+      ストア・相乗りはプロセスごとなので、--maps で同じマップを開いても共有はしない。
+
+使い方:
+    python loadtest.py --sessions 1 2 4 8 --rows 20000
+    python loadtest.py --sessions 4 16 --maps 1 --csv loadtest.csv   # 全員が同じマップを開く
+    python loadtest.py --sessions 1 2 4 8 --processes                # 同時に動かしたときのレイテンシ・メモリ
+"""
+import argparse
+import contextlib
+import gc
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+import download_module
+import nomic_module
+import sheet_module
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+# app.py が作業ディレクトリから読むファイル（作業ディレクトリは一時ディレクトリにする）
+APP_FILES = ("design", "style.css")
+# st.secrets["google_service_account"] に入れる偽のサービスアカウント（偽の Sheets では使わない）
+FAKE_SERVICE_ACCOUNT = {"type": "service_account", "client_email": "loadtest@example.com"}
+
+# AppTest は実行のたびに Streamlit のランタイム・st.secrets をプロセス全体で差し替えるので、
+# 1プロセスの中ではスクリプトの実行を同時に1つずつにする（バックグラウンドのジョブは同時に動く）。
+# 待たされた時間は操作のレイテンシに含めず、queue として別に数える（--processes では待ちは生じない）
+_run_lock = threading.Lock()
+
+
+# ==============================
+# 🔹 合成マップ
+# ==============================
+
+def synthetic_map(rows, seed=0, broad=8, medium_per_broad=4):
+    """
+    Nomic のマップと同じ形の (meta, topics, data)。
+    トピックは Broad × Medium の2段、スコアは 1〜5 の実数、カテゴリーは数種類。
+    """
+    rng = np.random.default_rng(seed)
+    d1 = rng.integers(0, broad, rows)
+    d2 = d1 * medium_per_broad + rng.integers(0, medium_per_broad, rows)
+
+    meta_rows = []
+    for b in range(broad):
+        meta_rows.append({"depth": 1, "topic_id": len(meta_rows), "topic_depth_1": f"Broad {b}",
+                          "topic_depth_2": None, "topic_description": f"Broad topic {b}"})
+        for k in range(medium_per_broad):
+            meta_rows.append({"depth": 2, "topic_id": len(meta_rows), "topic_depth_1": f"Broad {b}",
+                              "topic_depth_2": f"Medium {b * medium_per_broad + k}",
+                              "topic_description": f"Medium topic {b * medium_per_broad + k}"})
+
+    row_number = np.arange(rows)
+    topics = pd.DataFrame({
+        "row_number": row_number,
+        "topic_depth_1": [f"Broad {x}" for x in d1],
+        "topic_depth_2": [f"Medium {x}" for x in d2],
+    })
+    data = pd.DataFrame({
+        "row_number": rng.permutation(row_number),
+        "title": [f"Idea {i}" for i in range(rows)],
+        "summary": [f"Summary of idea {i} about topic {x}" for i, x in enumerate(d2)],
+        "category": rng.choice(["Product", "Service", "Process", "Business model"], rows),
+        "novelty_score": rng.uniform(1, 5, rows).round(1),
+        "feasibility_score": rng.uniform(1, 5, rows).round(1),
+        "marketability_score": rng.uniform(1, 5, rows).round(1),
+    })
+    return pd.DataFrame(meta_rows), topics, data
+
+
+# ==============================
+# 🔹 Nomic・Sheets の偽物
+# ==============================
+
+class FakeDataset:
+    def __init__(self, fields):
+        self.dataset_fields = list(fields)
+
+
+class FakeProjection:
+    """_open_projection が返す projection の代わり（get_map_data の偽物が map_id と行数を読む）"""
+
+    def __init__(self, map_id, rows):
+        self.id = f"projection-{map_id}"
+        self.map_id = map_id
+        self.rows = rows
+        self.dataset = FakeDataset(["row_number", "title", "summary", "category",
+                                    "novelty_score", "feasibility_score", "marketability_score"])
+
+
+class LatencyRecorder(sheet_module.DryRunRecorder):
+    """Sheets API の呼び出し1回ごとに latency 秒待ってから記録する"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def record(self, method, body, kwargs=None):
+        time.sleep(self.latency)
+        super().record(method, body, kwargs)
+
+
+def install_fakes(rows, nomic_latency, download_seconds, sheets_latency):
+    """
+    nomic_module / download_module / sheet_module の通信部分を偽物に差し替える。
+    AppTest はアプリを同じプロセスで動かすので、ジョブのスレッドからもこの偽物が使われる。
+    取得の相乗り（single_flight）・共有ストア・ジョブの実行器・シートの書式手順は本物のまま通る。
+    """
+    def open_projection(token, domain, map_url):
+        time.sleep(nomic_latency)
+        map_id = nomic_module.extract_map_name(map_url)
+        projection = FakeProjection(map_id, rows)
+        return projection, (domain, map_id, projection.id, rows)
+
+    def get_map_data(projection, fields=None, timings=None):
+        started = time.perf_counter()
+        time.sleep(download_seconds)
+        df_meta, df_topics, df_data = synthetic_map(projection.rows, seed=zlib.crc32(projection.map_id.encode()))
+        if fields is not None:
+            df_data = df_data[[col for col in df_data.columns if col in fields]]
+        if timings is not None:
+            timings["data"] = timings["wall"] = time.perf_counter() - started
+        return df_meta, df_topics, df_data
+
+    def open_worksheet(spreadsheet_url, sheet_name, service_account_info, rows=100, cols=26):
+        time.sleep(sheets_latency)
+        worksheet = sheet_module.DryRunWorksheet(sheet_name, rows, cols)
+        worksheet.spreadsheet.recorder = LatencyRecorder(sheets_latency)
+        return worksheet
+
+    nomic_module._open_projection = open_projection
+    nomic_module.get_map_data = get_map_data
+    download_module.resumable = lambda projection, version=None: contextlib.nullcontext(projection)
+    sheet_module.open_worksheet = open_worksheet
+
+
+# ==============================
+# 🔹 1セッションのシナリオ
+# ==============================
+
+class SessionResult:
+    """
+    1セッション分の計測結果。
+    latencies: [(操作名, 秒)]（スクリプトの再実行1回ごと）
+    waits: スクリプトの実行を他のセッションに待たされた秒数（操作ごと）
+    jobs: {ジョブ名: クリックから結果の反映までの秒数}
+    started / finished: セッションの開始・終了時刻（time.time()、--processes の経過時間に使う）
+    rss_bytes: --processes のとき、セッションを終えた時点（AppTest は生きたまま）のそのプロセスの常駐メモリ
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.latencies = []
+        self.waits = []
+        self.jobs = {}
+        self.errors = []
+        self.flows = 0
+        self.state_bytes = 0
+        self.started = self.finished = None
+        self.rss_bytes = None
+        self.app = None
+
+
+def _widget(elements, label):
+    return next(w for w in elements if w.label == label)
+
+
+def _state_bytes(at):
+    """セッションステートの大きさ（DataFrame は中身まで数える。共有ストアのマップはキーだけ）"""
+    total = 0
+    for value in at.session_state.filtered_state.values():
+        if isinstance(value, pd.DataFrame):
+            total += int(value.memory_usage(deep=True).sum())
+        elif isinstance(value, (bytes, bytearray)):
+            total += len(value)
+        else:
+            total += sys.getsizeof(value)
+    return total
+
+
+def run_session(index, map_url, args):
+    """Nomic → Output → Setting を1回操作する。例外は errors に残して途中で止める"""
+    result = SessionResult(index)
+    result.started = time.time()
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets["google_service_account"] = {"value": json.dumps(FAKE_SERVICE_ACCOUNT)}
+    result.app = at
+
+    def timed(label, action):
+        queued = time.perf_counter()
+        with _run_lock:
+            started = time.perf_counter()
+            action()
+            finished = time.perf_counter()
+        result.latencies.append((label, finished - started))
+        result.waits.append(started - queued)
+        if at.exception:
+            raise RuntimeError(f"{label}: {at.exception[0].value}")
+
+    def wait_job(name, state_key, clicked):
+        # 進捗のフラグメント（1秒ごとの再描画）の代わりに、poll 秒ごとにスクリプトを再実行する
+        deadline = clicked + args.job_timeout
+        while at.session_state[state_key] is not None:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"{name} did not finish within {args.job_timeout}s")
+            time.sleep(args.poll)
+            timed("poll", at.run)
+        result.jobs[name] = time.perf_counter() - clicked
+        if at.error:
+            raise RuntimeError(f"{name}: {at.error[0].value}")
+
+    try:
+        timed("load", at.run)
+
+        # --- Nomic：マップの取得 ---
+        _widget(at.text_input, "API Token").set_value("loadtest-token")
+        _widget(at.text_input, "Map URL").set_value(map_url)
+        clicked = time.perf_counter()
+        timed("download", _widget(at.button, "Download data").click().run)
+        wait_job("download", "download_job_id", clicked)
+
+        # --- Output：マスターテーブルの計算とシートへの書き込み ---
+        timed("tab", at.button(key="tab_output").click().run)
+        _widget(at.text_input, "Sheet URL").set_value("https://docs.google.com/spreadsheets/d/loadtest/edit")
+        clicked = time.perf_counter()
+        timed("run_output", _widget(at.button, "Run Output").click().run)
+        wait_job("output", "output_job_id", clicked)
+
+        # --- Setting：設定の変更をまとめて反映 ---
+        timed("tab", at.button(key="tab_setting").click().run)
+        _widget(at.checkbox, "Add distinctive terms to キーワード").uncheck()
+        timed("apply_settings", _widget(at.button, "Apply settings").click().run)
+
+        result.flows = 1
+    except Exception as e:
+        result.errors.append(f"session {index}: {e}")
+    result.finished = time.time()
+    result.state_bytes = _state_bytes(at)
+    return result
+
+
+# ==============================
+# 🔹 セッション数ごとの計測
+# ==============================
+
+def _rss_bytes():
+    """プロセスの常駐メモリ（Linux 以外は最大常駐メモリで代用）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_threads(sessions, args):
+    """既定：sessions 個のセッションを1プロセスのスレッドで動かす → (結果, 経過秒, プロセスの常駐メモリの増減)"""
+    gc.collect()
+    rss_before = _rss_bytes()
+    results = [None] * sessions
+    maps = args.maps or sessions
+
+    def worker(i):
+        map_url = f"https://atlas.nomic.ai/data/loadtest/s{sessions}-map{i % maps}/map"
+        results[i] = run_session(i, map_url, args)
+
+    started = time.perf_counter()
+    threads = []
+    for i in range(sessions):
+        thread = threading.Thread(target=worker, args=(i,), name=f"session-{i}")
+        thread.start()
+        threads.append(thread)
+        time.sleep(args.ramp)
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    # セッション（AppTest）がまだ生きているうちに測る
+    rss_after = _rss_bytes()
+    return results, wall, rss_after - rss_before
+
+
+def _process_session(index, map_url, args, workdir, barrier):
+    """
+    --processes の子プロセス：偽物を入れてウォームアップしたあと、全員そろってから1セッションを動かす。
+    セッションを終えた時点のプロセスの常駐メモリ（アプリ1つ＋セッション1つ分）を rss_bytes に入れて返す。
+    """
+    install_fakes(args.rows, args.nomic_latency, args.download_seconds, args.sheets_latency)
+    os.chdir(workdir)
+    warmup = run_session(-1, f"https://atlas.nomic.ai/data/loadtest/warmup-{index}/map", args)
+    del warmup
+    gc.collect()
+    barrier.wait()
+    time.sleep(index * args.ramp)
+    result = run_session(index, map_url, args)
+    result.rss_bytes = _rss_bytes()
+    result.app = None  # AppTest は親プロセスに送れない
+    return result
+
+
+def _run_processes(sessions, args, workdir):
+    """--processes：セッションごとに別プロセスで同時に動かす → (結果, 経過秒)"""
+    maps = args.maps or sessions
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, \
+            ProcessPoolExecutor(max_workers=sessions, mp_context=context) as pool:
+        barrier = manager.Barrier(sessions)
+        futures = [
+            pool.submit(_process_session, i, f"https://atlas.nomic.ai/data/loadtest/s{sessions}-map{i % maps}/map",
+                        args, workdir, barrier)
+            for i in range(sessions)
+        ]
+        results = [future.result() for future in futures]
+    wall = max(r.finished for r in results) - min(r.started for r in results)
+    return results, wall
+
+
+def run_level(sessions, args, workdir):
+    """sessions 個のセッションを同時に動かして1行分の集計を返す（マップは毎回取得し直す）"""
+    if args.processes:
+        results, wall = _run_processes(sessions, args, workdir)
+    else:
+        results, wall, rss_delta = _run_threads(sessions, args)
+
+    latencies = np.array([seconds for r in results for _, seconds in r.latencies]) * 1000
+    interactive = np.array([
+        seconds for r in results for label, seconds in r.latencies if label != "poll"
+    ]) * 1000
+    waits = np.array([seconds for r in results for seconds in r.waits]) * 1000
+    downloads = [r.jobs["download"] for r in results if "download" in r.jobs]
+    outputs = [r.jobs["output"] for r in results if "output" in r.jobs]
+    flows = sum(r.flows for r in results)
+    errors = [e for r in results for e in r.errors]
+    for error in errors:
+        print(f"❌ {error}")
+
+    def pct(values, q):
+        return round(float(np.percentile(values, q)), 1) if len(values) else None
+
+    # 1プロセスでは操作が1つずつ流れるので、レイテンシは競合を含まない値として列名で区別する
+    prefix = "" if args.processes else "serialized_"
+    row = {
+        "sessions": sessions,
+        "mode": "processes" if args.processes else "serialized",
+        "wall_s": round(wall, 1),
+        "interactions": int(len(latencies)),
+        f"{prefix}p50_ms": pct(latencies, 50),
+        f"{prefix}p95_ms": pct(latencies, 95),
+        f"{prefix}click_p95_ms": pct(interactive, 95),
+        "queue_p95_ms": pct(waits, 95),
+        "download_p50_s": pct(downloads, 50),
+        "output_p50_s": pct(outputs, 50),
+        "output_p95_s": pct(outputs, 95),
+        "flows_per_min": round(flows / wall * 60, 1) if wall else None,
+        "interactions_per_s": round(len(latencies) / wall, 1) if wall else None,
+    }
+    if args.processes:
+        per_process = np.array([r.rss_bytes for r in results]) / 1024 / 1024
+        row["rss_per_process_mb"] = pct(per_process, 50)
+        row["rss_per_process_max_mb"] = round(float(per_process.max()), 1)
+    else:
+        row["rss_mb"] = round(_rss_bytes() / 1024 / 1024, 1)
+        row["approx_rss_delta_per_session_mb"] = round(rss_delta / sessions / 1024 / 1024, 2)
+    row["state_per_session_mb"] = round(sum(r.state_bytes for r in results) / sessions / 1024 / 1024, 2)
+    row["errors"] = len(errors)
+    results.clear()
+    gc.collect()
+    return row
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-session load test for app.py with fake Nomic / Sheets")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="concurrent session counts to run, one level each")
+    parser.add_argument("--rows", type=int, default=20000, help="ideas per synthetic map")
+    parser.add_argument("--maps", type=int, default=0,
+                        help="distinct maps per level (sessions share them round-robin; 0 = one map per session)")
+    parser.add_argument("--nomic-latency", type=float, default=0.3, help="seconds per Nomic login / dataset call")
+    parser.add_argument("--download-seconds", type=float, default=2.0, help="seconds to download one map")
+    parser.add_argument("--sheets-latency", type=float, default=0.1, help="seconds per Sheets API call")
+    parser.add_argument("--ramp", type=float, default=0.2, help="seconds between session starts")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between reruns while a job is running")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed per script run")
+    parser.add_argument("--job-timeout", type=float, default=600, help="seconds allowed per background job")
+    parser.add_argument("--processes", action="store_true",
+                        help="run each session in its own process (concurrent latency, per-process memory); "
+                             "by default sessions share one app instance and script runs are serialized")
+    parser.add_argument("--csv", help="also write the report to this CSV file")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the temporary working directory")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    install_fakes(args.rows, args.nomic_latency, args.download_seconds, args.sheets_latency)
+
+    # スナップショット・履歴・検索インデックス（.cache）は一時ディレクトリに書き、本物の履歴を汚さない
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    for name in APP_FILES:
+        os.symlink(os.path.join(ROOT, name), os.path.join(workdir, name))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    mode = "one process per session" if args.processes else "one app instance, serialized script runs"
+    print(f"🧪 Load test: {args.rows} rows/map, sessions {args.sessions}, {mode} (workdir {workdir})")
+
+    rows = []
+    prefix = "" if args.processes else "serialized_"
+    try:
+        # 初回の import・キャッシュの作成をセッション数1の計測に含めない（--processes では各プロセスで行う）
+        if not args.processes:
+            print("🔥 Warm-up session...")
+            warmup = run_session(-1, "https://atlas.nomic.ai/data/loadtest/warmup/map", args)
+            for error in warmup.errors:
+                print(f"❌ {error}")
+            del warmup
+        for sessions in args.sessions:
+            print(f"▶️ {sessions} session(s)...")
+            rows.append(run_level(sessions, args, workdir))
+            print(f"   p50 {rows[-1][prefix + 'p50_ms']} ms / p95 {rows[-1][prefix + 'p95_ms']} ms, "
+                  f"output p50 {rows[-1]['output_p50_s']} s, errors {rows[-1]['errors']}")
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False))
+    if args.csv:
+        report.to_csv(args.csv, index=False)
+        print(f"✅ Report written to {args.csv}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+
+
+# ==============================
+# 🔹 2D マップの密度ピラミッド
+# ==============================
+# マップ全体を GRID × GRID のセルに分けたものをレベル 0 とし、レベルが1つ上がるごとに縦横2倍に細かくする。
+# 表示範囲ごとにセル数が MAX_MARKS に収まる一番細かいレベルを使うので、描くマーク数は点数に依存しない。
+GRID = 64
+MAX_LEVEL = 6
+# 描画に送るマーク数の上限（これ以下なら範囲内の点をそのまま送る）
+MAX_MARKS = 4000
+# このアイデア数以下のセルは集約せず、点として残す（外れ値・孤立したアイデアを消さない）
+OUTLIER_MAX = 2
+# 外れ値として送る点の上限
+MAX_OUTLIERS = 1000
+
+
+class MapPyramid:
+    """
+    2D 投影の点（x, y, トピックコード）と、レベルごとの集約セルを持つ。
+    levels[z]: cx, cy, count, topic（セル内で最多のトピックコード）, x, y（セル内の平均座標）
+    cell_of[z]: 各点が属するレベル z のセル番号（levels[z] の行番号）
+    """
+
+    def __init__(self, x, y, codes, topics, bounds, levels, cell_of):
+        self.x = x
+        self.y = y
+        self.codes = codes
+        self.topics = topics
+        self.bounds = bounds
+        self.levels = levels
+        self.cell_of = cell_of
+
+    def __len__(self):
+        return len(self.x)
+
+
+def _aggregate(cx, cy, side, x, y, codes, n_topics):
+    """セル座標ごとに件数・最多トピック・平均座標をまとめる"""
+    key = cx.astype(np.int64) * side + cy
+    cells, inverse, counts = np.unique(key, return_inverse=True, return_counts=True)
+    k = len(cells)
+    mean_x = np.bincount(inverse, weights=x, minlength=k) / counts
+    mean_y = np.bincount(inverse, weights=y, minlength=k) / counts
+
+    # (セル, トピック) の件数から、セルごとに最多のトピックを選ぶ
+    pair, pair_counts = np.unique(inverse.astype(np.int64) * n_topics + codes, return_counts=True)
+    pair_cell = pair // n_topics
+    order = np.lexsort((-pair_counts, pair_cell))
+    first = order[np.r_[0, np.flatnonzero(np.diff(pair_cell[order])) + 1]]
+    dominant = (pair[first] % n_topics).astype(np.int32)
+
+    frame = pd.DataFrame({
+        "cx": (cells // side).astype(np.int32),
+        "cy": (cells % side).astype(np.int32),
+        "count": counts.astype(np.int64),
+        "topic": dominant,
+        "x": mean_x,
+        "y": mean_y,
+    })
+    return frame, inverse.astype(np.int32)
+
+
+def build_pyramid(x, y, topics, grid=GRID, max_level=MAX_LEVEL):
+    """
+    点の座標と Broad トピック名から密度ピラミッドを作る（全レベルを最初に一度だけ計算する）。
+    100万点でも np.unique / bincount だけで、数秒以内に終わる。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    codes, names = pd.factorize(pd.Series(np.asarray(topics)[valid]).astype(str))
+    codes = codes.astype(np.int64)
+
+    if len(x) == 0:
+        bounds = (0.0, 1.0, 0.0, 1.0)
+    else:
+        x0, x1, y0, y1 = x.min(), x.max(), y.min(), y.max()
+        # 幅0の軸でもセルが切れるように少し広げる
+        pad_x = (x1 - x0) * 1e-6 or 1.0
+        pad_y = (y1 - y0) * 1e-6 or 1.0
+        bounds = (x0 - pad_x, x1 + pad_x, y0 - pad_y, y1 + pad_y)
+
+    finest = grid * 2 ** max_level
+    fx = ((x - bounds[0]) / (bounds[1] - bounds[0]) * finest).astype(np.int64).clip(0, finest - 1)
+    fy = ((y - bounds[2]) / (bounds[3] - bounds[2]) * finest).astype(np.int64).clip(0, finest - 1)
+
+    levels, cell_of = [], []
+    n_topics = max(len(names), 1)
+    for z in range(max_level + 1):
+        shift = max_level - z
+        frame, inverse = _aggregate(fx >> shift, fy >> shift, grid * 2 ** z, x, y, codes, n_topics)
+        levels.append(frame)
+        cell_of.append(inverse)
+    return MapPyramid(x, y, codes, list(names), bounds, levels, cell_of)
+
+
+# ==============================
+# 🔹 表示範囲の問い合わせ
+# ==============================
+
+def query(pyramid, view=None, max_marks=MAX_MARKS):
+    """
+    表示範囲 view = (x0, x1, y0, y1)（None ならマップ全体）に描くマークを返す。
+    範囲内の点が max_marks 以下なら点をそのまま、多ければセル数が max_marks に収まる一番細かいレベルのセル
+    （円の大きさ = 件数）を返す。
+    集約する場合も、件数 OUTLIER_MAX 以下のセルの点は個別の点として残す。
+
+    Returns:
+        (marks DataFrame [x, y, count, topic, kind], 使ったレベル or None, 範囲内の点数)
+        kind: "point"（個別の点）/ "cell"（集約セル）
+    """
+    view = view or pyramid.bounds
+    inside = (
+        (pyramid.x >= view[0]) & (pyramid.x <= view[1]) & (pyramid.y >= view[2]) & (pyramid.y <= view[3])
+    )
+    n_inside = int(inside.sum())
+    names = np.asarray(pyramid.topics + [""], dtype=object)
+
+    def points(mask):
+        idx = np.flatnonzero(mask)
+        return pd.DataFrame({
+            "x": pyramid.x[idx], "y": pyramid.y[idx], "count": 1,
+            "topic": names[pyramid.codes[idx]], "kind": "point",
+        })
+
+    if n_inside <= max_marks:
+        return points(inside), None, n_inside
+
+    # 範囲内のセル数が max_marks に収まる一番細かいレベルを選ぶ（ズームするほど細かいレベルになる）。
+    # セルの件数は範囲内の点だけで数え直す（範囲の端のセルが過大にならない）
+    for level in range(len(pyramid.levels) - 1, -1, -1):
+        cells = pyramid.levels[level]
+        counts = np.bincount(pyramid.cell_of[level][inside], minlength=len(cells))
+        if np.count_nonzero(counts) <= max_marks:
+            break
+
+    dense = counts > OUTLIER_MAX
+    marks = pd.DataFrame({
+        "x": cells["x"].to_numpy()[dense], "y": cells["y"].to_numpy()[dense], "count": counts[dense],
+        "topic": names[cells["topic"].to_numpy()[dense]], "kind": "cell",
+    })
+
+    sparse_points = inside & ~dense[pyramid.cell_of[level]]
+    if np.count_nonzero(sparse_points) > MAX_OUTLIERS:
+        keep = np.flatnonzero(sparse_points)
+        keep = keep[np.linspace(0, len(keep) - 1, MAX_OUTLIERS).astype(np.int64)]
+        sparse_points = np.zeros_like(sparse_points)
+        sparse_points[keep] = True
+    return pd.concat([marks, points(sparse_points)], ignore_index=True), level, n_inside
+
+
+# ==============================
+# 🔹 トピックのツリーマップ
+# ==============================
+
+def _worst(row, length):
+    """squarify：行の中で最も細長い長方形の縦横比"""
+    total = sum(row)
+    side = total / length
+    return max(max(side * side / r, r / (side * side)) for r in row if r > 0)
+
+
+def squarify(sizes, x, y, w, h):
+    """
+    面積 sizes（降順推奨）の長方形で (x, y, w, h) を敷き詰める（squarified treemap）。
+    戻り値: 各要素の (x, y, w, h)（sizes と同じ順）
+    """
+    sizes = [float(s) for s in sizes]
+    total = sum(sizes)
+    if total <= 0 or w <= 0 or h <= 0:
+        return [(x, y, 0.0, 0.0) for _ in sizes]
+    scale = w * h / total
+    areas = [s * scale for s in sizes]
+
+    rects = []
+    i = 0
+    while i < len(areas):
+        length = min(w, h)
+        row = [areas[i]]
+        j = i + 1
+        while j < len(areas) and _worst(row + [areas[j]], length) <= _worst(row, length):
+            row.append(areas[j])
+            j += 1
+        thickness = sum(row) / length if length > 0 else 0.0
+        offset = 0.0
+        for a in row:
+            extent = a / thickness if thickness > 0 else 0.0
+            if w >= h:
+                rects.append((x, y + offset, thickness, extent))
+            else:
+                rects.append((x + offset, y, extent, thickness))
+            offset += extent
+        if w >= h:
+            x, w = x + thickness, w - thickness
+        else:
+            y, h = y + thickness, h - thickness
+        i = j
+    return rects
+
+
+def topic_counts(df_topics):
+    """マスターテーブルがまだ無いとき用：トピック割り当てから depth / Broad / Medium / アイデア数 だけの表を作る"""
+    broad = df_topics["topic_depth_1"].astype(str).value_counts()
+    pairs = df_topics[["topic_depth_1", "topic_depth_2"]].astype(str).value_counts()
+    return pd.concat([
+        pd.DataFrame({"depth": "1", "Nomic Topic: Broad": broad.index, "Nomic Topic: Medium": "",
+                      "アイデア数": broad.to_numpy()}),
+        pd.DataFrame({"depth": "2", "Nomic Topic: Broad": pairs.index.get_level_values(0),
+                      "Nomic Topic: Medium": pairs.index.get_level_values(1), "アイデア数": pairs.to_numpy()}),
+    ], ignore_index=True)
+
+
+def treemap_frame(df_master, width=100.0, height=60.0):
+    """
+    マスターテーブルから Broad → Medium の2段のツリーマップの長方形を作る（面積 = アイデア数）。
+    戻り値の列: broad, topic, depth, count, x, x2, y, y2
+    """
+    rows = []
+    df = df_master[df_master["アイデア数"] > 0]
+    broad = df[df["depth"].astype(str) == "1"].sort_values("アイデア数", ascending=False)
+    medium = df[df["depth"].astype(str) == "2"]
+    for (_, b), (bx, by, bw, bh) in zip(
+        broad.iterrows(), squarify(broad["アイデア数"].tolist(), 0.0, 0.0, width, height)
+    ):
+        name = b["Nomic Topic: Broad"]
+        rows.append({"broad": name, "topic": name, "depth": "1", "count": int(b["アイデア数"]),
+                     "x": bx, "x2": bx + bw, "y": by, "y2": by + bh})
+        subs = medium[medium["Nomic Topic: Broad"] == name].sort_values("アイデア数", ascending=False)
+        for (_, sub), (sx, sy, sw, sh) in zip(
+            subs.iterrows(), squarify(subs["アイデア数"].tolist(), bx, by, bw, bh)
+        ):
+            rows.append({"broad": name, "topic": sub["Nomic Topic: Medium"], "depth": "2",
+                         "count": int(sub["アイデア数"]), "x": sx, "x2": sx + sw, "y": sy, "y2": sy + sh})
+    return pd.DataFrame(rows, columns=["broad", "topic", "depth", "count", "x", "x2", "y", "y2"])
@@ -1,7 +1,24 @@
 import nomic
 from nomic import AtlasDataset
+from nomic.data_operations import AtlasMapData
+import numpy as np
 import pandas as pd
+import hashlib
+import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import aggregate_module
+import atlas_module
+import dedup_module
+import download_module
+import keyword_module
+import parallel_module
+import schema_module
+import store_module
+import scoring_module
 
 
 # ==============================
@@ -18,37 +35,306 @@ def extract_map_name(url_or_name: str) -> str:
     return url_or_name
 
 
-def get_data(token, domain, map_url):
-    try:
+def map_key(domain, map_url):
+    """ドメインごとに区別したマップのキー（"<domain>/<map_name>"）。同じ名前のマップが別のドメインにあっても混ざらない"""
+    return f"{domain}/{extract_map_name(map_url)}"
+
+
+# ==============================
+# 🔹 同一マップ取得の相乗り（single-flight）
+# ==============================
+
+class _Flight:
+    """実行中の取得1件。後から来た呼び出しは event を待って結果を共有する"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(key, fn):
+    """
+    同じ key の処理がすでに実行中なら、それが終わるのを待って同じ結果を返す。
+    実行中のものが無ければ fn() を実行する（完了後は保持しない）。
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _flights[key] = flight
+
+    if leader:
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with _flights_lock:
+                _flights.pop(key, None)
+            flight.event.set()
+        return flight.result
+
+    flight.event.wait()
+    if flight.error is not None:
+        raise RuntimeError(f"Shared Nomic fetch failed: {flight.error}") from flight.error
+    return flight.result
+
+
+# nomic.login は資格情報をプロセス共通のファイル（~/.nomic/credentials）に書き、
+# AtlasDataset はそれを読んでヘッダー（トークン）を作る。トークン・ドメインの違うジョブが同時に
+# ログインすると他人の資格情報でデータセットを開いてしまうので、ログインから生成までを1つずつ行う
+# （ヘッダーはデータセットが持つので、以降の取得はロックの外で並行に動く）
+_login_lock = threading.Lock()
+
+
+def _dataset_version(dataset, projection):
+    """
+    相乗り・タイルキャッシュの版。件数だけでは同数の追加と削除・値の更新・再構築を見分けられないので、
+    件数・スキーマ・その projection を含む索引のメタデータ（再構築で変わる）をまとめたハッシュにする。
+    """
+    meta = dataset.meta
+    indices = [
+        index for index in meta.get("atlas_indices", [])
+        if any(p.get("id") == projection.id for p in index.get("projections", []))
+    ]
+    payload = json.dumps(
+        [meta.get("total_datums_in_project"), meta.get("schema"), indices], sort_keys=True, default=str
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def _open_projection(token, domain, map_url):
+    """ログインしてマップを開き、(projection, 相乗りキー) を返す"""
+    map_id = extract_map_name(map_url)
+    with _login_lock:
         nomic.login(token=token, domain=domain)
-        map_id = extract_map_name(map_url)
         dataset = AtlasDataset(map_id)
+    projection = dataset.maps[0]
+
+    # 再クラスタリングで projection が、データの追加・更新で版が変わる
+    key = (domain, map_id, projection.id, _dataset_version(dataset, projection))
+    return projection, key
+
+
+# ストアに置くフレームの名前（get_map_data の戻り値の順）
+FRAME_NAMES = ("meta", "topics", "data")
+
+
+def projected_fields(projection, columns, extra_fields=()):
+    """
+    マッピング (n, f, m, t, s, c) をデータセットのフィールド名に合わせ、取得するフィールドだけを返す。
+    row_number がフィールドとして存在すれば含める（トピックとの突き合わせに使う）。
+    extra_fields（採点モデルが直接指定した列など）もあれば含める。
+    """
+    available = list(projection.dataset.dataset_fields)
+    wanted = ["row_number"] + list(schema_module.resolve_fields(available, columns)) + list(extra_fields)
+    return tuple(dict.fromkeys(f for f in wanted if f in available))
+
 
-        df_meta, df_topics, df_data = get_map_data(dataset.maps[0])
+def fetch_map_handle(token, domain, map_url, columns=None, extra_fields=(), opened=None):
+    """
+    ログイン・データセット取得（＝トークンごとのアクセス確認）は呼び出しごとに行い、
+    重いフレームのダウンロードだけを (domain, map, projection, 版, 取得列) 単位で相乗りする。
+    columns (n, f, m, t, s, c) を渡すと、その列（と extra_fields）だけを Atlas から取得する（None なら全列）。
+    取得したフレームはプロセス共有のストア（store_module）に1つだけ置き、そのキーを返す。
+    同じキーがストアにあればダウンロードしない。
+    opened: 同じ呼び出し元ですでに開いた open_map の結果（渡すとログインとデータセットの取得を省く）。
+    """
+    projection, key = opened or _open_projection(token, domain, map_url)
+    fields = projected_fields(projection, columns, extra_fields) if columns is not None else None
+    handle = key + (fields,)
+    store = store_module.get_store()
+    if handle in store:
+        return handle
+
+    def fetch():
+        # タイルはリトライ付きでローカルに残し、途中で失敗しても次回は続きから取得する
+        with download_module.resumable(projection, version=key[3]):
+            timings = {}
+            frames = get_map_data(projection, fields, timings)
+        _fetch_timings[extract_map_name(map_url)] = timings
+        store.put(handle, dict(zip(FRAME_NAMES, frames)))
+
+    single_flight(handle, fetch)
+    return handle
+
+
+def map_frames(handle):
+    """ストアのフレーム (meta, topics, data)。topics / data は共有バッファのゼロコピーのビュー。無ければ None"""
+    frames = store_module.get_store().get(handle) if handle is not None else None
+    if frames is None:
+        return None
+    return tuple(frames[name] for name in FRAME_NAMES)
+
+
+def fetch_map_frames(token, domain, map_url, columns=None, extra_fields=()):
+    """fetch_map_handle で取得（または共有）したフレーム (meta, topics, data)"""
+    frames = map_frames(fetch_map_handle(token, domain, map_url, columns, extra_fields))
+    if frames is None:
+        raise RuntimeError("Map data was evicted from the shared store while loading; please retry")
+    return frames
+
+
+def open_map(token, domain, map_url):
+    """
+    ログインしてマップを開いたもの（(projection, 相乗りキー)）。get_dataset_fields・fetch_map_handle に
+    opened として渡すと、1回の取得でログインとデータセットの取得を繰り返さない。
+    """
+    return _open_projection(token, domain, map_url)
+
+
+def get_dataset_fields(token, domain, map_url, opened=None):
+    """データセットのフィールド名一覧（タイルはダウンロードしない。opened は open_map の結果）"""
+    projection, _ = opened or _open_projection(token, domain, map_url)
+    return list(projection.dataset.dataset_fields)
+
+
+def fetch_map_embeddings(token, domain, map_url):
+    """正規化済みの埋め込み行列（data.df と同じ行順・読み取り専用）を相乗りで取得。タイルは再開可能なダウンロードで取る"""
+    projection, key = _open_projection(token, domain, map_url)
+
+    def fetch():
+        with download_module.resumable(projection, version=key[3]):
+            return get_map_embeddings(projection)
+
+    return single_flight(key + ("embeddings",), fetch)
+
+
+def fetch_map_points(token, domain, map_url):
+    """2D 投影の座標 (x, y)（data.df と同じ行順）を相乗りで取得。タイルは再開可能なダウンロードで取る"""
+    projection, key = _open_projection(token, domain, map_url)
+
+    def fetch():
+        with download_module.resumable(projection, version=key[3]):
+            return get_map_points(projection)
+
+    return single_flight(key + ("points",), fetch)
+
+
+def get_data(token, domain, map_url, columns=None, extra_fields=()):
+    """(meta, topics, data, err)。columns を渡すと data はその列と extra_fields だけ（全列は Data CSV 用）"""
+    try:
+        df_meta, df_topics, df_data = fetch_map_frames(token, domain, map_url, columns, extra_fields)
         return df_meta, df_topics, df_data, None
     except Exception as e:
         return None,None,None, str(e)
 
-def create_nomic_dataset(token, domain, map_url, n,f,m,t,s,c):
-    """Nomic Atlasからデータセットを取得し、マスターデータを生成"""
+def create_nomic_dataset(token, domain, map_url, n,f,m,t,s,c, dedup_threshold=None, keywords=False, workers=None,
+                         model=None):
+    """Nomic Atlasからデータセットを取得し、マスターデータを生成（model は採点モデル）"""
     try:
-        nomic.login(token=token, domain=domain)
-        map_id = extract_map_name(map_url)
-        dataset = AtlasDataset(map_id)
-
-        df_meta, df_topics, df_data = get_map_data(dataset.maps[0])
-        df_master = prepare_master_dataframe(df_meta, df_topics, df_data,n,f,m,t,s,c)
+        model = scoring_module.get_model(model)
+        df_meta, df_topics, df_data = fetch_map_frames(
+            token, domain, map_url, (n, f, m, t, s, c), model.extra_fields()
+        )
+        embeddings = None
+        if dedup_threshold is not None:
+            embeddings = fetch_map_embeddings(token, domain, map_url)
+        df_master = prepare_master_dataframe(
+            df_meta, df_topics, df_data,n,f,m,t,s,c,
+            embeddings=embeddings, dedup_threshold=dedup_threshold, keywords=keywords, workers=workers,
+            model=model,
+        )
         return df_master, None
     except Exception as e:
         return None, str(e)
 
 
-def get_map_data(map_data):
-    """map_dataからtopicsとmetadataをDataFrameとして取り出す"""
-    df_metadata = map_data.topics.metadata
-    df_topics = map_data.topics.df
-    df_data = map_data.data.df
-    return df_metadata, df_topics, df_data
+# 3つの取得（トピックのメタデータ・トピック割り当て・データ）を並行に行うスレッド数
+FETCH_WORKERS = 3
+
+# マップごとの直近の取得時間（秒）。相乗りした呼び出しは取得した側の値を参照する
+_fetch_timings = {}
+
+
+def _prime_projection(map_data):
+    """
+    トピックとデータの両方が使う遅延取得（スキーマ・manifest・datum_id）を呼び出し側のスレッドで済ませておく。
+    並行に初回アクセスすると同じファイルを二重にダウンロード・書き込みしてしまうため。
+    非公開の属性に触るのは atlas_module だけ。
+    """
+    topics = map_data.topics
+    atlas_module.prime(map_data, topics)
+    return topics
+
+
+def _timed(fn):
+    """(結果, 所要秒数)"""
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def get_map_data(map_data, fields=None, timings=None):
+    """
+    map_dataからtopicsとmetadataをDataFrameとして取り出す。
+    fields を渡すと、そのフィールドを含むサイドカーだけをダウンロードし、その列だけを Arrow から読む。
+    metadata・topics・data の3つは小さなスレッドプールで並行に取得する（待ち時間は一番遅い1つ分に近づく）。
+    nomic が確認済みの版でなければ（atlas_module.supported）下準備ができないので、公開 API で1つずつ取得する。
+    timings に dict を渡すと、部品ごとの所要秒数（prepare / metadata / topics / data / wall）を書き込む。
+    """
+    started = time.perf_counter()
+    topics = _prime_projection(map_data) if atlas_module.supported() else map_data.topics
+    data = map_data.data if fields is None else AtlasMapData(map_data, fields=list(fields))
+    timings = {} if timings is None else timings
+    timings["prepare"] = time.perf_counter() - started
+
+    tasks = {
+        "metadata": lambda: topics.metadata,
+        "topics": lambda: topics.df,
+        "data": lambda: data.df,
+    }
+    results = {}
+    workers = FETCH_WORKERS if atlas_module.supported() else 1
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nomic-fetch")
+    try:
+        futures = {pool.submit(_timed, fn): name for name, fn in tasks.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results[name], timings[name] = future.result()
+            except Exception as e:
+                # 残りの取得は待たずに打ち切る（実行中のものはバックグラウンドで終わる）
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise RuntimeError(f"Failed to fetch Nomic {name}: {e}") from e
+    finally:
+        pool.shutdown(wait=False)
+
+    timings["wall"] = time.perf_counter() - started
+    print(f"⏱️ Nomic fetch: {format_timings(timings)}")
+    return results["metadata"], results["topics"], results["data"]
+
+
+def format_timings(timings):
+    """取得時間の内訳を1行にする（例: metadata 0.4s / topics 1.2s / data 2.0s (wall 2.1s)）"""
+    if not timings:
+        return ""
+    parts = [f"{name} {timings[name]:.1f}s" for name in ("metadata", "topics", "data") if name in timings]
+    return " / ".join(parts) + f" (wall {timings.get('wall', 0.0):.1f}s)"
+
+
+def last_fetch_timings(map_url):
+    """マップについて直近に実際にダウンロードしたときの取得時間（秒）。未取得なら空の dict"""
+    return dict(_fetch_timings.get(extract_map_name(map_url), {}))
+
+
+def get_map_embeddings(map_data):
+    """高次元埋め込みを取得し、正規化済みの float32 行列にする（行順は data.df と同じ）"""
+    embeddings = dedup_module.normalize_embeddings(map_data.embeddings.latent)
+    embeddings.setflags(write=False)
+    return embeddings
+
+
+def get_map_points(map_data):
+    """2D 投影の座標だけの DataFrame [x, y]（行順は data.df と同じ）"""
+    return map_data.embeddings.df[["x", "y"]].reset_index(drop=True)
 
 
 
@@ -60,10 +346,9 @@ def numcol(df: pd.DataFrame, col: str) -> pd.Series:
     """
     if col not in df.columns:
         return pd.Series(0.0, index=df.index, dtype="float64")
-    s = df[col]
-    # カテゴリ列でも安全に数値化
-    s = pd.to_numeric(s, errors="coerce")
-    return s.fillna(0.0).astype("float64")
+    # カテゴリ列・Arrow の列でも安全に数値化（Arrow の NaN は欠損扱いにならないので numpy にしてから埋める）
+    s = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    return pd.Series(s, index=df.index).fillna(0.0)
 
 # ==============================
 # 🔹 マスターデータ生成関数群
@@ -81,181 +366,405 @@ def create_master_dataframe(df_metadata):
     return df_master
 
 
-def add_item_count(df_master, df_topics):
-    """各トピックのアイデア数をカウントしてdf_masterに追加"""
-    df_master["アイデア数"] = 0
-    for idx, row in df_master.iterrows():
-        if row["depth"] == "1":
-            count = (df_topics["topic_depth_1"] == row["Nomic Topic: Broad"]).sum()
-        elif row["depth"] == "2":
-            count = (df_topics["topic_depth_2"] == row["Nomic Topic: Medium"]).sum()
-        else:
-            count = 0
-        df_master.at[idx, "アイデア数"] = count
-    return df_master
+def topic_states(df_topics, df_data, scored, t, s, c, workers=None):
+    """
+    Broad / Medium ごとの集計状態を {"1": frame, "2": frame} で返す（aggregate_module.fold でマージできる形）。
+    frame の index はトピック名、列は
+      count・採点モデルの stat_fields・assigned（トピック割り当て件数）… 足し合わせられる値
+      best_total・best_row（最優秀アイデアの合計スコアと row_number）
+      best_title / best_summary / best_category・best_score_<i> … 最優秀アイデアの表示用の値
+    workers >= 2 のときは Broad トピック単位でプロセスプールに分けて集計する
+    （最優秀アイデアの同点は df_data で先に出る行を採用）。
+    """
+    model = scored.model
+    topics = df_topics[["row_number", "topic_depth_1", "topic_depth_2"]].astype(
+        {"topic_depth_1": str, "topic_depth_2": str}
+    )
+    df_pos = pd.DataFrame({"row_number": df_data["row_number"].to_numpy(), "_pos": np.arange(len(df_data))})
+    joined = topics.drop_duplicates("row_number").merge(df_pos, on="row_number")
+    pos = joined["_pos"].to_numpy()
+
+    d1_codes, d1_names = pd.factorize(joined["topic_depth_1"])
+    d2_codes, d2_names = pd.factorize(joined["topic_depth_2"])
+    stats_1, stats_2 = parallel_module.group_stats(
+        d1_codes, d2_codes, scored.sums(pos), scored.total[pos], pos, workers=workers
+    )
+    fields = ["count"] + model.stat_fields()
+    row_numbers = df_data["row_number"].to_numpy()
+    texts = {"best_title": t, "best_summary": s, "best_category": c}
+
+    def as_frame(state, names, assigned):
+        keys, stats, best_total, best_pos = state
+        frame = pd.DataFrame(stats, columns=fields, index=pd.Index(names[keys], dtype=object))
+        frame["best_total"] = best_total
+        frame["best_row"] = row_numbers[best_pos].astype(np.float64) if len(best_pos) else np.empty(0)
+        for name, col in texts.items():
+            frame[name] = [str(v) for v in df_data[col].to_numpy()[best_pos]] if col in df_data.columns else ""
+        for i in range(len(model.criteria)):
+            frame[f"best_score_{i}"] = scored.values[best_pos, i]
+        # データの行が無く、割り当てだけがあるトピックも持つ（アイデア数に使う）
+        frame = frame.reindex(frame.index.union(pd.Index(assigned.index, dtype=object)))
+        frame[fields] = frame[fields].fillna(0.0)
+        frame["best_total"] = frame["best_total"].fillna(-np.inf)
+        frame["best_row"] = frame["best_row"].fillna(-1.0)
+        frame["assigned"] = assigned.reindex(frame.index).fillna(0).astype(np.float64)
+        return frame
+
+    return {
+        "1": as_frame(stats_1, d1_names, topics["topic_depth_1"].value_counts()),
+        "2": as_frame(stats_2, d2_names, topics["topic_depth_2"].value_counts()),
+    }
 
 
-def add_average_scores(df_master, df_topics, df_data, n, f, m):
-    df_master["平均スコア"] = 0.0
-    df_master["新規性平均スコア"] = 0.0
-    df_master["市場性平均スコア"] = 0.0
-    df_master["実現性平均スコア"] = 0.0
-
-    for idx, row in df_master.iterrows():
-        depth = row["depth"]
-        if depth == "1":
-            mask = df_topics["topic_depth_1"] == row["Nomic Topic: Broad"]
-        elif depth == "2":
-            mask = df_topics["topic_depth_2"] == row["Nomic Topic: Medium"]
-        else:
-            continue
-
-        rows = df_topics.loc[mask, "row_number"]
-        df_sub = df_data[df_data["row_number"].isin(rows)]
-        if df_sub.empty:
-            continue
-
-        a = numcol(df_sub, n)
-        b = numcol(df_sub, f)
-        c = numcol(df_sub, m)
-        total_score = a + b + c
-
-        df_master.at[idx, "平均スコア"] = round(total_score.mean(), 2)
-        df_master.at[idx, "新規性平均スコア"] = round(a.mean(), 2)
-        df_master.at[idx, "市場性平均スコア"] = round(c.mean(), 2)
-        df_master.at[idx, "実現性平均スコア"] = round(b.mean(), 2)
+def apply_topic_states(df_master, states, model, present):
+    """
+    トピックごとの集計状態（topic_states / aggregate_module.fold の結果）から、
+    アイデア数・平均スコア・優秀アイデア数・基準ごとの詳細・最優秀アイデアの列を作る。
+    present は各基準の列がデータにあるか（scoring_module.ModelScores.present）。
+    """
+    # master の各行に、対応するトピックの集計状態を並べる
+    parts = []
+    for depth, master_col in (("1", "Nomic Topic: Broad"), ("2", "Nomic Topic: Medium")):
+        rows = df_master["depth"] == depth
+        part = states[depth].reindex(df_master.loc[rows, master_col].to_numpy())
+        part.index = df_master.index[rows]
+        parts.append(part)
+    stats = pd.concat(parts).reindex(df_master.index)
+    idea_count = stats["assigned"].fillna(0).astype("int64")
+
+    has_data = stats["count"].fillna(0) > 0
+    count = stats["count"].where(has_data, 1.0)
+
+    def mean_of(col):
+        return (stats[col] / count).round(2).where(has_data, 0.0)
+
+    def ratio_text(num, den):
+        ratio = (num / den.where(den > 0, 1.0) * 100).where(den > 0, 0.0)
+        return pd.Series([f"{round(r, 1)}%" for r in ratio], index=df_master.index).where(has_data, "0%")
+
+    df_master["アイデア数"] = idea_count
+    df_master["平均スコア"] = mean_of("sum_total")
+    for i, criterion in enumerate(model.criteria):
+        df_master[model.average_column(criterion)] = mean_of(f"sum_{i}")
+
+    excellent_col, excellent_ratio_col = model.excellent_columns()
+    excellent = stats["excellent"].fillna(0).astype("int64")
+    df_master[excellent_col] = excellent
+    df_master[excellent_ratio_col] = ratio_text(excellent, idea_count)
+
+    for i, criterion in enumerate(model.criteria):
+        mean_col, count_col, ratio_col = model.detail_columns(criterion)
+        high = stats[f"high_{i}"].fillna(0).astype("int64")
+        df_master[mean_col] = mean_of(f"sum_{i}") if present[i] else 0.0
+        df_master[count_col] = high if present[i] else 0
+        df_master[ratio_col] = ratio_text(high, stats["count"].fillna(0)) if present[i] else "0%"
+
+    # ---- 最優秀アイデア
+    df_master["アイデア名"] = stats["best_title"].where(has_data, "")
+    df_master["Summary"] = stats["best_summary"].where(has_data, "")
+    df_master["カテゴリー"] = stats["best_category"].where(has_data, "")
+    df_master["合計スコア"] = stats["best_total"].where(has_data, 0.0).astype("float64")
+    for i, criterion in enumerate(model.criteria):
+        df_master[model.best_column(criterion)] = stats[f"best_score_{i}"].where(has_data, 0.0).astype("float64")
     return df_master
 
 
-def add_excellent_ideas(df_master, df_topics, df_data, n, f, m):
-    df_master["優秀アイデア数(12点以上)"] = 0
-    df_master["優秀アイデアの比率(12点以上)"] = "0%"
-
-    for idx, row in df_master.iterrows():
-        if row["depth"] == "1":
-            mask = df_topics["topic_depth_1"] == row["Nomic Topic: Broad"]
-        elif row["depth"] == "2":
-            mask = df_topics["topic_depth_2"] == row["Nomic Topic: Medium"]
-        else:
-            continue
+def add_topic_scores(df_master, df_topics, df_data, scored, t, s, c, workers=None):
+    """
+    アイデア数・平均スコア・優秀アイデア数・基準ごとの詳細・最優秀アイデアの列を、
+    採点モデルの評価結果（scoring_module.ModelScores）からトピックごとの集計状態で一括で作る。
+    最優秀アイデアは合計スコア最大の行で、同点なら df_data で先に出る行（決定的）。
+    元の実装（合計スコアで sort_values して先頭）は安定ソートではなく、同点のときアイデア名・カテゴリーが
+    どの行になるかは決まっていなかった。既定のモデルで同点が無ければ元の実装と同じ値になる
+    （tests/test_master_table.py で固定）。
+    """
+    states = topic_states(df_topics, df_data, scored, t, s, c, workers=workers)
+    return apply_topic_states(df_master, states, scored.model, scored.present)
 
-        df_sub = df_data[df_data["row_number"].isin(df_topics.loc[mask, "row_number"])]
-        if df_sub.empty:
-            continue
 
-        a = numcol(df_sub, n)
-        b = numcol(df_sub, f)
-        c = numcol(df_sub, m)
-        total_score = a + b + c
+def add_duplicate_stats(df_master, df_topics, df_data, embeddings, scored, threshold=0.95):
+    """
+    トピック内で埋め込みの近いアイデアを重複クラスタにまとめ、
+    重複数・重複除外後のアイデア数と平均スコア（クラスタ代表のみで計算）を追加する。
+    クラスタは Broad 行なら Broad トピック内、Medium 行なら Medium トピック内で求める
+    （件数と平均が同じクラスタの集合から出るように）。
+    embeddings は df_data と同じ行順の正規化済み行列、scored はその行順の採点結果。
+    """
+    if len(embeddings) != len(df_data):
+        raise ValueError(
+            f"Embeddings ({len(embeddings)} rows) do not match data ({len(df_data)} rows)"
+        )
+
+    model = scored.model
+    df_pos = pd.DataFrame({"row_number": df_data["row_number"].to_numpy(), "_pos": np.arange(len(df_data))})
+    joined = df_topics[["row_number", "topic_depth_1", "topic_depth_2"]].merge(df_pos, on="row_number")
+    pos = joined["_pos"].to_numpy()
+
+    score_cols = {"_total": scored.total[pos]}
+    score_cols.update({f"_s{i}": scored.values[pos, i] for i in range(len(model.criteria))})
+    joined = joined.assign(
+        topic_depth_1=joined["topic_depth_1"].astype(str),
+        topic_depth_2=joined["topic_depth_2"].astype(str),
+        **score_cols,
+    )
 
-        excellent_count = (total_score >= 12).sum()
-        df_master.at[idx, "優秀アイデア数(12点以上)"] = int(excellent_count)
+    mean_columns = {"重複除外平均スコア": "_total"}
+    mean_columns.update({model.dedup_column(cr): f"_s{i}" for i, cr in enumerate(model.criteria)})
+    df_master["重複アイデア数"] = 0
+    df_master["重複除外アイデア数"] = 0
+    for col in mean_columns:
+        df_master[col] = 0.0
 
-        idea_count = row["アイデア数"]
-        ratio = (excellent_count / idea_count * 100) if idea_count > 0 else 0
-        df_master.at[idx, "優秀アイデアの比率(12点以上)"] = f"{round(ratio, 1)}%"
+    for depth, topic_col, master_col in [
+        ("1", "topic_depth_1", "Nomic Topic: Broad"),
+        ("2", "topic_depth_2", "Nomic Topic: Medium"),
+    ]:
+        rows = df_master["depth"] == depth
+        keys = df_master.loc[rows, master_col]
+        labels = dedup_module.find_duplicate_clusters(
+            embeddings, joined[topic_col].to_numpy(), rows=pos, threshold=threshold
+        )
+        reps = joined[labels == np.arange(len(labels))]
+        total = joined.groupby(topic_col, observed=True).size()
+        unique = reps.groupby(topic_col, observed=True).size()
+        means = reps.groupby(topic_col, observed=True)[list(mean_columns.values())].mean().round(2)
+
+        unique_counts = keys.map(unique).fillna(0).astype(int)
+        df_master.loc[rows, "重複除外アイデア数"] = unique_counts
+        df_master.loc[rows, "重複アイデア数"] = keys.map(total).fillna(0).astype(int) - unique_counts
+        for col, src in mean_columns.items():
+            df_master.loc[rows, col] = keys.map(means[src]).fillna(0.0)
     return df_master
 
 
-def add_detailed_scores(df_master, df_topics, df_data, n, f, m):
-    score_map = {
-        "novelty_score":       {"label": "新規性",     "col": n},
-        "marketability_score": {"label": "市場性",     "col": m},
-        "feasibility_score":   {"label": "実現可能性", "col": f},
-    }
+def add_topic_keywords(df_master, df_topics, df_data, t, s, top_k=8):
+    """
+    タイトル・概要から各トピックの特徴語を求め、キーワード列に追記する。
+    単語行列は全アイデアで1回だけ作り、Broad / Medium それぞれでまとめて集計する。
+    """
+    text_cols = [col for col in [t, s] if col and col in df_data.columns]
+    if not text_cols:
+        return df_master
 
-    for key, meta in score_map.items():
-        label = meta["label"]
-        col   = meta["col"]
-
-        mean_col  = f"{key}({label})\n平均スコア"
-        count_col = f"{key}({label})\n優秀アイデア数(4点以上)"
-        ratio_col = f"{key}({label})\n優秀アイデア比率(4点以上)"
-
-        df_master[mean_col] = 0.0
-        df_master[count_col] = 0
-        df_master[ratio_col] = "0%"
-
-        for idx, row in df_master.iterrows():
-            if row["depth"] == "1":
-                mask = df_topics["topic_depth_1"] == row["Nomic Topic: Broad"]
-            elif row["depth"] == "2":
-                mask = df_topics["topic_depth_2"] == row["Nomic Topic: Medium"]
-            else:
-                continue
-
-            rows = df_topics.loc[mask, "row_number"]
-            df_sub = df_data[df_data["row_number"].isin(rows)]
-            if df_sub.empty or col not in df_sub.columns:
-                continue
-
-            s = numcol(df_sub, col)
-            df_master.at[idx, mean_col] = round(s.mean(), 2)
-            excellent_count = (s >= 4).sum()
-            ratio = (excellent_count / len(s) * 100) if len(s) > 0 else 0
-            df_master.at[idx, count_col] = int(excellent_count)
-            df_master.at[idx, ratio_col] = f"{round(ratio, 1)}%"
+    joined = df_topics[["row_number", "topic_depth_1", "topic_depth_2"]].merge(
+        df_data[["row_number"] + text_cols], on="row_number"
+    )
+    # 欠損は空文字にしてから連結する（astype(str) だけだと "nan" / "<NA>" が特徴語になる）
+    texts = joined[text_cols[0]].fillna("").astype(str)
+    for col in text_cols[1:]:
+        texts = texts + " " + joined[col].fillna("").astype(str)
+    docs, terms, vocab = keyword_module.build_term_matrix(texts.tolist())
+
+    for depth, topic_col, master_col in [
+        ("1", "topic_depth_1", "Nomic Topic: Broad"),
+        ("2", "topic_depth_2", "Nomic Topic: Medium"),
+    ]:
+        top = keyword_module.distinctive_terms(
+            docs, terms, vocab, joined[topic_col].astype(str).to_numpy(), top_k=top_k
+        )
+        rows = df_master["depth"] == depth
+        extra = df_master.loc[rows, master_col].map(lambda k: ", ".join(top.get(k, [])))
+        has_terms = extra != ""
+        target = extra[has_terms].index
+        df_master.loc[target, "キーワード"] = (
+            df_master.loc[target, "キーワード"] + "\n特徴語: " + extra[has_terms]
+        )
     return df_master
 
 
-def add_best_ideas(df_master, df_topics, df_data, n, f, m,t,s,c):
-    """トピックごとの最優秀アイデアを抽出（列名ゆらぎ＆型安全対応版）"""
+# ==============================
+# 🔹 アイデア単位のテーブル
+# ==============================
 
-    # ---- 合計スコア（型安全に計算）
-    df_data["total_score"] = (
-        pd.to_numeric(df_data.get(n, 0), errors="coerce").fillna(0.0) +
-        pd.to_numeric(df_data.get(f, 0), errors="coerce").fillna(0.0) +
-        pd.to_numeric(df_data.get(m, 0), errors="coerce").fillna(0.0)
+def build_idea_table(df_topics, df_data):
+    """df_data に各アイデアのトピック（Broad / Medium）を付与した表を作る"""
+    topic_cols = [c for c in ["topic_depth_1", "topic_depth_2"] if c in df_topics.columns]
+    df_assign = (
+        df_topics[["row_number"] + topic_cols]
+        .drop_duplicates("row_number")
+        .rename(columns={
+            "topic_depth_1": "Nomic Topic: Broad",
+            "topic_depth_2": "Nomic Topic: Medium",
+        })
     )
+    df_ideas = df_assign.merge(df_data, on="row_number", how="inner")
+    return df_ideas.sort_values("row_number", kind="stable").reset_index(drop=True)
 
 
-    # ---- 出力列の初期化（正しい型で）
-    for col in ["アイデア名", "Summary", "カテゴリー"]:
-        df_master[col] = ""
-    for col in ["合計スコア", "新規性スコア", "市場性スコア", "実現性スコア"]:
-        df_master[col] = 0.0
+# ==============================
+# 🔹 カテゴリー × トピックのクロス集計
+# ==============================
+# カテゴリーが多すぎるとシートが横に伸びるので、件数の多い順にこれだけを列にし、残りは「その他」にまとめる
+CROSSTAB_MAX_CATEGORIES = 30
+CROSSTAB_OTHER = "(その他)"
+CROSSTAB_MISSING = "(未分類)"
 
-    # ---- 各トピックに対して最優秀アイデアを抽出
-    for idx, row in df_master.iterrows():
-        if row["depth"] == "1":
-            mask = (df_topics["topic_depth_1"] == row["Nomic Topic: Broad"])
-        elif row["depth"] == "2":
-            mask = (df_topics["topic_depth_2"] == row["Nomic Topic: Medium"])
-        else:
-            continue
-
-        rows = df_topics.loc[mask, "row_number"]
-        df_sub = df_data[df_data["row_number"].isin(rows)]
-        if df_sub.empty:
-            continue
-
-        # total_score の最大値の行を取得
-        best = df_sub.sort_values(by="total_score", ascending=False).iloc[0]
-
-        # テキスト列（存在すれば取得）
-        df_master.at[idx, "アイデア名"] = str(best[t])
-        df_master.at[idx, "Summary"] = str(best[s])
-        df_master.at[idx, "カテゴリー"] = str(best[c])
-
-        # 数値列（単一値なので fillna 不要）
-        df_master.at[idx, "合計スコア"]   = float(best.get("total_score", 0.0))
-        df_master.at[idx, "新規性スコア"] = float(pd.to_numeric(best.get(n, 0), errors="coerce"))
-        df_master.at[idx, "市場性スコア"] = float(pd.to_numeric(best.get(m, 0), errors="coerce"))
-        df_master.at[idx, "実現性スコア"] = float(pd.to_numeric(best.get(f, 0), errors="coerce"))
 
-    return df_master
+def build_category_crosstab(df_meta, df_topics, df_data, n, f, m, c, model=None,
+                            max_categories=CROSSTAB_MAX_CATEGORIES):
+    """
+    トピック（マスターテーブルと同じ行・同じ順）× アイデアのカテゴリーのクロス集計。
+    列は depth・Nomic Topic: Broad・Nomic Topic: Medium・アイデア数 に続いて、
+    カテゴリーごとの「<カテゴリー>\nアイデア数」、カテゴリーごとの「<カテゴリー>\n平均スコア」
+    （採点モデルの合計スコアの平均。アイデアが無いセルは NaN）。
+    Broad・Medium の割り当てを縦に積んだ (トピック, カテゴリー) のコードに bincount を1回かけて作る。
+    """
+    model = scoring_module.get_model(model)
+    scores = schema_module.score_matrix(df_data, *model.bind(n, f, m))
+    total = model.evaluate(scores, available=df_data.columns).total
+
+    topics = df_topics[["row_number", "topic_depth_1", "topic_depth_2"]].astype(
+        {"topic_depth_1": str, "topic_depth_2": str}
+    )
+    df_pos = pd.DataFrame({"row_number": df_data["row_number"].to_numpy(), "_pos": np.arange(len(df_data))})
+    joined = topics.drop_duplicates("row_number").merge(df_pos, on="row_number")
+    pos = joined["_pos"].to_numpy()
+
+    # ---- カテゴリー（空・欠損は「未分類」、件数の少ないものは「その他」）
+    if c in df_data.columns:
+        raw = df_data[c].iloc[pos]
+        text = raw.astype(str).str.strip().to_numpy(dtype=object)
+        text[raw.isna().to_numpy(dtype=bool) | (text == "")] = CROSSTAB_MISSING
+    else:
+        text = np.full(len(pos), CROSSTAB_MISSING, dtype=object)
+    codes, names = pd.factorize(text)
+    freq = np.bincount(codes, minlength=len(names))
+    order = np.lexsort((np.asarray(names, dtype=str), -freq))
+    if len(order) > max_categories:
+        keep, rest = order[: max_categories - 1], order[max_categories - 1:]
+        remap = np.full(len(names), len(keep))
+        remap[keep] = np.arange(len(keep))
+        remap[rest] = len(keep)
+        codes = remap[codes]
+        names = [names[i] for i in keep] + [CROSSTAB_OTHER]
+    else:
+        remap = np.empty(len(names), dtype=np.int64)
+        remap[order] = np.arange(len(order))
+        codes = remap[codes]
+        names = [names[i] for i in order]
+    k = len(names)
+
+    # ---- (トピック, カテゴリー) の件数・合計スコアを一括で数える
+    topic_keys = np.concatenate([
+        ("1\x1f" + joined["topic_depth_1"]).to_numpy(dtype=object),
+        ("2\x1f" + joined["topic_depth_2"]).to_numpy(dtype=object),
+    ])
+    topic_codes, topic_names = pd.factorize(topic_keys)
+    cell = topic_codes * k + np.tile(codes, 2)
+    size = len(topic_names) * k
+    counts = np.bincount(cell, minlength=size).reshape(-1, k)
+    sums = np.bincount(cell, weights=np.tile(total[pos], 2), minlength=size).reshape(-1, k)
+
+    # ---- マスターテーブルの行（depth 1 は Broad 名、depth 2 は Medium 名で引く）に並べる
+    df_cross = create_master_dataframe(df_meta)[["depth", "Nomic Topic: Broad", "Nomic Topic: Medium"]]
+    row_keys = np.where(
+        df_cross["depth"] == "1",
+        "1\x1f" + df_cross["Nomic Topic: Broad"],
+        "2\x1f" + df_cross["Nomic Topic: Medium"],
+    )
+    idx = pd.Index(topic_names, dtype=object).get_indexer(row_keys)
+    found = idx >= 0
+    cell_counts = np.zeros((len(df_cross), k), dtype=np.int64)
+    cell_sums = np.zeros((len(df_cross), k))
+    cell_counts[found] = counts[idx[found]]
+    cell_sums[found] = sums[idx[found]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(cell_counts > 0, cell_sums / cell_counts, np.nan).round(2)
+
+    df_cross = df_cross.assign(アイデア数=cell_counts.sum(axis=1))
+    return pd.concat([
+        df_cross.reset_index(drop=True),
+        pd.DataFrame(cell_counts, columns=[f"{name}\nアイデア数" for name in names]),
+        pd.DataFrame(means, columns=[f"{name}\n平均スコア" for name in names]),
+    ], axis=1)
 
 
 # ==============================
 # 🔹 メイン統合処理
 # ==============================
 
-def prepare_master_dataframe(df_meta, df_topics, df_data,n,f,m,t,s,c):
-    """一連の処理をまとめて実行"""
+def prepare_master_dataframe(df_meta, df_topics, df_data,n,f,m,t,s,c, embeddings=None, dedup_threshold=None,
+                             keywords=False, workers=None, model=None):
+    """
+    一連の処理をまとめて実行（埋め込みとしきい値があれば重複検出、keywords=True なら特徴語も追加）。
+    model は採点モデル（scoring_module の定義 dict / ScoringModel、None なら既定の3軸均等）。
+    スコア列は最初に一度だけ数値化し、採点モデルも全行に一度だけ適用して、スコア系の列はすべてその結果から作る。
+    workers を指定すると、トピックの集計を Broad トピック単位でプロセスに分ける。
+    """
+    model = scoring_module.get_model(model)
+    scores = schema_module.score_matrix(df_data, *model.bind(n, f, m))
+    df_data = schema_module.typed_frame(df_data, scores)
+    scored = model.evaluate(scores, available=df_data.columns)
     df_master = create_master_dataframe(df_meta)
-    df_master = add_item_count(df_master, df_topics)
-    df_master = add_average_scores(df_master, df_topics, df_data,n,f,m)
-    df_master = add_excellent_ideas(df_master, df_topics, df_data,n,f,m)
-    df_master = add_detailed_scores(df_master, df_topics, df_data, n, f, m)
-    df_master = add_best_ideas(df_master, df_topics, df_data,n,f,m,t,s,c)
+    if keywords:
+        df_master = add_topic_keywords(df_master, df_topics, df_data, t, s)
+    df_master = add_topic_scores(df_master, df_topics, df_data, scored, t, s, c, workers=workers)
+    if embeddings is not None and dedup_threshold is not None:
+        df_master = add_duplicate_stats(df_master, df_topics, df_data, embeddings, scored, dedup_threshold)
     return df_master
+
+
+def append_master_dataframe(df_meta, df_topics, df_data, n, f, m, t, s, c, state_key, embeddings=None,
+                            dedup_threshold=None, keywords=False, workers=None, model=None):
+    """
+    追記モード：前回保存したトピックごとの集計状態（aggregate_module）に、
+    row_number が前回のウォーターマークより大きい行だけを集計して足し込み、マスターテーブルを作る。
+    トピックの再クラスタリング・マッピングや採点モデルの変更・処理済みの行の増減や
+    トピックの付け替えがあれば全件から作り直す。
+    スコア列の数値化と採点は新しい行だけ（最優秀アイデアの同点は row_number の小さい方）。
+    特徴語・重複検出は全行が必要なので、有効にした場合は従来どおり全件で計算する。
+
+    Returns:
+        (df_master, info)  info: {"mode": "append" / "rebuild", "reason", "new_rows", "watermark"}
+    """
+    model = scoring_module.get_model(model)
+    bound = model.bind(n, f, m)
+    sig = aggregate_module.signature(df_meta, (n, f, m, t, s, c), model)
+    data_rows = aggregate_module.row_numbers(df_data)
+    topic_rows = aggregate_module.row_numbers(df_topics)
+
+    state = aggregate_module.load_state(state_key)
+    reason = aggregate_module.stale_reason(state, sig, data_rows, topic_rows, df_topics)
+    if reason is None:
+        watermark = state.watermark
+        new, new_topic = data_rows > watermark, topic_rows > watermark
+    else:
+        watermark = -np.inf
+        new, new_topic = np.ones(len(df_data), dtype=bool), np.ones(len(df_topics), dtype=bool)
+
+    # 新しい行だけを row_number 順に並べて集計する（同点の最優秀アイデアは先に追加された行）
+    order = np.argsort(data_rows[new], kind="stable")
+    df_new = df_data[new].iloc[order].reset_index(drop=True)
+    scores = schema_module.score_matrix(df_new, *bound)
+    scored = model.evaluate(scores, available=df_data.columns)
+    fresh = topic_states(
+        df_topics[new_topic], schema_module.typed_frame(df_new, scores), scored, t, s, c, workers=workers
+    )
+    if reason is None:
+        states = aggregate_module.fold(state.frames, fresh, ["count"] + model.stat_fields() + ["assigned"])
+    else:
+        states = fresh
+
+    # row_number で区切れないデータは毎回作り直す（状態は保存しない）
+    if not (np.isnan(data_rows).any() or np.isnan(topic_rows).any()):
+        high = float(np.max(np.r_[data_rows, topic_rows, watermark]))
+        aggregate_module.save_state(state_key, aggregate_module.AggregateState(
+            sig, high, int((data_rows <= high).sum()), int((topic_rows <= high).sum()), states,
+            assignments=aggregate_module.assignment_hash(df_topics, topic_rows, high),
+        ))
+
+    df_master = create_master_dataframe(df_meta)
+    if keywords:
+        df_master = add_topic_keywords(df_master, df_topics, df_data, t, s)
+    df_master = apply_topic_states(df_master, states, model, scored.present)
+    if embeddings is not None and dedup_threshold is not None:
+        full = schema_module.score_matrix(df_data, *bound)
+        df_master = add_duplicate_stats(
+            df_master, df_topics, schema_module.typed_frame(df_data, full), embeddings,
+            model.evaluate(full, available=df_data.columns), dedup_threshold,
+        )
+    info = {"mode": "rebuild" if reason else "append", "reason": reason, "new_rows": int(new.sum()),
+            "watermark": watermark}
+    print(f"➕ Master {info['mode']}: {info['new_rows']} new row(s)" + (f" ({reason})" if reason else ""))
+    return df_master, info
+
@@ -0,0 +1,214 @@
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# ==============================
+# 🔹 トピック別の集計状態（マージ可能）
+# ==============================
+# 各グループの集計値は「行数」と、行ごとの値の列（sums）のグループ内合計。
+# パーティションごとの値を足し合わせれば全体の値になる。
+# sums の列の意味は呼び出し側（採点モデル）が決める（scoring_module.ScoringModel.stat_fields）。
+
+
+def partial_stats(codes, sums, total, pos):
+    """
+    グループコードごとの集計状態を求める（ループなし）。
+    sums: (行数, q) の float64。total: 最優秀アイデアを選ぶ合計スコア。pos: 元データの行位置。
+
+    Returns:
+        (keys, stats, best_total, best_pos)
+        keys: 出現したグループコード
+        stats: (len(keys), 1 + q) の float64（先頭列は行数、続いて sums の各列の合計）
+        best_total, best_pos: 合計スコア最大の行（同点は元データで先に出る行）
+    """
+    sums = np.asarray(sums, dtype=np.float64)
+    if sums.ndim == 1:
+        sums = sums.reshape(len(codes), -1)
+    if len(codes) == 0:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), np.empty((0, 1 + sums.shape[1])), empty, np.empty(0, dtype=np.int64)
+
+    keys, local = np.unique(codes, return_inverse=True)
+    k = len(keys)
+    stats = np.column_stack(
+        [np.bincount(local, minlength=k).astype(np.float64)]
+        + [np.bincount(local, weights=sums[:, j], minlength=k) for j in range(sums.shape[1])]
+    )
+
+    # グループ昇順・合計スコア降順・行位置昇順 → 各グループの先頭が最優秀
+    order = np.lexsort((pos, -total, local))
+    first = order[np.r_[0, np.flatnonzero(np.diff(local[order])) + 1]]
+    return keys, stats, total[first], pos[first]
+
+
+def merge_partials(partials):
+    """
+    partial_stats の結果（複数パーティション分）を1つにまとめる。
+    足し算と「合計スコア最大・同点は行位置の小さい方」の選択だけなので、順序に依存しない。
+    """
+    partials = [p for p in partials if len(p[0])]
+    if not partials:
+        return partial_stats(np.empty(0, dtype=np.int64), np.empty((0, 0)), np.empty(0), np.empty(0, dtype=np.int64))
+
+    keys = np.concatenate([p[0] for p in partials])
+    stats = np.concatenate([p[1] for p in partials])
+    best_total = np.concatenate([p[2] for p in partials])
+    best_pos = np.concatenate([p[3] for p in partials])
+
+    merged_keys, local = np.unique(keys, return_inverse=True)
+    merged = np.zeros((len(merged_keys), stats.shape[1]))
+    np.add.at(merged, local, stats)
+
+    order = np.lexsort((best_pos, -best_total, local))
+    first = order[np.r_[0, np.flatnonzero(np.diff(local[order])) + 1]]
+    return merged_keys, merged, best_total[first], best_pos[first]
+
+
+# ==============================
+# 🔹 共有メモリ
+# ==============================
+
+class SharedArrays:
+    """
+    numpy 配列を共有メモリに置き、子プロセスには名前・型・形だけを渡す（DataFrame を pickle しない）。
+    with ブロックを抜けると共有メモリを解放する。
+    """
+
+    def __init__(self, **arrays):
+        self._blocks = []
+        self.specs = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            self._blocks.append(shm)
+            self.specs[name] = (shm.name, arr.dtype.str, arr.shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+
+
+def _attach(specs):
+    """子プロセス側：共有メモリを開いて (ハンドル, 配列の dict) を返す"""
+    handles, arrays = [], {}
+    for name, (shm_name, dtype, shape) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return handles, arrays
+
+
+def _partition_worker(specs, lo, hi):
+    """1パーティション（Broad トピックのまとまり）分の集計状態を返す"""
+    handles, arr = _attach(specs)
+    try:
+        sl = slice(lo, hi)
+        sums, total, pos = arr["sums"][sl], arr["total"][sl], arr["pos"][sl]
+        # partial_stats の戻り値は新しく確保された配列なので、共有メモリを閉じても使える
+        result = (
+            partial_stats(arr["d1"][sl], sums, total, pos),
+            partial_stats(arr["d2"][sl], sums, total, pos),
+        )
+        del sums, total, pos
+    finally:
+        arr.clear()
+        for shm in handles:
+            shm.close()
+    return result
+
+
+# ==============================
+# 🔹 プロセスプール
+# ==============================
+# プールは CPU 数の大きさで1つだけ作り、作り直さない（他のジョブが使用中のプールを止めない）。
+# 呼び出しごとの並列数は、同時に投入するタスク数で抑える（run_limited）
+POOL_WORKERS = os.cpu_count() or 1
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """プロセス共有のプール（spawn：Streamlit のスレッドを fork しない）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=mp.get_context("spawn"))
+        return _pool
+
+
+def run_limited(fn, tasks, workers):
+    """
+    共有プールで fn(*task) を実行し、投入順の結果のリストを返す。
+    同時に実行中のタスクはこの呼び出しで workers 個まで（残りは空きが出てから投入する）。
+    """
+    pool = get_pool()
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    running = {}
+    next_task = 0
+    try:
+        while next_task < len(tasks) or running:
+            while next_task < len(tasks) and len(running) < workers:
+                running[pool.submit(fn, *tasks[next_task])] = next_task
+                next_task += 1
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    except BaseException:
+        # 失敗したら残りは投入せず、実行中のものが終わるのを待つ（呼び出し側が共有メモリを解放できるように）
+        wait(running)
+        raise
+    return results
+
+
+def _partitions(d1_sorted, n_parts):
+    """Broad トピックの境界で切り、行数がほぼ均等な (lo, hi) の列を作る"""
+    n = len(d1_sorted)
+    if n == 0:
+        return []
+    bounds = np.r_[0, np.flatnonzero(np.diff(d1_sorted)) + 1, n]
+    targets = np.linspace(0, n, n_parts + 1)[1:-1]
+    cuts = np.unique(bounds[np.searchsorted(bounds, targets)])
+    edges = np.unique(np.r_[0, cuts, n])
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def group_stats(d1, d2, sums, total, pos, *, workers=None):
+    """
+    Broad / Medium ごとの集計状態を求める。
+    workers が 2 以上なら Broad トピックでパーティションを切り、共有メモリ経由でプロセスプールに渡す
+    （同時に動くのはこの呼び出しで workers プロセスまで）。
+    結果は merge_partials で決定的にまとめる（完了順に依存しない）。
+
+    Returns:
+        (Broad の集計状態, Medium の集計状態) … それぞれ merge_partials の戻り値
+    """
+    if not workers or workers < 2 or len(d1) == 0:
+        return (
+            partial_stats(d1, sums, total, pos),
+            partial_stats(d2, sums, total, pos),
+        )
+
+    order = np.argsort(d1, kind="stable")
+    parts = _partitions(d1[order], workers * 4)
+    with SharedArrays(
+        d1=d1[order].astype(np.int64), d2=d2[order].astype(np.int64),
+        sums=sums[order].astype(np.float64), total=total[order].astype(np.float64),
+        pos=pos[order].astype(np.int64),
+    ) as shared:
+        results = run_limited(_partition_worker, [(shared.specs, lo, hi) for lo, hi in parts], workers)
+
+    return (
+        merge_partials([r[0] for r in results]),
+        merge_partials([r[1] for r in results]),
+    )
@@ -0,0 +1,248 @@
+import difflib
+import re
+import threading
+import unicodedata
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+# ==============================
+# 🔹 列の役割と候補名
+# ==============================
+# columns タプルの並び（n, f, m, t, s, c）と同じ順
+ROLES = ["novelty", "feasibility", "marketability", "title", "summary", "category"]
+SCORE_ROLES = ROLES[:3]
+
+# 指定列がデータに無いときに探す候補（比較は _normalize 後）
+ROLE_CANDIDATES = {
+    "novelty": ["novelty_score", "新規性スコア", "novelty", "新規性"],
+    "feasibility": ["feasibility_score", "実現可能性スコア", "実現性スコア", "feasibility", "実現可能性", "実現性"],
+    "marketability": ["marketability_score", "市場性スコア", "marketability", "市場性"],
+    "title": ["title", "タイトル", "アイデア名", "name"],
+    "summary": ["summary", "概要", "description", "説明"],
+    "category": ["category", "アイデアカテゴリー", "カテゴリー", "カテゴリ"],
+}
+
+# あいまい一致の下限（difflib の類似度）
+FUZZY_CUTOFF = 0.8
+
+
+def _normalize(name):
+    """比較用の列名（NFKC・小文字化し、空白・記号・アンダースコアを除く）"""
+    s = unicodedata.normalize("NFKC", str(name)).lower()
+    return re.sub(r"[\s_\-:()\[\]]+", "", s)
+
+
+def match_column(requested, role, columns):
+    """
+    指定列をデータの列名に突き合わせる。
+    完全一致 → 表記ゆれ（_normalize 後の一致）→ 役割の候補名 → あいまい一致 の順に探す。
+
+    Returns:
+        (列名 or None, 一致の種類)
+        一致の種類: "exact" / "normalized" / "candidate" / "fuzzy" / "missing"
+        "fuzzy" の列名は似た名前の候補にすぎない（_resolve はマッピングに使わず、レポートで知らせる）
+    """
+    columns = [col for col in columns if isinstance(col, str)]
+    if requested in columns:
+        return requested, "exact"
+
+    by_norm = {}
+    for col in columns:
+        by_norm.setdefault(_normalize(col), col)
+
+    if requested and _normalize(requested) in by_norm:
+        return by_norm[_normalize(requested)], "normalized"
+
+    for cand in ROLE_CANDIDATES.get(role, []):
+        if _normalize(cand) in by_norm:
+            return by_norm[_normalize(cand)], "candidate"
+
+    targets = [_normalize(requested)] if requested else []
+    targets += [_normalize(cand) for cand in ROLE_CANDIDATES.get(role, [])]
+    for target in targets:
+        close = difflib.get_close_matches(target, list(by_norm), n=1, cutoff=FUZZY_CUTOFF)
+        if close:
+            return by_norm[close[0]], "fuzzy"
+    return None, "missing"
+
+
+# ==============================
+# 🔹 列マッピングの解決と数値化チェック
+# ==============================
+
+def _coercion_stats(series):
+    """(数値化できない値の件数, 欠損件数, 例) を返す"""
+    # Arrow の列では数値化できなかった値が NaN（欠損ではない）になるので numpy にしてから判定する
+    numeric = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    missing = series.isna().to_numpy(dtype=bool)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return 0, int(missing.sum()), ""
+    text = series.astype(str).str.strip()
+    failed = np.isnan(numeric) & ~missing & (text != "").to_numpy(dtype=bool)
+    examples = ", ".join(text[failed].unique()[:3])
+    return int(failed.sum()), int(missing.sum()), examples
+
+
+def _resolve(available, columns):
+    """
+    (解決後の列名リスト, 一致の種類リスト, あいまい一致の候補リスト)。
+    同じ列を2つの役割に割り当てない（完全一致を優先）。
+    あいまい一致は別の列を取り違えるおそれがあるので、マッピングを書き換えずに候補として返すだけにする
+    （その役割は見つからなかった扱い）。
+    """
+    available = list(available)
+    resolved = list(columns)
+    kinds = [None] * len(ROLES)
+    suggestions = [None] * len(ROLES)
+
+    # 完全一致を先に確定し、残りの役割はまだ使われていない列から探す
+    for i, requested in enumerate(columns):
+        if requested in available:
+            kinds[i] = "exact"
+    taken = {columns[i] for i, kind in enumerate(kinds) if kind}
+    for i, (role, requested) in enumerate(zip(ROLES, columns)):
+        if kinds[i]:
+            continue
+        col, kinds[i] = match_column(requested, role, [c for c in available if c not in taken])
+        if kinds[i] == "fuzzy":
+            suggestions[i] = col
+        elif col is not None:
+            resolved[i] = col
+            taken.add(col)
+    return resolved, kinds, suggestions
+
+
+def resolve_fields(available, columns):
+    """列名の一覧（データセットのフィールドなど）に対して (n, f, m, t, s, c) を解決したタプル"""
+    return tuple(_resolve(available, columns)[0])
+
+
+def resolve_columns(df_data, columns, available=None):
+    """
+    Setting のマッピング (n, f, m, t, s, c) を df_data の列に合わせて解決する。
+    available を渡すと、その名前の一覧（列を絞って取得する前のフィールド一覧など）に対して突き合わせる。
+
+    Returns:
+        (解決後の columns タプル, レポート DataFrame)
+        解決できなかった役割（あいまい一致しかないものを含む）は元の指定のまま
+        （後段では全件 0 / 空として扱われる）。あいまい一致の列はレポートの「候補」に入れる
+    """
+    resolved, kinds, suggestions = _resolve(df_data.columns if available is None else available, columns)
+
+    rows = []
+    for i, role in enumerate(ROLES):
+        used = kinds[i] not in ("missing", "fuzzy")
+        failed, missing, examples = 0, 0, ""
+        if used and role in SCORE_ROLES and resolved[i] in df_data.columns:
+            failed, missing, examples = _coercion_stats(df_data[resolved[i]])
+        rows.append({
+            "役割": role,
+            "指定列": columns[i],
+            "使用列": resolved[i] if used else None,
+            "一致": kinds[i],
+            "候補": suggestions[i],
+            "数値化できない値": failed,
+            "欠損": missing,
+            "例": examples,
+        })
+    return tuple(resolved), pd.DataFrame(rows)
+
+
+def summarize(report):
+    """レポートを1行のメッセージにまとめる（ジョブの進捗表示用）"""
+    notes = []
+    for row in report.itertuples(index=False):
+        if row.一致 == "missing":
+            notes.append(f"{row.役割}: '{row.指定列}' not found")
+        elif row.一致 == "fuzzy":
+            notes.append(f"{row.役割}: '{row.指定列}' not found (did you mean '{row.候補}'? update the mapping in Setting)")
+        elif row.一致 != "exact":
+            notes.append(f"{row.役割}: '{row.指定列}' → '{row.使用列}' ({row.一致})")
+        if row.数値化できない値:
+            notes.append(f"{row.役割}: {row.数値化できない値} non-numeric value(s)")
+    return "; ".join(notes) if notes else f"All {len(report)} columns matched"
+
+
+def has_issues(report):
+    """自動補正・欠落（あいまい一致の候補のみを含む）・数値化失敗のいずれかがあるか"""
+    return bool(((report["一致"] != "exact") | (report["数値化できない値"] > 0)).any())
+
+
+# ==============================
+# 🔹 型付きスコア行列（一度だけ数値化して使い回す）
+# ==============================
+
+class ScoreMatrix:
+    """
+    スコア列を float64 にした (行数, 列数) の行列。df_data と同じ行順。
+    数値化できない値・欠損は NaN のまま持つ（0 埋めは filled() で）。
+    """
+
+    def __init__(self, values, columns):
+        self.values = values
+        self.columns = columns
+
+    def filled(self, fill=0.0):
+        """NaN を fill で埋めたコピー"""
+        return np.nan_to_num(self.values, nan=fill)
+
+    def column(self, i, fill=0.0):
+        """i 番目の列（score_matrix に渡した順。n, f, m なら 0=新規性, 1=実現性, 2=市場性）の NaN 埋め済み配列"""
+        return np.nan_to_num(self.values[:, i], nan=fill)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _remember(df, key, matrix):
+    """df が生きている間だけ行列を覚えておく"""
+    df_id = id(df)
+    with _cache_lock:
+        known = df_id in _cache
+        _cache[df_id] = (weakref.ref(df), key, matrix)
+    if not known:
+        weakref.finalize(df, _forget, df_id)
+
+
+def _forget(df_id):
+    with _cache_lock:
+        _cache.pop(df_id, None)
+
+
+def score_matrix(df_data, *columns):
+    """
+    df_data のスコア列（n, f, m や採点モデルの基準の列）を数値化した ScoreMatrix を返す。
+    同じ DataFrame・同じ列指定なら2回目以降は数値化せずキャッシュを返す。
+    """
+    key = tuple(columns)
+    with _cache_lock:
+        entry = _cache.get(id(df_data))
+    if entry is not None and entry[0]() is df_data and entry[1] == key:
+        return entry[2]
+
+    values = np.full((len(df_data), len(key)), np.nan)
+    for i, col in enumerate(key):
+        if col in df_data.columns:
+            values[:, i] = pd.to_numeric(df_data[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        else:
+            values[:, i] = 0.0
+    values.flags.writeable = False
+    matrix = ScoreMatrix(values, key)
+    _remember(df_data, key, matrix)
+    return matrix
+
+
+def typed_frame(df_data, matrix):
+    """
+    スコア列を行列の float64 列に差し替えた浅いコピー。
+    後段の numcol は文字列の再パースをせずに済み、同じ行列もキャッシュから引ける。
+    """
+    typed = df_data.assign(**{
+        col: matrix.values[:, i] for i, col in enumerate(matrix.columns) if col in df_data.columns
+    })
+    _remember(typed, matrix.columns, matrix)
+    return typed
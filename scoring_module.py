@@ -0,0 +1,351 @@
+import copy
+import json
+import re
+
+import numpy as np
+
+
+# ==============================
+# 🔹 採点モデルの定義
+# ==============================
+# criteria の並びがマスターテーブルの列の並び。
+# role を持つ基準は Setting のマッピング（novelty / feasibility / marketability）の列を使い、
+# それ以外は column にデータの列名を直接書く。
+DEFAULT_MODEL = {
+    "name": "3軸（均等）",
+    "total_threshold": 12,
+    "criteria": [
+        {"key": "novelty_score", "label": "新規性", "role": "novelty", "weight": 1, "threshold": 4},
+        {"key": "marketability_score", "label": "市場性", "role": "marketability", "weight": 1, "threshold": 4},
+        {"key": "feasibility_score", "label": "実現性", "detail_label": "実現可能性", "role": "feasibility",
+         "weight": 1, "threshold": 4},
+    ],
+}
+
+_ROLE_INDEX = {"novelty": 0, "feasibility": 1, "marketability": 2}
+
+
+class Criterion:
+    """採点基準1つ（スコア列・重み・しきい値・表示名）"""
+
+    def __init__(self, key, label, weight=1.0, threshold=4.0, role=None, column=None, detail_label=None):
+        self.key = key
+        self.label = label
+        self.weight = float(weight)
+        self.threshold = float(threshold)
+        self.role = role
+        self.column = column
+        self.detail_label = detail_label or label
+
+    def to_dict(self):
+        d = {"key": self.key, "label": self.label, "weight": self.weight, "threshold": self.threshold}
+        if self.role:
+            d["role"] = self.role
+        if self.column:
+            d["column"] = self.column
+        if self.detail_label != self.label:
+            d["detail_label"] = self.detail_label
+        return d
+
+
+class ScoringModel:
+    """
+    採点モデル：任意個の基準の加重和を合計スコアとし、
+    合計スコア・各基準のしきい値で「優秀」を数える。
+    """
+
+    def __init__(self, criteria, total_threshold=12.0, name=""):
+        self.criteria = list(criteria)
+        self.total_threshold = float(total_threshold)
+        self.name = name
+
+    @classmethod
+    def from_dict(cls, d):
+        """dict から作る（不正な定義は ValueError）"""
+        if not isinstance(d, dict):
+            raise ValueError("Scoring model must be a JSON object")
+        items = d.get("criteria")
+        if not isinstance(items, list) or not items:
+            raise ValueError("'criteria' must be a non-empty list")
+        criteria = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get("label"):
+                raise ValueError(f"criteria[{i}] needs a 'label'")
+            role = item.get("role")
+            if role is not None and role not in _ROLE_INDEX:
+                raise ValueError(f"criteria[{i}]: unknown role '{role}' (use {', '.join(_ROLE_INDEX)})")
+            if role is None and not item.get("column"):
+                raise ValueError(f"criteria[{i}] needs a 'role' or a 'column'")
+            try:
+                weight = float(item.get("weight", 1))
+                threshold = float(item.get("threshold", 4))
+            except (TypeError, ValueError):
+                raise ValueError(f"criteria[{i}]: weight and threshold must be numbers")
+            criteria.append(Criterion(
+                key=item.get("key") or item.get("column") or f"{role}_score",
+                label=item["label"],
+                weight=weight,
+                threshold=threshold,
+                role=role,
+                column=item.get("column"),
+                detail_label=item.get("detail_label"),
+            ))
+        labels = [c.label for c in criteria]
+        if len(set(labels)) != len(labels):
+            raise ValueError("Criterion labels must be unique")
+        try:
+            total_threshold = float(d.get("total_threshold", 12))
+        except (TypeError, ValueError):
+            raise ValueError("'total_threshold' must be a number")
+        return cls(criteria, total_threshold, d.get("name", ""))
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "total_threshold": self.total_threshold,
+            "criteria": [c.to_dict() for c in self.criteria],
+        }
+
+    # ---- 列の割り当て
+
+    def bind(self, n, f, m):
+        """各基準のスコア列名（role の基準は Setting のマッピング n, f, m を使う）"""
+        mapping = (n, f, m)
+        return tuple(mapping[_ROLE_INDEX[c.role]] if c.role else c.column for c in self.criteria)
+
+    def extra_fields(self):
+        """Setting のマッピング以外に取得が必要な列"""
+        return tuple(c.column for c in self.criteria if not c.role)
+
+    # ---- 評価
+
+    def compile(self):
+        """重み・しきい値を配列にまとめ、スコア行列に1回で適用できる形にする"""
+        return CompiledModel(self)
+
+    def evaluate(self, matrix, available=None):
+        """compile().evaluate(...) の省略形"""
+        return self.compile().evaluate(matrix, available)
+
+    # ---- マスターテーブルの列名
+
+    @staticmethod
+    def _points(value):
+        return f"{value:g}点以上"
+
+    def excellent_columns(self):
+        """(優秀アイデア数の列名, 優秀アイデア比率の列名)"""
+        pts = self._points(self.total_threshold)
+        return f"優秀アイデア数({pts})", f"優秀アイデアの比率({pts})"
+
+    def average_column(self, criterion):
+        return f"{criterion.label}平均スコア"
+
+    def detail_columns(self, criterion):
+        """(平均, 優秀アイデア数, 優秀アイデア比率) の列名"""
+        head = f"{criterion.key}({criterion.detail_label})"
+        pts = self._points(criterion.threshold)
+        return f"{head}\n平均スコア", f"{head}\n優秀アイデア数({pts})", f"{head}\n優秀アイデア比率({pts})"
+
+    def best_column(self, criterion):
+        return f"{criterion.label}スコア"
+
+    def dedup_column(self, criterion):
+        return f"重複除外{criterion.label}平均スコア"
+
+    def stat_fields(self):
+        """partial_stats に渡す加算列（ModelScores.sums の列）の名前"""
+        k = len(self.criteria)
+        return ["sum_total", "excellent"] + [f"sum_{i}" for i in range(k)] + [f"high_{i}" for i in range(k)]
+
+
+class ModelScores:
+    """
+    採点モデルを df_data の全行に1回適用した結果（行順は df_data と同じ）。
+
+    values: (行数, 基準数) の float64（欠損・数値化できない値は 0）
+    total: 加重合計スコア
+    high: 各基準がしきい値以上か (行数, 基準数)
+    excellent: 合計スコアがしきい値以上か
+    present: 各基準の列がデータにあるか
+    """
+
+    def __init__(self, model, values, total, high, excellent, present):
+        self.model = model
+        self.values = values
+        self.total = total
+        self.high = high
+        self.excellent = excellent
+        self.present = present
+
+    def sums(self, pos=None):
+        """グループ集計で足し合わせる列をまとめた (行数, 2 + 2 × 基準数) 行列（stat_fields の順）"""
+        sl = slice(None) if pos is None else pos
+        return np.column_stack([
+            self.total[sl], self.excellent[sl], self.values[sl], self.high[sl],
+        ]).astype(np.float64)
+
+
+class CompiledModel:
+    """ScoringModel の重み・しきい値をベクトル化したもの"""
+
+    def __init__(self, model):
+        self.model = model
+        self.weights = np.array([c.weight for c in model.criteria], dtype=np.float64)
+        self.thresholds = np.array([c.threshold for c in model.criteria], dtype=np.float64)
+        self.total_threshold = model.total_threshold
+        # 合計を足す順番：role の基準を novelty → feasibility → marketability（元の実装の n + f + m）、
+        # そのあと column の基準を定義順に。浮動小数点の和は順番で末尾の桁が変わるので、
+        # 既定モデルの合計スコアを元の実装とビット単位で一致させる
+        self.sum_order = sorted(
+            range(len(model.criteria)),
+            key=lambda i: (_ROLE_INDEX.get(model.criteria[i].role, len(_ROLE_INDEX)), i),
+        )
+
+    def evaluate(self, matrix, available=None):
+        """
+        型付きスコア行列（schema_module.ScoreMatrix、列は bind の順）に一括で適用する。
+        合計は基準ごとの列ベクトルを sum_order の順に足し、しきい値判定は配列同士の比較1回。
+        available（データの列名）を渡すと、無い列の基準を present=False にする。
+        """
+        values = matrix.filled()
+        total = np.zeros(len(values), dtype=np.float64)
+        for i in self.sum_order:
+            total += values[:, i] * self.weights[i]
+        high = values >= self.thresholds
+        excellent = total >= self.total_threshold
+        if available is None:
+            present = np.ones(len(self.weights), dtype=bool)
+        else:
+            available = set(available)
+            present = np.array([col in available for col in matrix.columns], dtype=bool)
+        return ModelScores(self.model, values, total, high, excellent, present)
+
+
+def get_model(model=None):
+    """None / dict / ScoringModel を ScoringModel にする（None は既定の3軸モデル）"""
+    if model is None:
+        return ScoringModel.from_dict(DEFAULT_MODEL)
+    if isinstance(model, ScoringModel):
+        return model
+    return ScoringModel.from_dict(model)
+
+
+def parse_model(text):
+    """Setting の JSON テキスト → (ScoringModel, err)"""
+    try:
+        return ScoringModel.from_dict(json.loads(text)), None
+    except json.JSONDecodeError as e:
+        return None, f"Invalid JSON: {e}"
+    except ValueError as e:
+        return None, str(e)
+
+
+def default_model_dict():
+    return copy.deepcopy(DEFAULT_MODEL)
+
+
+# ==============================
+# 🔹 マスターテーブルのグループ境界
+# ==============================
+
+def group_right_edges(columns):
+    """
+    惑星の枠線でグループの左端に線を引く列（0始まり）を、マスターテーブルの列名から求める。
+    アイデア数 / 優秀アイデア数 / 各基準の詳細 / 最優秀アイデア の各グループの先頭。
+    既定の3軸モデルでは [5, 10, 12, 15, 18, 21]。
+    """
+    columns = [str(col) for col in columns]
+    edges = []
+    for j, col in enumerate(columns):
+        if col in ("アイデア数", "アイデア名") or col.startswith("優秀アイデア数(") or col.endswith("\n平均スコア"):
+            edges.append(j)
+    return edges
+
+
+# ==============================
+# 🔹 マスターテーブルの列の役割（列ごとの書式の割り当て）
+# ==============================
+# 基準の数によらず名前の決まっている列（役割名は列名そのもの）
+_FIXED_COLUMNS = ("depth", "topic_id", "Nomic Topic: Broad", "Nomic Topic: Medium", "キーワード", "アイデア数",
+                  "平均スコア", "アイデア名", "Summary", "カテゴリー", "合計スコア")
+_COL_LETTERS_RE = re.compile(r"^[A-Za-z]+$")
+
+
+def column_role(col):
+    """
+    マスターテーブルの列名 → 列の役割。基準ごとに並ぶ列は、どの基準でも同じ役割になる。
+    重複検出の列など、書式の割り当て対象でない列は None。
+    """
+    col = str(col)
+    if col in _FIXED_COLUMNS:
+        return col
+    if col.startswith("優秀アイデア数("):
+        return "excellent_count"
+    if col.startswith("優秀アイデアの比率("):
+        return "excellent_ratio"
+    if "\n" in col:
+        detail = col.split("\n", 1)[1]
+        if detail == "平均スコア":
+            return "detail_mean"
+        if detail.startswith("優秀アイデア数("):
+            return "detail_count"
+        if detail.startswith("優秀アイデア比率("):
+            return "detail_ratio"
+        return None
+    if col.startswith("重複"):
+        return None
+    if col.endswith("平均スコア"):
+        return "criterion_mean"
+    if col.endswith("スコア"):
+        return "best_score"
+    return None
+
+
+def _default_roles():
+    """既定の3軸モデルのマスターテーブルの列の役割の並び（design/defalte.json の列記号はこの並びで書かれている）"""
+    k = len(DEFAULT_MODEL["criteria"])
+    return (list(_FIXED_COLUMNS[:7]) + ["criterion_mean"] * k + ["excellent_count", "excellent_ratio"]
+            + ["detail_mean", "detail_count", "detail_ratio"] * k + list(_FIXED_COLUMNS[7:]) + ["best_score"] * k)
+
+
+def _with_occurrence(roles):
+    """役割の並び → (役割, 同じ役割の中で何番目か) の並び"""
+    seen = {}
+    out = []
+    for role in roles:
+        out.append((role, seen.get(role, 0)))
+        if role is not None:
+            seen[role] = seen.get(role, 0) + 1
+    return out
+
+
+def style_targets(col_key, columns):
+    """
+    書式設定の列指定（"A" / 1始まりの番号 / 列名）→ その書式を当てる列の番号（0始まり）のリスト。
+    列記号・番号は既定の3軸モデルの並びでの位置として読み、その位置の列と同じ役割の列を columns から探す。
+    同じ役割の列が並ぶとき（基準ごとの列）は何番目かで対応させ、基準が既定より多いときは
+    その役割の最後の列の書式を増えた列にも当てる。既定の並びの外の位置はそのままの位置、列名はその列。
+    """
+    columns = [str(col) for col in columns]
+    if isinstance(col_key, str) and not _COL_LETTERS_RE.match(col_key):
+        return [columns.index(col_key)] if col_key in columns else []
+    if isinstance(col_key, int):
+        position = col_key - 1
+    elif isinstance(col_key, str):
+        position = 0
+        for ch in col_key.upper():
+            position = position * 26 + (ord(ch) - 64)
+        position -= 1
+    else:
+        raise ValueError(f"Unknown column spec: {col_key}")
+
+    default = _with_occurrence(_default_roles())
+    if not 0 <= position < len(default):
+        return [position] if 0 <= position < len(columns) else []
+    role, nth = default[position]
+    last = max(n for r, n in default if r == role)
+    return [
+        j for j, (r, n) in enumerate(_with_occurrence(column_role(col) for col in columns))
+        if r == role and (n == nth or (nth == last and n > last))
+    ]
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import nomic_module
+
+
+# ==============================
+# 🔹 アイデア全文検索インデックス（SQLite FTS5）
+# ==============================
+SEARCH_DB = os.path.join(".cache", "search.sqlite")
+
+# trigram トークナイザは語の区切りが無い日本語でも部分一致で引ける（3文字以上のクエリ）
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ideas (
+    id            INTEGER PRIMARY KEY,
+    map_id        TEXT NOT NULL,
+    row_number    INTEGER NOT NULL,
+    row_hash      INTEGER NOT NULL,
+    title         TEXT,
+    summary       TEXT,
+    category      TEXT,
+    broad         TEXT,
+    medium        TEXT,
+    total_score   REAL,
+    novelty       REAL,
+    feasibility   REAL,
+    marketability REAL,
+    UNIQUE (map_id, row_number)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS ideas_fts USING fts5(
+    title, summary, category,
+    content='ideas', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS ideas_ai AFTER INSERT ON ideas BEGIN
+    INSERT INTO ideas_fts (rowid, title, summary, category) VALUES (new.id, new.title, new.summary, new.category);
+END;
+CREATE TRIGGER IF NOT EXISTS ideas_ad AFTER DELETE ON ideas BEGIN
+    INSERT INTO ideas_fts (ideas_fts, rowid, title, summary, category)
+    VALUES ('delete', old.id, old.title, old.summary, old.category);
+END;
+CREATE TABLE IF NOT EXISTS index_state (
+    map_id      TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    updated_at  TEXT NOT NULL
+);
+"""
+
+_FIELDS = ["row_number", "title", "summary", "category", "broad", "medium",
+           "total_score", "novelty", "feasibility", "marketability"]
+
+
+@contextmanager
+def _connect(db_path):
+    """スキーマを用意した接続（ブロックを抜けるとコミットして閉じる）"""
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _index_frame(df_topics, df_data, t, s, c, n, f, m):
+    """インデックスに入れる列だけの表（Setting のマッピングに従う）"""
+    df_ideas = nomic_module.build_idea_table(df_topics, df_data)
+
+    def text(col):
+        if col and col in df_ideas.columns:
+            return df_ideas[col].astype(str).where(df_ideas[col].notna(), "")
+        return pd.Series("", index=df_ideas.index)
+
+    novelty = nomic_module.numcol(df_ideas, n)
+    feasibility = nomic_module.numcol(df_ideas, f)
+    marketability = nomic_module.numcol(df_ideas, m)
+    df = pd.DataFrame({
+        "row_number": df_ideas["row_number"].astype("int64"),
+        "title": text(t),
+        "summary": text(s),
+        "category": text(c),
+        "broad": df_ideas.get("Nomic Topic: Broad", pd.Series("", index=df_ideas.index)).astype(str),
+        "medium": df_ideas.get("Nomic Topic: Medium", pd.Series("", index=df_ideas.index)).astype(str),
+        "total_score": novelty + feasibility + marketability,
+        "novelty": novelty,
+        "feasibility": feasibility,
+        "marketability": marketability,
+    })
+    df["row_hash"] = pd.util.hash_pandas_object(df, index=False).to_numpy().view("int64")
+    return df
+
+
+def update_index(map_url, df_topics, df_data, t, s, c, n, f, m, domain=None, db_path=SEARCH_DB):
+    """
+    マップのスナップショットをインデックスに反映する。
+    行ごとのハッシュを比べ、変わった行・消えた行だけを削除／追加する（差分更新）。
+    map_id は "<domain>/<map_name>"（nomic_module.map_key。履歴と同じキー）。
+    戻り値: (追加行数, 削除行数)
+    """
+    map_id = nomic_module.map_key(domain, map_url)
+    df = _index_frame(df_topics, df_data, t, s, c, n, f, m)
+    fingerprint = hashlib.sha1(df["row_hash"].sort_values().to_numpy().tobytes()).hexdigest()
+
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT fingerprint FROM index_state WHERE map_id = ?", (map_id,)).fetchone()
+        if row and row[0] == fingerprint:
+            return 0, 0
+
+        existing = pd.read_sql_query(
+            "SELECT id, row_number, row_hash FROM ideas WHERE map_id = ?", conn, params=(map_id,)
+        )
+        merged = existing.merge(df[["row_number", "row_hash"]], on="row_number", how="outer",
+                                suffixes=("_old", ""), indicator=True)
+        stale = merged[(merged["_merge"] == "left_only")
+                       | ((merged["_merge"] == "both") & (merged["row_hash_old"] != merged["row_hash"]))]
+        fresh_rows = merged.loc[(merged["_merge"] == "right_only")
+                                | ((merged["_merge"] == "both") & (merged["row_hash_old"] != merged["row_hash"])),
+                                "row_number"]
+
+        conn.executemany("DELETE FROM ideas WHERE id = ?", ((int(i),) for i in stale["id"]))
+        fresh = df[df["row_number"].isin(fresh_rows)]
+        conn.executemany(
+            f"INSERT INTO ideas (map_id, row_hash, {', '.join(_FIELDS)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(_FIELDS))})",
+            (
+                (map_id, int(h), *vals)
+                for h, vals in zip(fresh["row_hash"], fresh[_FIELDS].itertuples(index=False, name=None))
+            ),
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO index_state (map_id, fingerprint, updated_at) VALUES (?, ?, ?)",
+            (map_id, fingerprint, datetime.now(timezone.utc).isoformat()),
+        )
+    print(f"🔎 Search index updated for {map_id}: +{len(fresh)} / -{len(stale)}")
+    return len(fresh), len(stale)
+
+
+# ==============================
+# 🔹 検索
+# ==============================
+
+_RESULT_COLUMNS = {
+    "row_number": "row_number",
+    "title": "アイデア名",
+    "summary": "Summary",
+    "category": "カテゴリー",
+    "broad": "Nomic Topic: Broad",
+    "medium": "Nomic Topic: Medium",
+    "total_score": "合計スコア",
+    "novelty": "新規性スコア",
+    "marketability": "市場性スコア",
+    "feasibility": "実現性スコア",
+}
+
+
+def search(map_url, query, limit=50, domain=None, db_path=SEARCH_DB):
+    """
+    アイデアを検索し、関連度順（bm25）に返す（domain は update_index と同じ）。
+    3文字以上の語は FTS の trigram 索引で、2文字以下の語は部分一致の絞り込みで扱う。
+    """
+    map_id = nomic_module.map_key(domain, map_url)
+    terms = [w for w in str(query).split() if w]
+    if not terms:
+        return pd.DataFrame(columns=list(_RESULT_COLUMNS.values()))
+
+    long_terms = [w for w in terms if len(w) >= 3]
+    short_terms = [w for w in terms if len(w) < 3]
+    select = ", ".join(f"i.{col}" for col in _RESULT_COLUMNS)
+    short_filter = "".join(
+        " AND (instr(i.title, ?) > 0 OR instr(i.summary, ?) > 0 OR instr(i.category, ?) > 0)"
+        for _ in short_terms
+    )
+    short_params = [w for w in short_terms for _ in range(3)]
+
+    with _connect(db_path) as conn:
+        if long_terms:
+            match = " AND ".join('"' + w.replace('"', '""') + '"' for w in long_terms)
+            sql = (
+                f"SELECT {select}, bm25(ideas_fts) AS rank "
+                "FROM ideas_fts JOIN ideas AS i ON i.id = ideas_fts.rowid "
+                f"WHERE ideas_fts MATCH ? AND i.map_id = ?{short_filter} "
+                "ORDER BY rank LIMIT ?"
+            )
+            params = [match, map_id, *short_params, int(limit)]
+        else:
+            sql = (
+                f"SELECT {select}, NULL AS rank FROM ideas AS i "
+                f"WHERE i.map_id = ?{short_filter} "
+                "ORDER BY i.total_score DESC LIMIT ?"
+            )
+            params = [map_id, *short_params, int(limit)]
+        df = pd.read_sql_query(sql, conn, params=params)
+
+    return df.drop(columns="rank").rename(columns=_RESULT_COLUMNS)
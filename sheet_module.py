@@ -1,7 +1,6 @@
 # sheets_writer.py
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from gspread_dataframe import set_with_dataframe
 from googleapiclient.discovery import build
 from gspread_formatting import (
     CellFormat,
@@ -10,99 +9,1036 @@ from gspread_formatting import (
     Color,
 )
 
+import hashlib
 import json
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 import colorsys
 
+import scoring_module
+
 def extract_spreadsheet_id(url) -> str:
     m = re.search(r"/spreadsheets/d/([a-zA-Z0-9-_]+)", url)
     return m.group(1) if m else url
 
 
-def write_sheet(spreadsheet_url, sheet_name, service_account_info, df_master, style_config):
+def _sheets_service(spreadsheet):
+    """Sheets API クライアント（ドライラン用のスプレッドシートなら送信せずに記録するクライアント）"""
+    recorder = getattr(spreadsheet, "recorder", None)
+    if recorder is not None:
+        return recorder
+    return build("sheets", "v4", credentials=spreadsheet.client.auth)
+
+
+def open_worksheet(spreadsheet_url, sheet_name, service_account_info, rows=100, cols=26):
+    """サービスアカウントで認証し、ワークシートを開く（無ければ rows×cols で作成）"""
+    scope = [
+        "https://spreadsheets.google.com/feeds",
+        "https://www.googleapis.com/auth/drive",
+    ]
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(service_account_info, scope)
+    client = gspread.authorize(creds)
+
+    spreadsheet_id = extract_spreadsheet_id(spreadsheet_url)
+    spreadsheet = client.open_by_key(spreadsheet_id)
     try:
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(service_account_info, scope)
-        client = gspread.authorize(creds)
-
-        # --- Open spreadsheet and worksheet ---
-        spreadsheet_id = extract_spreadsheet_id(spreadsheet_url)
-        spreadsheet = client.open_by_key(spreadsheet_id)
-        try:
-            worksheet = spreadsheet.worksheet(sheet_name)
-        except gspread.WorksheetNotFound:
-            worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=100, cols=26)
-
-        # --- Clear and write DataFrame ---
-        worksheet.clear()
-        set_with_dataframe(worksheet, df_master, include_column_header=True, resize=True)
-        reset_sheet(worksheet)
-        base_sheet_design(worksheet, df_master)
-
-        header_cfg = style_config.get("header", {})
-        apply_header_style(
-            worksheet,
-            df_master,
+        worksheet = spreadsheet.worksheet(sheet_name)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title=sheet_name, rows=max(1, rows), cols=max(1, cols))
+    return worksheet
+
+
+class PreparedSheet:
+    """
+    データに依存しない準備（認証・ワークシートを開く・書式手順の組み立て）を済ませた書き込み先。
+    prepare_sheet で作り、write_sheet(prepared=...) に渡す。シートの内容・書式にはまだ手を付けていない。
+    """
+
+    def __init__(self, worksheet, steps):
+        self.worksheet = worksheet
+        self.steps = steps
+
+
+def style_steps(style_config, paste_csv=False, rules_cleared=False):
+    """
+    書き込み〜書式適用の手順 [(名前, fn(worksheet, df))] を style_config から組み立てる（データは実行時に渡す）。
+    rules_cleared=True なら reset_sheet はフィルタ・条件付き書式の削除を省く（先に clear_sheet_rules の手順がある場合）。
+    """
+    column_cfg = style_config.get("columns", {})
+    header_cfg = style_config.get("header", {})
+    planet_cfg = style_config.get("planet", {})
+
+    steps = [
+        ("write_values", lambda ws, df: write_values(ws, df, paste_csv=paste_csv)),
+        ("reset_sheet", lambda ws, df: reset_sheet(
+            ws, num_rows=len(df) + 1, num_cols=len(df.columns), rules_cleared=rules_cleared,
+        )),
+        ("base_sheet_design", lambda ws, df: base_sheet_design(ws, df)),
+        ("apply_header_style", lambda ws, df: apply_header_style(
+            ws,
+            df,
             backgroundColor=header_cfg.get("backgroundColor", "#356854"),
             textColor=header_cfg.get("textColor", "#FFFFFF"),
             bold=header_cfg.get("bold", True),
             fontSize=header_cfg.get("fontSize", 10),
             header_height_px=header_cfg.get("header_height_px", 40),
-        )
-        apply_filter_to_header(worksheet, df_master)
-        apply_wrap_text_to_header_row(worksheet, df_master)
-
-        planet_cfg = style_config.get("planet", {})
-        apply_planet_border(
-            worksheet,
-            df_master,
+        )),
+        ("apply_filter_to_header", lambda ws, df: apply_filter_to_header(ws, df)),
+        ("apply_wrap_text_to_header_row", lambda ws, df: apply_wrap_text_to_header_row(ws, df)),
+        ("apply_planet_border", lambda ws, df: apply_planet_border(
+            ws,
+            df,
             has_planet=planet_cfg.get("has_planet", True),
             planet_color=planet_cfg.get("planet_color", "#356854"),
             start_row=planet_cfg.get("start_row", 1),
             start_col=planet_cfg.get("start_col", 1),
-        )
+        )),
+        ("dropdowns", lambda ws, df: dropdowns(ws, df)),
+    ]
+    for col_key, params in column_cfg.items():
+        steps.append((f"style_column[{col_key}]",
+                      lambda ws, df, col_key=col_key, params=params: style_columns(ws, df, col_key, params)))
+    return steps
+
+
+def style_columns(worksheet, df, col_key, params):
+    """
+    書式設定の列指定1つ分の style_column を、採点モデルに合わせた実際の列に当てる。
+    列記号は既定の3軸モデルの並びでの位置なので、基準の数で列がずれても同じ種類の列に当たる
+    （scoring_module.style_targets）。
+    """
+    if df is None:
+        return
+    for j in scoring_module.style_targets(col_key, df.columns):
+        style_column(worksheet, df, j + 1, **params)
+
 
-        dropdowns(worksheet, df_master)
+def prepare_sheet(spreadsheet_url, sheet_name, service_account_info, style_config, paste_csv=False,
+                  template=False):
+    """
+    書き込み先の準備のうち、データに依存しない部分を済ませた PreparedSheet を返す（失敗は例外）。
+    Nomic の取得・マスターテーブルの計算と並行して実行できるよう、ここでは認証・ワークシートを開く
+    （無ければ作る）・手順の組み立てだけを行い、既存のシートの値・書式は変えない。
+    取得や計算が失敗・キャンセルされても、シートは元のまま残る。
+    前回のフィルタと条件付き書式の削除は、書き込みの最初の手順（clear_sheet_rules）で行う。
+    template=True ならシートはテンプレートの複製に置き換わるので、前回のルールは消さない。
+    """
+    worksheet = open_worksheet(spreadsheet_url, sheet_name, service_account_info)
+    if template:
+        return PreparedSheet(worksheet, template_steps(style_config, paste_csv))
+    steps = [("clear_sheet_rules", lambda ws, df: clear_sheet_rules(ws))]
+    return PreparedSheet(worksheet, steps + style_steps(style_config, paste_csv, rules_cleared=True))
 
-        column_cfg = style_config.get("columns", {})
-        for col_key, params in column_cfg.items():
-            style_column(worksheet, df_master, col_key, **params)
+
+def write_sheet(spreadsheet_url, sheet_name, service_account_info, df_master, style_config, paste_csv=False,
+                on_step=None, dry_run=False, prepared=None, template=False):
+    """
+    df_master をシートへ書き込み、style_config の書式を適用する。
+    on_step: (完了ステップ数, 全ステップ数) を受け取るコールバック（任意）。
+             例外を投げると書き込みを中断できる（ジョブのキャンセル用）。その例外は (None, err) にせず呼び出し元へ投げ直す。
+    dry_run: True なら通信せず、送るはずのリクエストと件数・バイト数・クォータ見積もりを
+             (plan, None) で返す（plan は build_dry_run_plan の形式）。
+    prepared: prepare_sheet の結果。渡すとワークシートを開き直さず、その準備済みの手順で書き込む。
+    template: True ならテンプレートワークシートを複製して値とプルダウンだけを書き込む（template_steps）。
+    """
+    num_rows, num_cols = len(df_master) + 1, len(df_master.columns)
+    interrupted = None
+
+    try:
+        if dry_run:
+            worksheet = DryRunWorksheet(sheet_name, num_rows, num_cols)
+            if template:
+                # テンプレートは作成済みとして見積もる（複製・値・プルダウンだけ。初回は作成の書式設定も加わる）
+                worksheet.spreadsheet.existing.append(
+                    DryRunWorksheet(template_title(style_config, df_master), sheet_id=1)
+                )
+                steps = template_steps(style_config, paste_csv)
+            else:
+                steps = style_steps(style_config, paste_csv)
+        elif prepared is not None:
+            worksheet, steps = prepared.worksheet, prepared.steps
+        else:
+            # --- Open spreadsheet and worksheet ---
+            worksheet = open_worksheet(
+                spreadsheet_url, sheet_name, service_account_info, rows=num_rows, cols=num_cols,
+            )
+            steps = template_steps(style_config, paste_csv) if template else style_steps(style_config, paste_csv)
+        spreadsheet_id = worksheet.spreadsheet.id
+
+        # --- 値の書き込み → 書式リセット → 各フォーマッタ ---
+        for done, (name, run) in enumerate(steps, start=1):
+            if dry_run:
+                worksheet.spreadsheet.recorder.step = name
+            result = run(worksheet, df_master)
+            if name == "clone_template":
+                worksheet = result
+            if on_step:
+                try:
+                    on_step(done, len(steps))
+                except Exception as e:
+                    interrupted = e
+                    raise
+
+        if dry_run:
+            plan = build_dry_run_plan(worksheet.spreadsheet.recorder, sheet_name, df_master)
+            if template:
+                plan["warnings"].append(
+                    "Template mode: assumes the template worksheet already exists "
+                    "(the first run, or a changed design or column layout, also builds it with full styling)"
+                )
+            return plan, None
 
         print(f"✅ Successfully wrote data to '{sheet_name}' in spreadsheet {spreadsheet_id}")
         return worksheet.url, None
 
     except Exception as e:
+        if e is interrupted:
+            print("⏹ Sheet write interrupted")
+            raise
         print(f"❌ Failed to write to sheet: {e}")
+        return None, str(e) or type(e).__name__
+
+
+# ===============================
+# 🧩 テンプレートワークシート（書式は一度だけ作り、出力ごとに複製する）
+# ===============================
+# 書式（リセット・交互色・ヘッダー・フィルター・折り返し・惑星の枠線・列スタイル）を適用した
+# 非表示のテンプレートをスプレッドシートに1枚作っておき、出力のたびに duplicateSheet で複製して
+# 値だけを書き込む。値に依存するプルダウン（C/D列）だけは出力ごとに付ける。
+# テンプレートは 書式設定（design/defalte.json の内容）・列の並び・行数の枠 のハッシュで見分け、
+# どれかが変わったら作り直す。
+TEMPLATE_PREFIX = "_template_"
+# テンプレートの行数の枠（データ行数以上の2のべき乗。複製後に実際の行数まで縮める）
+TEMPLATE_MIN_ROWS = 256
+# テンプレートでは適用しない（値に依存する）手順
+_DATA_STEPS = ("write_values", "dropdowns")
+
+
+def template_capacity(num_rows):
+    """データ行数 num_rows を収めるテンプレートの行数の枠"""
+    capacity = TEMPLATE_MIN_ROWS
+    while capacity < num_rows:
+        capacity *= 2
+    return capacity
+
+
+def template_key(style_config, columns, capacity):
+    """テンプレートを見分けるハッシュ（書式設定・列の並び・行数の枠）"""
+    payload = json.dumps(
+        {"style": style_config, "columns": [str(c) for c in columns], "capacity": capacity},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def template_title(style_config, df):
+    """df の列・行数に合うテンプレートワークシートの名前"""
+    return TEMPLATE_PREFIX + template_key(style_config, df.columns, template_capacity(len(df)))
+
+
+def ensure_template(spreadsheet, style_config, df):
+    """
+    df の列・行数に合うテンプレートワークシートを返す（無ければ作る）。
+    作るときは空の値で全書式を適用して非表示にし、古いテンプレートは削除する。
+    """
+    capacity = template_capacity(len(df))
+    title = template_title(style_config, df)
+    worksheets = spreadsheet.worksheets()
+    for ws in worksheets:
+        if ws.title == title:
+            return ws
+
+    blank = pd.DataFrame("", index=range(capacity), columns=df.columns)
+    template = spreadsheet.add_worksheet(title=title, rows=capacity + 1, cols=max(1, len(df.columns)))
+    write_values(template, blank)
+    for name, run in style_steps(style_config):
+        if name not in _DATA_STEPS:
+            run(template, blank)
+
+    service = _sheets_service(spreadsheet)
+    requests = [{
+        "updateSheetProperties": {
+            "properties": {"sheetId": template.id, "hidden": True},
+            "fields": "hidden",
+        }
+    }]
+    requests += [{"deleteSheet": {"sheetId": ws.id}} for ws in worksheets if ws.title.startswith(TEMPLATE_PREFIX)]
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet.id, body={"requests": requests}).execute()
+    print(f"🧩 Template worksheet '{title}' built ({capacity} rows)")
+    return template
+
+
+def clone_template(worksheet, template, df, style_config):
+    """
+    worksheet をテンプレートの複製に置き換える（同じ名前・同じ位置）。1回の batchUpdate で
+    複製 → 表示・行数を df に合わせる → 元のシートを削除 → 名前を戻す → フィルター範囲と惑星の下端を引き直す。
+    元のシートは削除されるので、他のシートからそのシートへの参照は切れる。
+    """
+    spreadsheet = worksheet.spreadsheet
+    service = _sheets_service(spreadsheet)
+    num_rows, num_cols = len(df) + 1, max(1, len(df.columns))
+    new_id = int.from_bytes(os.urandom(4), "big") & 0x7FFFFFFF
+    planet_cfg = style_config.get("planet", {})
+
+    requests = [
+        {
+            "duplicateSheet": {
+                "sourceSheetId": template.id,
+                "insertSheetIndex": worksheet.index,
+                "newSheetId": new_id,
+                "newSheetName": f"{worksheet.title} ({new_id})",
+            }
+        },
+        {
+            "updateSheetProperties": {
+                "properties": {
+                    "sheetId": new_id,
+                    "hidden": False,
+                    "gridProperties": {"rowCount": num_rows, "columnCount": num_cols},
+                },
+                "fields": "hidden,gridProperties.rowCount,gridProperties.columnCount",
+            }
+        },
+        {"deleteSheet": {"sheetId": worksheet.id}},
+        {
+            "updateSheetProperties": {
+                "properties": {"sheetId": new_id, "title": worksheet.title},
+                "fields": "title",
+            }
+        },
+    ]
+    if not df.empty:
+        requests.append({
+            "setBasicFilter": {
+                "filter": {
+                    "range": {
+                        "sheetId": new_id,
+                        "startRowIndex": 0,
+                        "endRowIndex": num_rows,
+                        "startColumnIndex": 0,
+                        "endColumnIndex": len(df.columns),
+                    }
+                }
+            }
+        })
+    if not df.empty and planet_cfg.get("has_planet", True):
+        start_row, start_col = planet_cfg.get("start_row", 1), planet_cfg.get("start_col", 1)
+        requests.append({
+            "updateBorders": {
+                "range": {
+                    "sheetId": new_id,
+                    "startRowIndex": start_row - 1 + len(df),
+                    "endRowIndex": start_row + len(df),
+                    "startColumnIndex": start_col - 1,
+                    "endColumnIndex": start_col - 1 + len(df.columns),
+                },
+                "bottom": {
+                    "style": "SOLID", "width": 2,
+                    "color": _hex_to_rgb_color(planet_cfg.get("planet_color", "#356854")),
+                },
+            }
+        })
+    service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet.id, body={"requests": requests}).execute()
+
+    if getattr(spreadsheet, "recorder", None) is not None:
+        # ドライラン：以降の手順も同じ記録先に送る
+        clone = DryRunWorksheet(worksheet.title, num_rows, num_cols, sheet_id=new_id)
+        clone.spreadsheet = spreadsheet
+        return clone
+    return gspread.Worksheet(spreadsheet, {
+        "sheetId": new_id,
+        "title": worksheet.title,
+        "index": worksheet.index,
+        "gridProperties": {"rowCount": num_rows, "columnCount": num_cols},
+    }, spreadsheet.id, spreadsheet.client)
+
+
+def template_steps(style_config, paste_csv=False):
+    """
+    テンプレートを使う場合の手順 [(名前, fn(worksheet, df))]。
+    最初の clone_template は複製したシートを返すので、write_sheet は以降の手順をそのシートに対して行う。
+    """
+    def clone(ws, df):
+        return clone_template(ws, ensure_template(ws.spreadsheet, style_config, df), df, style_config)
+
+    return [
+        ("clone_template", clone),
+        ("write_values", lambda ws, df: write_values(ws, df, paste_csv=paste_csv, resize=False)),
+        ("dropdowns", lambda ws, df: dropdowns(ws, df)),
+    ]
+
+
+# ===============================
+# 🚀 大量データの高速書き込み
+# ===============================
+# 1リクエストあたりのペイロード上限（Sheets API の上限より十分小さくとる）
+VALUES_CHUNK_BYTES = 4 * 1024 * 1024
+# 行をまとめてシリアライズする単位（バイト数の見積もりはこの単位で行う）
+_ROW_BLOCK = 500
+# 値はシートに手入力したのと同じように解釈させる（set_with_dataframe・pasteData と同じ）。
+# "17.4%" はパーセントの数値に、文字列の "1" は数値になり、書式の PERCENT・並べ替え・フィルターが効く
+VALUE_INPUT_OPTION = "USER_ENTERED"
+
+
+def _col_letter(n: int) -> str:
+    """1始まりの列番号 → A, B, ..., Z, AA ..."""
+    letters = ""
+    while n > 0:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _escape_text(value):
+    """USER_ENTERED で ' が引用符として消えないよう、' で始まる文字列だけ ' を重ねる（set_with_dataframe と同じ）"""
+    return "'" + value if isinstance(value, str) and value.startswith("'") else value
+
+
+def _frame_to_rows(df: pd.DataFrame) -> list:
+    """DataFrame → JSON化できる2次元リスト（NaN/inf は空文字、numpy型は Python 型へ、' 始まりの文字列はエスケープ）"""
+    df = df.replace([np.inf, -np.inf], np.nan)
+    rows = df.astype(object).where(df.notna(), "").to_numpy().tolist()
+    return [[_escape_text(v) for v in row] for row in rows]
+
+
+def _resize_and_clear_request(sheet_id, num_rows, num_cols):
+    """グリッドを書き込みサイズに合わせ、既存の値を消すリクエスト（1バッチで送る）"""
+    return [
+        {
+            "updateSheetProperties": {
+                "properties": {
+                    "sheetId": sheet_id,
+                    "gridProperties": {"rowCount": num_rows, "columnCount": num_cols},
+                },
+                "fields": "gridProperties.rowCount,gridProperties.columnCount",
+            }
+        },
+        {
+            "updateCells": {
+                "range": {"sheetId": sheet_id},
+                "fields": "userEnteredValue",
+            }
+        },
+    ]
+
+
+def iter_value_chunks(df, *, include_header=True, max_bytes=VALUES_CHUNK_BYTES, start_row=1):
+    """
+    DataFrame を「開始行, 行リスト, 推定バイト数」のチャンクに分けて順に返す。
+    行は _ROW_BLOCK 行ずつ変換・シリアライズするため、メモリは1チャンク分に収まる。
+    """
+    pending, pending_bytes, pending_start = [], 0, start_row
+    next_row = start_row
+
+    if include_header:
+        header = [_escape_text(str(c)) for c in df.columns]
+        pending.append(header)
+        pending_bytes = len(json.dumps(header, ensure_ascii=False).encode("utf-8"))
+        next_row += 1
+
+    for offset in range(0, len(df), _ROW_BLOCK):
+        rows = _frame_to_rows(df.iloc[offset:offset + _ROW_BLOCK])
+        block_bytes = len(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+        if pending and pending_bytes + block_bytes > max_bytes:
+            yield pending_start, pending, pending_bytes
+            pending, pending_bytes, pending_start = [], 0, next_row
+        pending.extend(rows)
+        pending_bytes += block_bytes
+        next_row += len(rows)
+
+    if pending:
+        yield pending_start, pending, pending_bytes
+
+
+def write_values(worksheet, df, *, include_header=True, paste_csv=False, max_bytes=VALUES_CHUNK_BYTES, resize=True):
+    """
+    DataFrame をシートへ一括書き込みする（set_with_dataframe の置き換え）。
+      - グリッドのサイズ変更と既存値のクリアを1回の batchUpdate で行う（resize=False なら省く）
+      - 値はバイト数上限ごとのチャンクに分け values.batchUpdate（USER_ENTERED）で送る
+      - paste_csv=True のときは CSV を pasteData で貼り付ける（最初のチャンクはサイズ変更と同じバッチ）
+    書き込んだ行数（ヘッダー含む）を返す。
+    """
+    spreadsheet = worksheet.spreadsheet
+    service = _sheets_service(spreadsheet)
+
+    num_rows = max(1, len(df) + (1 if include_header else 0))
+    num_cols = max(1, len(df.columns))
+    setup = _resize_and_clear_request(worksheet.id, num_rows, num_cols) if resize else []
+
+    if paste_csv:
+        _paste_csv_chunks(service, spreadsheet.id, worksheet.id, df, setup,
+                          include_header=include_header, max_bytes=max_bytes)
+        return num_rows
+
+    if setup:
+        service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet.id, body={"requests": setup}
+        ).execute()
+
+    title = worksheet.title.replace("'", "''")
+    last_col = _col_letter(num_cols)
+    for start, rows, _ in iter_value_chunks(df, include_header=include_header, max_bytes=max_bytes):
+        end = start + len(rows) - 1
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet.id,
+            body={
+                "valueInputOption": VALUE_INPUT_OPTION,
+                "data": [{"range": f"'{title}'!A{start}:{last_col}{end}", "values": rows}],
+            },
+        ).execute()
+
+    return num_rows
+
+
+def _paste_csv_chunks(service, spreadsheet_id, sheet_id, df, setup, *, include_header, max_bytes):
+    """CSV を行ブロック単位で作り、バイト数上限ごとに pasteData で送る"""
+    requests, request_bytes = list(setup), 0
+    row_index = 0
+
+    def paste(text, at_row):
+        return {
+            "pasteData": {
+                "coordinate": {"sheetId": sheet_id, "rowIndex": at_row, "columnIndex": 0},
+                "data": text,
+                "type": "PASTE_VALUES",
+                "delimiter": ",",
+            }
+        }
+
+    def flush():
+        service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body={"requests": requests}
+        ).execute()
+
+    buffer, buffer_start = [], 0
+    if include_header:
+        buffer.append(df.iloc[:0].to_csv(index=False, lineterminator="\n"))
+        request_bytes = len(buffer[0].encode("utf-8"))
+        row_index = 1
+
+    for offset in range(0, len(df), _ROW_BLOCK):
+        block = df.iloc[offset:offset + _ROW_BLOCK].to_csv(index=False, header=False, lineterminator="\n")
+        block_bytes = len(block.encode("utf-8"))
+        if buffer and request_bytes + block_bytes > max_bytes:
+            requests.append(paste("".join(buffer).rstrip("\n"), buffer_start))
+            flush()
+            requests, buffer, request_bytes, buffer_start = [], [], 0, row_index
+        buffer.append(block)
+        request_bytes += block_bytes
+        row_index += min(_ROW_BLOCK, len(df) - offset)
+
+    if buffer:
+        requests.append(paste("".join(buffer).rstrip("\n"), buffer_start))
+    if requests:
+        flush()
+
+
+# ===============================
+# 🧪 ドライラン（リクエストを組み立てるだけで送信しない）
+# ===============================
+# Sheets API の既定クォータ（ユーザーごと・1分あたり。読み取り・書き込みは別枠）
+READ_QUOTA_PER_MINUTE = 60
+WRITE_QUOTA_PER_MINUTE = 60
+# これを超えるフォーマッタは警告する（行ごとのリクエストなど）
+WARN_REQUESTS_PER_STEP = 500
+WARN_PAYLOAD_BYTES = VALUES_CHUNK_BYTES
+
+
+class _RecordedCall:
+    """service.spreadsheets().batchUpdate(...) などの戻り値。execute() で記録する"""
+
+    def __init__(self, recorder, method, kwargs, response):
+        self._recorder = recorder
+        self._method = method
+        self._kwargs = kwargs
+        self._response = response
+
+    def execute(self):
+        self._recorder.record(self._method, self._kwargs.get("body"), self._kwargs)
+        return self._response
+
+
+class _RecordedValues:
+    def __init__(self, recorder):
+        self._recorder = recorder
+
+    def batchUpdate(self, **kwargs):
+        return _RecordedCall(self._recorder, "values.batchUpdate", kwargs, {})
+
+
+class DryRunRecorder:
+    """
+    googleapiclient の Sheets サービスの代わり。送るはずだった呼び出しを step ごとに記録する。
+    読み取り（spreadsheets.get）は空の応答を返す（既存の条件付き書式の数などは 0 として扱う）。
+    """
+
+    def __init__(self):
+        self.step = None
+        self.calls = []
+
+    def record(self, method, body, kwargs=None):
+        params = {k: v for k, v in (kwargs or {}).items() if k not in ("body", "spreadsheetId")}
+        self.calls.append({"step": self.step, "method": method, "params": params, "body": body})
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return _RecordedValues(self)
+
+    def batchUpdate(self, **kwargs):
+        return _RecordedCall(self, "batchUpdate", kwargs, {})
+
+    def get(self, **kwargs):
+        return _RecordedCall(self, "get", kwargs, {})
+
+
+class _DryRunSpreadsheet:
+    id = "dry-run"
+    url = "dry-run"
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.client = None
+        # すでにあることにするワークシート（テンプレートを使う見積もり用）
+        self.existing = []
+
+    def worksheets(self):
+        return list(self.existing)
+
+    def batch_update(self, body):
+        """gspread_formatting の format_cell_range などが呼ぶ"""
+        self.recorder.record("batchUpdate", body)
+        return {}
+
+
+class DryRunWorksheet:
+    """write_sheet の各フォーマッタに渡す、通信しないワークシート"""
+
+    id = 0
+    index = 0
+
+    def __init__(self, title, rows=1, cols=1, sheet_id=0):
+        self.id = sheet_id
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.url = "dry-run"
+        self.spreadsheet = _DryRunSpreadsheet(DryRunRecorder())
+
+    def get_all_values(self):
+        self.spreadsheet.recorder.record("values.get", None)
+        return []
+
+
+def _request_type(request):
+    return next(iter(request), "?") if isinstance(request, dict) else "?"
+
+
+def build_dry_run_plan(recorder, sheet_name, df):
+    """
+    記録した呼び出しをフォーマッタごとに集計する。
+
+    Returns:
+        {
+          "sheet_name", "rows", "cols",
+          "totals": {http_calls, read_calls, write_calls, requests, payload_bytes, estimated_quota_minutes},
+          "steps": [{step, http_calls, read_calls, write_calls, requests, payload_bytes, request_types}],
+          "warnings": [...],
+          "calls": [{step, method, params, body, payload_bytes}],
+        }
+    """
+    steps = {}
+    calls = []
+    for call in recorder.calls:
+        body = call["body"]
+        payload = len(json.dumps(body, ensure_ascii=False).encode("utf-8")) if body is not None else 0
+        calls.append({**call, "payload_bytes": payload})
+
+        st = steps.setdefault(call["step"], {
+            "step": call["step"], "http_calls": 0, "read_calls": 0, "write_calls": 0,
+            "requests": 0, "payload_bytes": 0, "request_types": {},
+        })
+        st["http_calls"] += 1
+        st["payload_bytes"] += payload
+        if call["method"] in ("get", "values.get"):
+            st["read_calls"] += 1
+            continue
+        st["write_calls"] += 1
+        if call["method"] == "values.batchUpdate":
+            kinds = ["valueRange"] * len((body or {}).get("data", []))
+        else:
+            kinds = [_request_type(req) for req in (body or {}).get("requests", [])]
+        st["requests"] += len(kinds)
+        for kind in kinds:
+            st["request_types"][kind] = st["request_types"].get(kind, 0) + 1
+
+    step_list = list(steps.values())
+    totals = {
+        key: sum(st[key] for st in step_list)
+        for key in ("http_calls", "read_calls", "write_calls", "requests", "payload_bytes")
+    }
+    # 1分あたりのクォータを使い切る前提の最短所要時間（分）
+    totals["estimated_quota_minutes"] = round(max(
+        totals["read_calls"] / READ_QUOTA_PER_MINUTE, totals["write_calls"] / WRITE_QUOTA_PER_MINUTE
+    ), 2)
+
+    warnings = []
+    for st in step_list:
+        if st["requests"] > WARN_REQUESTS_PER_STEP:
+            top = max(st["request_types"].items(), key=lambda kv: kv[1])
+            warnings.append(f"{st['step']}: {st['requests']} requests ({top[1]} × {top[0]})")
+    for call in calls:
+        if call["payload_bytes"] > WARN_PAYLOAD_BYTES:
+            warnings.append(f"{call['step']}: {call['method']} payload {call['payload_bytes']:,} bytes")
+    if totals["write_calls"] > WRITE_QUOTA_PER_MINUTE:
+        warnings.append(
+            f"{totals['write_calls']} write calls exceed the per-minute quota ({WRITE_QUOTA_PER_MINUTE})"
+        )
+
+    return {
+        "sheet_name": sheet_name,
+        "rows": len(df) + 1,
+        "cols": len(df.columns),
+        "totals": totals,
+        "steps": step_list,
+        "warnings": warnings,
+        "calls": calls,
+    }
+
+
+# ===============================
+# 📄 補助テーブル（差分・集計など）の書き込み
+# ===============================
+def write_table_sheet(spreadsheet_url, sheet_name, service_account_info, df, style_config=None, formatters=()):
+    """
+    任意の表を別ワークシートに書き込み、ヘッダー書式・フィルター・折り返しだけを適用する。
+    formatters: そのあとに追加で適用する fn(worksheet, df) のリスト（任意）
+    戻り値: (worksheet.url, None) または (None, エラーメッセージ)
+    """
+    try:
+        worksheet = open_worksheet(
+            spreadsheet_url, sheet_name, service_account_info,
+            rows=len(df) + 1, cols=len(df.columns),
+        )
+        write_values(worksheet, df)
+        reset_sheet(worksheet, num_rows=len(df) + 1, num_cols=len(df.columns))
+
+        header_cfg = (style_config or {}).get("header", {})
+        apply_header_style(
+            worksheet,
+            df,
+            backgroundColor=header_cfg.get("backgroundColor", "#356854"),
+            textColor=header_cfg.get("textColor", "#FFFFFF"),
+            bold=header_cfg.get("bold", True),
+            fontSize=header_cfg.get("fontSize", 10),
+            header_height_px=header_cfg.get("header_height_px", 40),
+        )
+        apply_filter_to_header(worksheet, df)
+        apply_wrap_text_to_header_row(worksheet, df)
+        for formatter in formatters:
+            formatter(worksheet, df)
+
+        print(f"✅ Successfully wrote table to '{sheet_name}'")
+        return worksheet.url, None
+
+    except Exception as e:
+        print(f"❌ Failed to write table: {e}")
         return None, str(e)
 
 
-def reset_sheet(worksheet):
+# ===============================
+# 🌡 カテゴリー × トピックのクロス集計（ヒートマップ）
+# ===============================
+# セルごとに色を付けず、件数の列・平均スコアの列それぞれに条件付き書式のカラースケールを1つずつ付ける
+# （セルが数千あってもリクエストは数件）
+CROSSTAB_COUNT_SUFFIX = "\nアイデア数"
+CROSSTAB_MEAN_SUFFIX = "\n平均スコア"
+# 左端の固定列（depth・Broad・Medium・アイデア数）
+CROSSTAB_FROZEN_COLS = 4
+
+
+def _column_runs(indices):
+    """列番号（0始まり・昇順）を連続する区間 [(start, end)] にまとめる（end は含まない）"""
+    runs = []
+    for j in indices:
+        if runs and runs[-1][1] == j:
+            runs[-1][1] = j + 1
+        else:
+            runs.append([j, j + 1])
+    return [tuple(run) for run in runs]
+
+
+def _blend(a, b, t):
+    """2色 {"red", "green", "blue"} を t (0〜1) で混ぜる"""
+    return {key: a[key] + (b[key] - a[key]) * t for key in ("red", "green", "blue")}
+
+
+def apply_crosstab_heatmap(worksheet, df, color="#356854"):
+    """
+    クロス集計（nomic_module.build_category_crosstab の形）にヒートマップを付ける。
+    「\nアイデア数」「\n平均スコア」で終わる列ごとに、白 → color のカラースケールを1ルールずつ
+    （平均スコアは中央値を中間色に）追加し、平均スコアの表示形式・ヘッダーと左端の列の固定も同じバッチで送る。
+    """
+    if df.empty:
+        return
+
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
-    spreadsheet_id = spreadsheet.id
-    sheet_id = worksheet.id
+    service = _sheets_service(spreadsheet)
+    columns = [str(col) for col in df.columns]
+    count_cols = [j for j, col in enumerate(columns) if col.endswith(CROSSTAB_COUNT_SUFFIX)]
+    mean_cols = [j for j, col in enumerate(columns) if col.endswith(CROSSTAB_MEAN_SUFFIX)]
 
-    # 現在の範囲サイズを取得
-    data = worksheet.get_all_values()
-    num_rows = max(1, len(data))
-    num_cols = max(1, len(data[0]) if data else 1)
+    def ranges(indices):
+        return [
+            {
+                "sheetId": worksheet.id,
+                "startRowIndex": 1,
+                "endRowIndex": len(df) + 1,
+                "startColumnIndex": start,
+                "endColumnIndex": end,
+            }
+            for start, end in _column_runs(indices)
+        ]
 
+    white = _hex_to_rgb_color("#FFFFFF")
+    accent = _hex_to_rgb_color(color)
+    requests = [{
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": worksheet.id,
+                "gridProperties": {"frozenRowCount": 1, "frozenColumnCount": min(CROSSTAB_FROZEN_COLS, len(columns))},
+            },
+            "fields": "gridProperties.frozenRowCount,gridProperties.frozenColumnCount",
+        }
+    }]
+    if count_cols:
+        requests.append({
+            "addConditionalFormatRule": {
+                "rule": {
+                    "ranges": ranges(count_cols),
+                    "gradientRule": {
+                        "minpoint": {"type": "NUMBER", "value": "0", "color": white},
+                        "maxpoint": {"type": "MAX", "color": accent},
+                    },
+                },
+                "index": 0,
+            }
+        })
+    if mean_cols:
+        requests.append({
+            "addConditionalFormatRule": {
+                "rule": {
+                    "ranges": ranges(mean_cols),
+                    "gradientRule": {
+                        "minpoint": {"type": "MIN", "color": white},
+                        "midpoint": {"type": "PERCENTILE", "value": "50", "color": _blend(white, accent, 0.4)},
+                        "maxpoint": {"type": "MAX", "color": accent},
+                    },
+                },
+                "index": 0,
+            }
+        })
+        for rng in ranges(mean_cols):
+            requests.append({
+                "repeatCell": {
+                    "range": rng,
+                    "cell": {"userEnteredFormat": {"numberFormat": {"type": "NUMBER", "pattern": "0.00"}}},
+                    "fields": "userEnteredFormat.numberFormat",
+                }
+            })
+
+    service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet.id, body={"requests": requests}
+    ).execute()
+    print(f"🌡 Heatmap applied to {len(count_cols)} count / {len(mean_cols)} score column(s)")
+
+
+def write_crosstab_sheet(spreadsheet_url, sheet_name, service_account_info, df_cross, style_config=None):
+    """
+    カテゴリー × トピックのクロス集計を別ワークシートに書き込み、ヘッダー書式とヒートマップを付ける。
+    ヒートマップの色は style_config の惑星の色（無ければヘッダーの背景色）。
+    戻り値: (worksheet.url, None) または (None, エラーメッセージ)
+    """
+    style_config = style_config or {}
+    color = style_config.get("planet", {}).get(
+        "planet_color", style_config.get("header", {}).get("backgroundColor", "#356854")
+    )
+    return write_table_sheet(
+        spreadsheet_url, sheet_name, service_account_info, df_cross, style_config,
+        formatters=[lambda ws, df: apply_crosstab_heatmap(ws, df, color=color)],
+    )
+
+
+# ===============================
+# 💾 アイデア単位の再開可能エクスポート
+# ===============================
+CHECKPOINT_DIR = os.path.join(".cache", "sheet_exports")
+
+
+def _frame_fingerprint(df: pd.DataFrame) -> str:
+    """DataFrame の内容ハッシュ（同じデータに対する再開かどうかの判定に使う）"""
+    h = hashlib.sha1()
+    h.update(json.dumps([str(c) for c in df.columns], ensure_ascii=False).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _checkpoint_path(spreadsheet_id, sheet_name, checkpoint_dir):
+    key = hashlib.sha1(f"{spreadsheet_id}\0{sheet_name}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(checkpoint_dir, f"{key}.json")
+
+
+def _load_checkpoint(path, fingerprint, chunk_rows):
+    """同じデータ・同じチャンク幅のチェックポイントがあれば完了済みチャンク番号を返す"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("fingerprint") != fingerprint or state.get("chunk_rows") != chunk_rows:
+        return None
+    return set(state.get("done", []))
+
+
+def _save_checkpoint(path, state):
+    """一時ファイルに書いてから置き換える（途中で落ちても壊れたファイルを残さない）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def export_idea_sheet(
+    spreadsheet_url,
+    sheet_name,
+    service_account_info,
+    df_ideas,
+    *,
+    chunk_rows: int = 5000,
+    workers: int = 4,
+    checkpoint_dir: str = CHECKPOINT_DIR,
+    on_progress=None,
+):
+    """
+    アイデア単位の表を番号付きチャンクに分け、並列接続でシートへ書き込む。
+    チャンクが書き込まれるたびにローカルのチェックポイントへ記録し、
+    同じデータで再実行したときは未完了のチャンクだけを送る。
+
+    on_progress: (完了チャンク数, 全チャンク数) を受け取るコールバック（任意）
+    戻り値: (worksheet.url, None) または (None, エラーメッセージ)
+    """
+    try:
+        worksheet = open_worksheet(
+            spreadsheet_url, sheet_name, service_account_info,
+            rows=len(df_ideas) + 1, cols=len(df_ideas.columns),
+        )
+        spreadsheet = worksheet.spreadsheet
+        creds = spreadsheet.client.auth
+
+        fingerprint = _frame_fingerprint(df_ideas)
+        path = _checkpoint_path(spreadsheet.id, sheet_name, checkpoint_dir)
+        done = _load_checkpoint(path, fingerprint, chunk_rows)
+        total = (len(df_ideas) + chunk_rows - 1) // chunk_rows
+
+        title = worksheet.title.replace("'", "''")
+        last_col = _col_letter(max(1, len(df_ideas.columns)))
+
+        if done is None:
+            # --- 新規エクスポート：サイズ調整・クリア → ヘッダー書き込み ---
+            service = build("sheets", "v4", credentials=creds)
+            service.spreadsheets().batchUpdate(
+                spreadsheetId=spreadsheet.id,
+                body={"requests": _resize_and_clear_request(
+                    worksheet.id, len(df_ideas) + 1, max(1, len(df_ideas.columns))
+                )},
+            ).execute()
+            service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet.id,
+                body={
+                    "valueInputOption": VALUE_INPUT_OPTION,
+                    "data": [{"range": f"'{title}'!A1:{last_col}1", "values": [[_escape_text(str(c)) for c in df_ideas.columns]]}],
+                },
+            ).execute()
+            done = set()
+            print(f"💾 Starting idea export: {total} chunks")
+        else:
+            print(f"💾 Resuming idea export: {len(done)}/{total} chunks already written")
+
+        state = {"fingerprint": fingerprint, "chunk_rows": chunk_rows, "total": total, "done": sorted(done)}
+        _save_checkpoint(path, state)
+
+        local = threading.local()
+        lock = threading.Lock()
+
+        def send(chunk_no):
+            # httplib2 はスレッド間で共有できないため、接続はスレッドごとに作る
+            if not hasattr(local, "service"):
+                local.service = build("sheets", "v4", credentials=creds)
+            start = chunk_no * chunk_rows
+            rows = _frame_to_rows(df_ideas.iloc[start:start + chunk_rows])
+            first = start + 2  # 1行目はヘッダー
+            local.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet.id,
+                body={
+                    "valueInputOption": VALUE_INPUT_OPTION,
+                    "data": [{"range": f"'{title}'!A{first}:{last_col}{first + len(rows) - 1}", "values": rows}],
+                },
+            ).execute()
+            return chunk_no
+
+        pending = [i for i in range(total) if i not in done]
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            futures = [ex.submit(send, i) for i in pending]
+            for fut in as_completed(futures):
+                try:
+                    chunk_no = fut.result()
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                with lock:
+                    done.add(chunk_no)
+                    state["done"] = sorted(done)
+                    _save_checkpoint(path, state)
+                if on_progress:
+                    on_progress(len(done), total)
+
+        if errors:
+            raise RuntimeError(f"{len(errors)} chunk(s) failed, rerun to resume: {errors[0]}")
+
+        os.remove(path)
+        print(f"✅ Idea export finished: {len(df_ideas)} rows in {total} chunks")
+        return worksheet.url, None
+
+    except Exception as e:
+        print(f"❌ Failed to export ideas: {e}")
+        return None, str(e)
+
+
+def _rule_cleanup_requests(service, spreadsheet_id, sheet_id):
+    """
+    前回のフィルタと条件付き書式を消すリクエスト（条件付き書式の件数を1回 GET する）。
+    数えるのは sheet_id のシートのルールだけ（同じスプレッドシートの他のシートのルールを数えると、
+    削除リクエストが実際のルール数を超えて batchUpdate ごと拒否される）。
+    """
     # --- 1️⃣ データ検証削除 ---
     clear_data_validation = {"clearBasicFilter": {"sheetId": sheet_id}}
 
     # --- 2️⃣ 条件付き書式削除 ---
     try:
         rules = service.spreadsheets().get(
-            spreadsheetId=spreadsheet_id, fields="sheets.conditionalFormats"
+            spreadsheetId=spreadsheet_id, fields="sheets(properties.sheetId,conditionalFormats)"
         ).execute()
         num_rules = 0
         for s in rules.get("sheets", []):
-            if "conditionalFormats" in s:
-                num_rules += len(s["conditionalFormats"])
+            if s.get("properties", {}).get("sheetId") == sheet_id:
+                num_rules += len(s.get("conditionalFormats", []))
     except Exception:
         num_rules = 0
 
@@ -111,6 +1047,39 @@ def reset_sheet(worksheet):
         delete_rules.append({
             "deleteConditionalFormatRule": {"sheetId": sheet_id, "index": 0}
         })
+    return [clear_data_validation] + delete_rules
+
+
+def clear_sheet_rules(worksheet):
+    """前回のフィルタと条件付き書式だけを消す（シートのサイズ・データに依存しないので先に実行できる）"""
+    spreadsheet = worksheet.spreadsheet
+    service = _sheets_service(spreadsheet)
+    requests = _rule_cleanup_requests(service, spreadsheet.id, worksheet.id)
+    service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheet.id, body={"requests": requests}
+    ).execute()
+
+
+def reset_sheet(worksheet, num_rows=None, num_cols=None, rules_cleared=False):
+    """
+    書式・枠線をリセットしてベースのフォント・色を設定する。
+    rules_cleared=True なら、フィルタ・条件付き書式の削除（clear_sheet_rules で済ませたもの）を省く。
+    """
+    spreadsheet = worksheet.spreadsheet
+    service = _sheets_service(spreadsheet)
+    spreadsheet_id = spreadsheet.id
+    sheet_id = worksheet.id
+
+    # 現在の範囲サイズを取得（書き込み直後なら呼び出し側のサイズを使い、全セル取得を省く）
+    if num_rows is None or num_cols is None:
+        data = worksheet.get_all_values()
+        num_rows = len(data)
+        num_cols = len(data[0]) if data else 1
+    num_rows = max(1, num_rows)
+    num_cols = max(1, num_cols)
+
+    # --- 1️⃣ 2️⃣ フィルタ・条件付き書式の削除（準備済みなら省く） ---
+    cleanup = [] if rules_cleared else _rule_cleanup_requests(service, spreadsheet_id, sheet_id)
 
     # --- 3️⃣ 全書式クリア + ベースフォント/カラー設定 ---
     base_text_color = {"red": 67/255, "green": 67/255, "blue": 67/255}
@@ -164,7 +1133,7 @@ def reset_sheet(worksheet):
     }
 
     # 一括実行
-    requests = [clear_data_validation, clear_and_set_format, clear_borders] + delete_rules
+    requests = cleanup[:1] + [clear_and_set_format, clear_borders] + cleanup[1:]
 
     service.spreadsheets().batchUpdate(
         spreadsheetId=spreadsheet_id, body={"requests": requests}
@@ -276,7 +1245,7 @@ def style_column(
             fmt["numberFormat"] = {"type": fmt_type}
         fields.append("userEnteredFormat.numberFormat")
 
-    service = build("sheets", "v4", credentials=worksheet.spreadsheet.client.auth)
+    service = _sheets_service(worksheet.spreadsheet)
 
     requests = []
     # スタイル適用（背景を含まない fields だけ指定）
@@ -321,7 +1290,7 @@ def base_sheet_design(worksheet, df):
         return
 
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
+    service = _sheets_service(spreadsheet)
 
     num_rows = len(df) + 1
     num_cols = len(df.columns)
@@ -372,13 +1341,15 @@ def dropdowns(worksheet, df):
     C列: Smart Dropdown（淡い背景＋同系色文字）
     D列: 値が入っている行にだけ Smart Dropdown を付与（背景は触らない／文字は #666666）
          "nan"/"None" はシート上から消去（空文字に置換）
+    リクエストは C列 → D列の空白化 → D列のプルダウンの順に1回の batchUpdate で送る。
     """
     if df.empty:
         return
 
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
+    service = _sheets_service(spreadsheet)
     num_rows = len(df) + 1  # ヘッダー含む
+    requests = []
 
     # ---------------------------
     # C列：淡い背景にトーンダウン（lを上げる）
@@ -458,9 +1429,7 @@ def dropdowns(worksheet, df):
                     }
                 })
 
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet.id, body={"requests": reqs_c}
-            ).execute()
+            requests.extend(reqs_c)
 
     # ---------------------------
     # D列："nan"/"None" を空白化 → 非空行のみにプルダウン／#666666を適用
@@ -502,9 +1471,7 @@ def dropdowns(worksheet, df):
                 }
             },
         ]
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheet.id, body={"requests": cleanup_reqs}
-        ).execute()
+        requests.extend(cleanup_reqs)
 
         # 2) Python側の d_series から非空行を抽出（空白/None/nan 除外）
         non_empty_rows = [i for i, v in enumerate(d_series, start=2)  # シート行番号（ヘッダー1なので+1 → +1でもう一段）
@@ -576,11 +1543,14 @@ def dropdowns(worksheet, df):
                     }
                 })
 
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet.id, body={"requests": reqs_d}
-            ).execute()
+            requests.extend(reqs_d)
         # 非空行が無い場合はスルー（プルダウンも付けない）
 
+    if requests:
+        service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet.id, body={"requests": requests}
+        ).execute()
+
 def _hex_to_rgb_color(hex_color: str):
     """#RRGGBB → Google Sheets Color dict"""
     hex_color = hex_color.strip()
@@ -618,7 +1588,7 @@ def apply_planet_border(
         return
 
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
+    service = _sheets_service(spreadsheet)
     num_rows = len(df)
     num_cols = len(df.columns)
 
@@ -665,7 +1635,8 @@ def apply_planet_border(
     }
 
     # --- グループ境界線を追加 ---
-    group_right_edges = [5, 10, 12, 15, 18, 21]
+    # 採点モデルの基準数で列の並びが変わるので、列名からグループの先頭を求める
+    group_right_edges = scoring_module.group_right_edges(df.columns)
     group_lines = []
     for edge_index in group_right_edges:
         group_lines.append({
@@ -715,7 +1686,7 @@ def apply_header_style(
         return
 
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
+    service = _sheets_service(spreadsheet)
 
     num_cols = len(df.columns)
     # 最終列を "A1:Z1" のような文字列に変換
@@ -791,7 +1762,7 @@ def apply_filter_to_header(worksheet, df):
         return
 
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
+    service = _sheets_service(spreadsheet)
 
     num_cols = len(df.columns)
     request_body = {
@@ -825,7 +1796,7 @@ def apply_wrap_text_to_header_row(worksheet, df):
 
     num_cols = len(df.columns)
     spreadsheet = worksheet.spreadsheet
-    service = build("sheets", "v4", credentials=spreadsheet.client.auth)
+    service = _sheets_service(spreadsheet)
 
     request_body = {
         "requests": [
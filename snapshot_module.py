@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+
+import pandas as pd
+
+
+# ==============================
+# 🔹 スナップショットの保存・読み込み
+# ==============================
+SNAPSHOT_DIR = os.path.join(".cache", "snapshots")
+
+# トピックを一意に決める列（マスターテーブル上）
+TOPIC_KEYS = ["depth", "Nomic Topic: Broad", "Nomic Topic: Medium"]
+
+# 差分を出す数値列
+DELTA_COLUMNS = ["アイデア数", "平均スコア", "新規性平均スコア", "市場性平均スコア", "実現性平均スコア"]
+
+
+def save_snapshot(df_master, df_topics=None, *, map_url="", label="", meta=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    マスターテーブル（と任意でトピック割り当て）を Parquet で保存し、スナップショットIDを返す。
+    """
+    now = datetime.now(timezone.utc)
+    name = re.sub(r"[^0-9A-Za-z_-]+", "-", label).strip("-")
+    snapshot_id = now.strftime("%Y%m%dT%H%M%S%fZ") + (f"_{name}" if name else "")
+    path = os.path.join(snapshot_dir, snapshot_id)
+    os.makedirs(path, exist_ok=True)
+
+    df_master.to_parquet(os.path.join(path, "master.parquet"), index=False)
+    if df_topics is not None:
+        assignments = df_topics[["row_number", "topic_depth_1", "topic_depth_2"]].astype(
+            {"topic_depth_1": str, "topic_depth_2": str}
+        )
+        assignments.to_parquet(os.path.join(path, "assignments.parquet"), index=False)
+
+    info = {
+        "id": snapshot_id,
+        "created_at": now.isoformat(),
+        "map_url": map_url,
+        "label": label,
+        "rows": len(df_master),
+        "has_assignments": df_topics is not None,
+        **(meta or {}),
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False)
+    return snapshot_id
+
+
+def delete_snapshot(snapshot_id, snapshot_dir=SNAPSHOT_DIR):
+    """スナップショットを削除する（無ければ何もしない）"""
+    shutil.rmtree(os.path.join(snapshot_dir, snapshot_id), ignore_errors=True)
+
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """保存済みスナップショットのメタ情報（新しい順）"""
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(snapshot_dir):
+        meta_path = os.path.join(snapshot_dir, name, "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(snapshots, key=lambda s: s["id"], reverse=True)
+
+
+def load_snapshot(snapshot_id, snapshot_dir=SNAPSHOT_DIR):
+    """(df_master, df_assignments or None, meta) を返す"""
+    path = os.path.join(snapshot_dir, snapshot_id)
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    df_master = pd.read_parquet(os.path.join(path, "master.parquet"))
+    assign_path = os.path.join(path, "assignments.parquet")
+    df_assign = pd.read_parquet(assign_path) if os.path.exists(assign_path) else None
+    return df_master, df_assign, meta
+
+
+# ==============================
+# 🔹 スナップショット間の差分
+# ==============================
+
+def diff_master(old_master, new_master):
+    """
+    トピックごとの アイデア数・平均スコア・最優秀アイデア の変化を返す。
+    トピックは (depth, Broad, Medium) で突き合わせる（インデックス結合）。
+    """
+    value_cols = [c for c in DELTA_COLUMNS if c in old_master.columns and c in new_master.columns]
+    extra_cols = [c for c in ["アイデア名", "合計スコア"] if c in old_master.columns and c in new_master.columns]
+
+    def keyed(df):
+        out = df[TOPIC_KEYS + value_cols + extra_cols].copy()
+        out[TOPIC_KEYS] = out[TOPIC_KEYS].astype(str)
+        return out.drop_duplicates(TOPIC_KEYS).set_index(TOPIC_KEYS)
+
+    old, new = keyed(old_master), keyed(new_master)
+    joined = old.join(new, how="outer", lsuffix="_old", rsuffix="_new")
+    in_old = joined.index.isin(old.index)
+    in_new = joined.index.isin(new.index)
+
+    out = pd.DataFrame(index=joined.index)
+    out["状態"] = "unchanged"
+    for col in value_cols:
+        before = joined[f"{col}_old"].astype(float)
+        after = joined[f"{col}_new"].astype(float)
+        out[f"{col}(旧)"] = before
+        out[f"{col}(新)"] = after
+        out[f"{col}(差分)"] = (after.fillna(0.0) - before.fillna(0.0)).round(2)
+
+    if "アイデア名" in extra_cols:
+        out["最優秀アイデア(旧)"] = joined["アイデア名_old"]
+        out["最優秀アイデア(新)"] = joined["アイデア名_new"]
+        out["最優秀アイデア変更"] = in_old & in_new & (joined["アイデア名_old"] != joined["アイデア名_new"])
+
+    changed = (out[[c for c in out.columns if c.endswith("(差分)")]] != 0).any(axis=1)
+    if "最優秀アイデア変更" in out.columns:
+        changed |= out["最優秀アイデア変更"]
+    out.loc[changed.to_numpy(), "状態"] = "changed"
+    out.loc[in_new & ~in_old, "状態"] = "added"
+    out.loc[in_old & ~in_new, "状態"] = "removed"
+
+    out = out.reset_index()
+    return out.sort_values(TOPIC_KEYS, kind="stable").reset_index(drop=True)
+
+
+def moved_ideas(old_assign, new_assign):
+    """
+    row_number をキーにトピック割り当てを突き合わせ、移動・追加・削除されたアイデアを返す。
+    """
+    cols = ["topic_depth_1", "topic_depth_2"]
+    old = old_assign.drop_duplicates("row_number").set_index("row_number")[cols]
+    new = new_assign.drop_duplicates("row_number").set_index("row_number")[cols]
+    joined = old.join(new, how="outer", lsuffix="_old", rsuffix="_new")
+
+    in_old = joined.index.isin(old.index)
+    in_new = joined.index.isin(new.index)
+    moved = in_old & in_new & (
+        (joined["topic_depth_1_old"] != joined["topic_depth_1_new"])
+        | (joined["topic_depth_2_old"] != joined["topic_depth_2_new"])
+    )
+    status = pd.Series("", index=joined.index)
+    status[moved] = "moved"
+    status[in_new & ~in_old] = "added"
+    status[in_old & ~in_new] = "removed"
+
+    out = joined[status != ""].rename(columns={
+        "topic_depth_1_old": "Nomic Topic: Broad(旧)",
+        "topic_depth_2_old": "Nomic Topic: Medium(旧)",
+        "topic_depth_1_new": "Nomic Topic: Broad(新)",
+        "topic_depth_2_new": "Nomic Topic: Medium(新)",
+    })
+    out.insert(0, "状態", status[status != ""])
+    return out.reset_index()
+
+
+def diff_snapshots(old_id, new_id, snapshot_dir=SNAPSHOT_DIR):
+    """2つのスナップショットの (トピック差分, 移動アイデア or None) を返す"""
+    old_master, old_assign, _ = load_snapshot(old_id, snapshot_dir)
+    new_master, new_assign, _ = load_snapshot(new_id, snapshot_dir)
+    df_diff = diff_master(old_master, new_master)
+    df_moved = None
+    if old_assign is not None and new_assign is not None:
+        df_moved = moved_ideas(old_assign, new_assign)
+    return df_diff, df_moved
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import ipc
+
+
+# ==============================
+# 🔹 プロセス共有のマップストア（Arrow・ゼロコピー）
+# ==============================
+# 取得したマップのフレームはプロセスに1つだけ、変更不可の Arrow テーブルとして持つ。
+# セッションには Arrow のバッファをそのまま使う DataFrame（pd.ArrowDtype）を渡すので、
+# 同じマップを開くセッションが何人いてもメモリは1マップ分で済む。
+# メモリ上のマップの合計が予算を超えたら、最近使われていないものからディスクに書き出し、
+# memory-map したテーブルに置き換える（以降はOSのページキャッシュ任せ）。
+STORE_DIR = os.path.join(".cache", "maps")
+MEMORY_BUDGET_MB = int(os.environ.get("MAP_MEMORY_BUDGET_MB", "2048"))
+# ディスクに書き出したマップをいくつまで残すか（超えたら古いものから削除）
+MAX_SPILLED = 32
+
+
+def _to_table(df):
+    """DataFrame → Arrow テーブル。型が混在する object 列は文字列として持つ（欠損は null のまま）"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        fixed = {}
+        for col in df.columns:
+            try:
+                fixed[str(col)] = pa.array(df[col], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                fixed[str(col)] = pa.array(
+                    [None if pd.isna(v) else str(v) for v in df[col]], type=pa.string()
+                )
+        return pa.table(fixed)
+
+
+def _view(table):
+    """テーブルのバッファをコピーせずに使う DataFrame"""
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+class _Entry:
+    """ストアの1マップ分。tables は共有する Arrow テーブル、frames は小さいのでそのまま持つ DataFrame"""
+
+    def __init__(self, tables, frames):
+        self.tables = tables
+        self.frames = frames
+        self.nbytes = sum(t.nbytes for t in tables.values())
+        self.path = None
+        self.last_used = time.time()
+        self.hits = 0
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+
+class MapStore:
+    """
+    マップのフレームを key（取得の相乗りキー）ごとに1つだけ持つ LRU ストア。
+    メモリ上にあるテーブルの合計を budget_bytes 以下に保ち、超えた分はディスクに書き出して memory-map する。
+    """
+
+    def __init__(self, budget_bytes=MEMORY_BUDGET_MB * 1024 * 1024, spill_dir=STORE_DIR, max_spilled=MAX_SPILLED):
+        self.budget_bytes = budget_bytes
+        self.spill_dir = spill_dir
+        self.max_spilled = max_spilled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 前のプロセスが書き出したファイルは使えない（キーがプロセス内のもの）
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def put(self, key, frames, shared=("topics", "data")):
+        """
+        frames（名前 → DataFrame）を key で登録し、get(key) と同じビューを返す。
+        shared の名前は Arrow テーブルにしてセッション間で共有し、それ以外（メタデータなど小さい表）はそのまま持つ。
+        同じ key がすでにあれば登録し直さずに既存のものを返す。
+        """
+        with self._lock:
+            if key not in self._entries:
+                tables = {name: _to_table(df) for name, df in frames.items() if name in shared}
+                small = {name: df for name, df in frames.items() if name not in shared}
+                self._entries[key] = _Entry(tables, small)
+                self._enforce_budget()
+        return self.get(key)
+
+    def get(self, key):
+        """key のフレーム（名前 → DataFrame）。無ければ None。呼び出しごとに新しいビュー（元は変わらない）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            entry.last_used = time.time()
+            entry.hits += 1
+            tables, frames = dict(entry.tables), dict(entry.frames)
+        views = {name: _view(table) for name, table in tables.items()}
+        views.update({name: df.copy(deep=False) for name, df in frames.items()})
+        return views
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def drop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None and entry.spilled:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def resident_bytes(self):
+        """メモリ上にある（ディスクに書き出していない）テーブルの合計バイト数"""
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values() if not e.spilled)
+
+    def stats(self):
+        """マップごとの状態（古い順）"""
+        with self._lock:
+            return pd.DataFrame([
+                {
+                    "key": " / ".join(str(k) for k in key[1:3]) if isinstance(key, tuple) else str(key),
+                    "MB": round(e.nbytes / 1024 / 1024, 1),
+                    "状態": "disk (mmap)" if e.spilled else "memory",
+                    "参照回数": e.hits,
+                    "最終利用": time.strftime("%H:%M:%S", time.localtime(e.last_used)),
+                }
+                for key, e in self._entries.items()
+            ], columns=["key", "MB", "状態", "参照回数", "最終利用"])
+
+    # ---- 予算とディスクへの書き出し（_lock を持って呼ぶ）
+
+    def _enforce_budget(self):
+        resident = sum(e.nbytes for e in self._entries.values() if not e.spilled)
+        for key, entry in list(self._entries.items()):
+            if resident <= self.budget_bytes:
+                break
+            if not entry.spilled:
+                self._spill(key, entry)
+                resident -= entry.nbytes
+
+        spilled = [key for key, e in self._entries.items() if e.spilled]
+        for key in spilled[: max(0, len(spilled) - self.max_spilled)]:
+            entry = self._entries.pop(key)
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _spill(self, key, entry):
+        """テーブルを Arrow IPC ファイルに書き、memory-map したテーブルに置き換える"""
+        path = os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest())
+        os.makedirs(path, exist_ok=True)
+        mapped = {}
+        for name, table in entry.tables.items():
+            file_path = os.path.join(path, f"{name}.arrow")
+            with pa.OSFile(file_path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            mapped[name] = ipc.open_file(pa.memory_map(file_path, "r")).read_all()
+        entry.tables = mapped
+        entry.path = path
+        print(f"💾 Map spilled to disk: {path} ({entry.nbytes / 1024 / 1024:.1f} MB)")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> MapStore:
+    """プロセス共有の MapStore（Streamlit のセッション・再実行をまたいで同じものを返す）"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MapStore()
+        return _store
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COLUMNS = ("novelty_score", "feasibility_score", "marketability_score", "title", "summary", "category")
+
+
+def make_map(rows=300, broad=3, medium_per_broad=2, seed=0, int_scores=False):
+    """Nomic のマップと同じ形の (meta, topics, data)"""
+    rng = np.random.default_rng(seed)
+    d1 = rng.integers(0, broad, rows)
+    d2 = d1 * medium_per_broad + rng.integers(0, medium_per_broad, rows)
+    meta_rows = []
+    for b in range(broad):
+        meta_rows.append({"depth": 1, "topic_id": len(meta_rows), "topic_depth_1": f"B{b}",
+                          "topic_depth_2": None, "topic_description": f"broad {b}"})
+        for k in range(medium_per_broad):
+            meta_rows.append({"depth": 2, "topic_id": len(meta_rows), "topic_depth_1": f"B{b}",
+                              "topic_depth_2": f"M{b * medium_per_broad + k}", "topic_description": "medium"})
+    topics = pd.DataFrame({
+        "row_number": np.arange(rows),
+        "topic_depth_1": [f"B{x}" for x in d1],
+        "topic_depth_2": [f"M{x}" for x in d2],
+    })
+
+    def score():
+        return rng.integers(1, 6, rows).astype(float) if int_scores else (rng.random(rows) * 5).round(3)
+
+    data = pd.DataFrame({
+        "row_number": rng.permutation(rows),
+        "title": [f"idea {i}" for i in range(rows)],
+        "summary": [f"summary {i}" for i in range(rows)],
+        "category": rng.choice(["A", "B", "C"], rows),
+        "novelty_score": score(),
+        "feasibility_score": score(),
+        "marketability_score": score(),
+    })
+    return pd.DataFrame(meta_rows), topics, data
+
+
+@pytest.fixture
+def map_frames():
+    return make_map()
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+import nomic_module
+from conftest import COLUMNS, make_map
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """集計状態の保存先（.cache/aggregates）を一時ディレクトリに"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _until(topics, data, last_row):
+    """row_number が last_row 以下の行だけの (topics, data)（それまでに取り込まれていたマップ）"""
+    return topics[topics["row_number"] <= last_row], data[data["row_number"] <= last_row]
+
+
+def test_append_equals_a_full_rebuild(state_dir):
+    meta, topics, data = make_map(rows=1000, broad=4, medium_per_broad=3, seed=5)
+
+    _, info = nomic_module.append_master_dataframe(meta, *_until(topics, data, 699), *COLUMNS, "map")
+    assert info["mode"] == "rebuild" and info["new_rows"] == 700
+
+    appended, info = nomic_module.append_master_dataframe(meta, topics, data, *COLUMNS, "map")
+    assert info["mode"] == "append" and info["new_rows"] == 300
+
+    full = nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS)
+    pd.testing.assert_frame_equal(appended, full, check_dtype=False, check_exact=True)
+
+
+def test_reassigned_topics_rebuild_instead_of_appending(state_dir):
+    meta, topics, data = make_map(rows=1000, broad=4, medium_per_broad=3, seed=5)
+    nomic_module.append_master_dataframe(meta, *_until(topics, data, 699), *COLUMNS, "map")
+
+    # トピックの定義はそのまま、処理済みの行の一部を別の Broad / Medium に付け替える
+    moved = topics.copy()
+    swap = moved["row_number"] < 100
+    moved.loc[swap, ["topic_depth_1", "topic_depth_2"]] = ["B0", "M0"]
+    assert (moved != topics).any().any()
+
+    master, info = nomic_module.append_master_dataframe(meta, moved, data, *COLUMNS, "map")
+    assert info["mode"] == "rebuild"
+    assert info["reason"] == "topic assignments of processed rows changed"
+    full = nomic_module.prepare_master_dataframe(meta, moved, data, *COLUMNS)
+    pd.testing.assert_frame_equal(master, full, check_dtype=False)
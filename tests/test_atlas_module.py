@@ -0,0 +1,48 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import atlas_module
+import download_module
+import nomic_module
+
+
+class PublicOnlyMap:
+    """公開 API（topics / data / tile_destination）だけを持つ projection。非公開の属性に触ると失敗する"""
+
+    def __init__(self, cache):
+        self.tile_destination = Path(cache)
+        self.topics = SimpleNamespace(metadata=pd.DataFrame({"depth": [1]}), df=pd.DataFrame({"row_number": [0]}))
+        self.data = SimpleNamespace(df=pd.DataFrame({"row_number": [0], "title": ["idea"]}))
+
+    def __getattr__(self, name):
+        raise AssertionError(f"private nomic attribute used: {name}")
+
+
+@pytest.fixture
+def untested_nomic(monkeypatch):
+    monkeypatch.setattr(atlas_module, "_SUPPORTED", False)
+
+
+def test_tested_nomic_version_is_supported():
+    assert atlas_module.NOMIC_VERSION.startswith(atlas_module.TESTED_NOMIC_VERSIONS)
+    assert atlas_module.supported()
+
+
+def test_untested_nomic_fetches_with_the_public_api_only(untested_nomic, tmp_path):
+    projection = PublicOnlyMap(tmp_path / "cache")
+    with download_module.resumable(projection, version="v1"):
+        meta, topics, data = nomic_module.get_map_data(projection)
+    assert list(data["title"]) == ["idea"]
+    assert len(meta) == 1 and len(topics) == 1
+
+
+def test_untested_nomic_still_drops_stale_tiles(untested_nomic, tmp_path):
+    cache = tmp_path / "cache"
+    projection = PublicOnlyMap(cache)
+    with download_module.resumable(projection, version="v1"):
+        (cache / "0.feather").write_bytes(b"old")
+    with download_module.resumable(projection, version="v2"):
+        assert not (cache / "0.feather").exists()
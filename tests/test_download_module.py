@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+from pyarrow import feather
+
+import download_module
+
+
+# ==============================
+# 🧪 接続を意図的に切るローカルのタイルサーバー
+# ==============================
+
+class FlakyTileServer:
+    """
+    root 以下のファイルを Atlas のタイル URL の形（…/quadtree/<key>.feather）で返すローカルサーバー。
+    drop_every 回に1回、本文を途中まで送って接続を切る。fail_after を超えた分は全部切る（中断の再現）。
+    """
+
+    def __init__(self, root, drop_every=0, fail_after=None):
+        self.root = Path(root)
+        self.drop_every = drop_every
+        self.fail_after = fail_after
+        self.requests = 0
+        self.dropped = 0
+        self.paths = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _should_drop(self, name):
+        with self._lock:
+            self.requests += 1
+            self.paths.append(name)
+            drop = (self.drop_every and self.requests % self.drop_every == 0) or \
+                (self.fail_after is not None and self.requests > self.fail_after)
+            if drop:
+                self.dropped += 1
+            return drop
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.split("/quadtree/", 1)[-1]
+                path = server.root / name
+                if not path.is_file():
+                    self.send_error(404)
+                    return
+                body = path.read_bytes()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if server._should_drop(name):
+                    self.wfile.write(body[: len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+KEYS = [f"{i}/0/0" for i in range(8)]
+
+
+class FakeProjection:
+    """download_module が使う AtlasProjection の属性だけを持つ projection"""
+
+    def __init__(self, cache, url):
+        self.id = "projection"
+        self.tile_destination = Path(cache)
+        self.dataset = SimpleNamespace(id="dataset", header={}, atlas_api_path=url)
+        self._manifest_tb = None
+
+    @property
+    def _manifest(self):
+        if self._manifest_tb is None:
+            self._manifest_tb = feather.read_table(self.tile_destination / "manifest.feather")
+        return self._manifest_tb
+
+
+@pytest.fixture
+def tiles(tmp_path, monkeypatch):
+    """サーバー側のタイル（manifest と KEYS ごとの1タイル）"""
+    monkeypatch.setattr(download_module, "DOWNLOAD_ATTEMPTS", 2)
+    monkeypatch.setattr(download_module, "BACKOFF_BASE", 0.0)
+    root = tmp_path / "server"
+    root.mkdir()
+    feather.write_feather(pa.table({"key": KEYS}), root / "manifest.feather")
+    for i, key in enumerate(KEYS):
+        path = root / f"{key}.feather"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        feather.write_feather(pa.table({"row": [i]}), path)
+    return root
+
+
+def test_resumed_download_skips_completed_tiles_and_retries_failed_ones(tiles, tmp_path):
+    cache = tmp_path / "cache"
+    # manifest と 3タイルだけ届き、残りは途中で接続が切れる
+    with FlakyTileServer(tiles, fail_after=4) as server:
+        projection = FakeProjection(cache, server.url)
+        with pytest.raises(RuntimeError, match=r"Downloaded 3/8 'data' tiles"):
+            download_module.download_sidecar(projection, None)
+    done = {key for key in KEYS if download_module._is_complete(cache / f"{key}.feather")}
+    assert len(done) == 3
+    assert not list(cache.rglob("*.part"))
+
+    with FlakyTileServer(tiles) as server:
+        projection = FakeProjection(cache, server.url)
+        paths = download_module.download_sidecar(projection, None)
+
+    # 2回目は失敗したタイルだけを取り直す（manifest も済んだタイルも取らない）
+    assert sorted(server.paths) == sorted(f"{key}.feather" for key in KEYS if key not in done)
+    assert [feather.read_table(p)["row"][0].as_py() for p in paths] == list(range(len(KEYS)))
+
+
+def test_dropped_connections_are_retried(tiles, tmp_path):
+    with FlakyTileServer(tiles, drop_every=3) as server:
+        projection = FakeProjection(tmp_path / "cache", server.url)
+        paths = download_module.download_sidecar(projection, None)
+    assert server.dropped > 0
+    assert all(download_module._is_complete(p) for p in paths)
+
+
+def test_new_version_waits_for_readers_of_the_old_tiles(tiles, tmp_path):
+    cache = tmp_path / "cache"
+    with FlakyTileServer(tiles) as server:
+        reader = FakeProjection(cache, server.url)
+        refresher = FakeProjection(cache, server.url)
+        seen = []
+
+        def refresh():
+            with download_module.resumable(refresher, version=2):
+                seen.append(sorted(p.name for p in cache.glob("*/0/0.feather")))
+
+        with download_module.resumable(reader, version=1):
+            paths = reader._download_sidecar(None)
+            thread = threading.Thread(target=refresh)
+            thread.start()
+            time.sleep(0.2)
+            # 別の版の取得は、読んでいる間はタイルを消さずに待つ
+            assert thread.is_alive()
+            assert all(p.is_file() for p in paths)
+        thread.join(5)
+
+    assert seen == [[]]
+    assert json.loads((cache / download_module._STATE_FILE).read_text()) == {"version": 2}
@@ -0,0 +1,20 @@
+import history_module
+import nomic_module
+from conftest import COLUMNS, make_map
+
+
+def test_same_map_name_on_different_domains_is_kept_apart(tmp_path):
+    meta, topics, data = make_map(rows=100)
+    master = nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS)
+    db = str(tmp_path / "history.sqlite")
+    url = "https://atlas.nomic.ai/data/org/ideas/map"
+
+    history_module.record_run(master, url, COLUMNS, domain="atlas.nomic.ai", db_path=db)
+    history_module.record_run(master, url, COLUMNS, domain="atlas.nomic.ai", db_path=db)
+    history_module.record_run(master, url, COLUMNS, domain="atlas.example.com", db_path=db)
+
+    runs = history_module.list_maps(db_path=db).set_index("map_id")["runs"].to_dict()
+    assert runs == {"atlas.nomic.ai/ideas": 2, "atlas.example.com/ideas": 1}
+    assert nomic_module.map_key("atlas.nomic.ai", url) == "atlas.nomic.ai/ideas"
+    trend = history_module.trend("atlas.example.com/ideas", "1", "B0", "アイデア数", db_path=db)
+    assert len(trend) == 1
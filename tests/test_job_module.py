@@ -0,0 +1,175 @@
+import contextlib
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import download_module
+import history_module
+import job_module
+import nomic_module
+import sheet_module
+import snapshot_module
+import store_module
+from conftest import COLUMNS
+
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "design", "defalte.json"),
+          encoding="utf-8") as f:
+    STYLE = json.load(f)
+
+
+def test_write_sheet_reraises_cancel_from_on_step(map_frames):
+    df_master = nomic_module.prepare_master_dataframe(*map_frames, *COLUMNS)
+    job = job_module.Job("k", "test", job_module.OUTPUT_STAGES)
+    worksheet = sheet_module.DryRunWorksheet("s", len(df_master) + 1, len(df_master.columns))
+    written = []
+    steps = [
+        ("first", lambda ws, df: written.append("first")),
+        ("cancel", lambda ws, df: job.cancel()),
+        ("last", lambda ws, df: written.append("last")),
+    ]
+    prepared = sheet_module.PreparedSheet(worksheet, steps)
+
+    with pytest.raises(job_module.JobCancelled):
+        sheet_module.write_sheet(None, "s", None, df_master, STYLE, prepared=prepared,
+                                 on_step=lambda done, total: job.update(done / total))
+    assert written == ["first"]
+
+
+def test_write_sheet_reports_failing_step_as_error(map_frames):
+    df_master = nomic_module.prepare_master_dataframe(*map_frames, *COLUMNS)
+    worksheet = sheet_module.DryRunWorksheet("s")
+
+    def fail(ws, df):
+        raise ValueError()
+
+    prepared = sheet_module.PreparedSheet(worksheet, [("fail", fail)])
+    url, err = sheet_module.write_sheet(None, "s", None, df_master, STYLE, prepared=prepared)
+    assert url is None and err == "ValueError"
+
+
+def test_run_output_cancelled_mid_write_is_not_done(map_frames, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    meta, topics, data = map_frames
+    monkeypatch.setattr(nomic_module, "get_data", lambda *a, **k: (meta, topics, data, None))
+    written = []
+
+    def prepare(*args, **kwargs):
+        job = runner.active("cancel-test")
+        steps = [
+            ("first", lambda ws, df: written.append("first")),
+            ("cancel", lambda ws, df: job.cancel()),
+            ("last", lambda ws, df: written.append("last")),
+        ]
+        return sheet_module.PreparedSheet(sheet_module.DryRunWorksheet("s"), steps)
+
+    monkeypatch.setattr(sheet_module, "prepare_sheet", prepare)
+    runner = job_module.JobRunner(max_workers=1)
+    job = runner.submit("cancel-test", "Run Output", job_module.OUTPUT_STAGES, job_module.run_output,
+                        "t", "d", "m", COLUMNS, "u", "s", {}, STYLE, keywords=False)
+    runner._executor.shutdown(wait=True)
+
+    assert job.status == "cancelled"
+    assert job.result is None
+    assert written == ["first"]
+    # 書き込みが終わらなかった実行は履歴にもスナップショットにも残さない
+    assert snapshot_module.list_snapshots() == []
+    assert history_module.list_maps().empty
+
+
+def test_prepare_sheet_does_not_modify_sheet_before_write(map_frames, monkeypatch):
+    worksheet = sheet_module.DryRunWorksheet("s")
+    monkeypatch.setattr(sheet_module, "open_worksheet", lambda *a, **k: worksheet)
+    prepared = sheet_module.prepare_sheet("u", "s", {}, STYLE)
+    assert worksheet.spreadsheet.recorder.calls == []
+    assert prepared.steps[0][0] == "clear_sheet_rules"
+
+
+def test_run_output_failed_fetch_leaves_sheet_untouched(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    worksheet = sheet_module.DryRunWorksheet("s")
+    monkeypatch.setattr(sheet_module, "open_worksheet", lambda *a, **k: worksheet)
+    monkeypatch.setattr(nomic_module, "get_data", lambda *a, **k: (None, None, None, "boom"))
+    runner = job_module.JobRunner(max_workers=1)
+    job = runner.submit("fail-test", "Run Output", job_module.OUTPUT_STAGES, job_module.run_output,
+                        "t", "d", "m", COLUMNS, "u", "s", {}, STYLE)
+    runner._executor.shutdown(wait=True)
+    assert job.status == "failed"
+    assert [c for c in worksheet.spreadsheet.recorder.calls if c["method"] != "get"] == []
+
+
+def test_run_output_records_history_after_successful_write(map_frames, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    meta, topics, data = map_frames
+    monkeypatch.setattr(nomic_module, "get_data", lambda *a, **k: (meta, topics, data, None))
+    monkeypatch.setattr(sheet_module, "open_worksheet", lambda *a, **k: sheet_module.DryRunWorksheet("s"))
+    runner = job_module.JobRunner(max_workers=1)
+    job = runner.submit("ok-test", "Run Output", job_module.OUTPUT_STAGES, job_module.run_output,
+                        "t", "d", "m", COLUMNS, "u", "s", {}, STYLE)
+    runner._executor.shutdown(wait=True)
+    assert job.status == "done", job.error
+    assert [s["id"] for s in snapshot_module.list_snapshots()] == [job.result["snapshot_id"]]
+    assert len(history_module.list_maps()) == 1
+
+
+class FakeMaps:
+    """
+    Nomic の代わり（ログイン・データセットを開いた回数とタイルの取得回数を数える）。
+    ストアはテストごとに新しく作る。
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.opened = []
+        self.fetched = []
+
+    def open(self, token, domain, map_url):
+        self.opened.append((domain, map_url))
+        dataset = SimpleNamespace(dataset_fields=list(self.frames[2].columns))
+        projection = SimpleNamespace(id="projection", dataset=dataset)
+        return projection, (domain, nomic_module.extract_map_name(map_url), "projection", "v1")
+
+    def get_map_data(self, projection, fields=None, timings=None):
+        self.fetched.append(fields)
+        meta, topics, data = self.frames
+        return meta, topics, data if fields is None else data[list(fields)]
+
+
+@pytest.fixture
+def fake_maps(map_frames, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    maps = FakeMaps(map_frames)
+    monkeypatch.setattr(store_module, "_store", store_module.MapStore(spill_dir=str(tmp_path / "maps")))
+    monkeypatch.setattr(nomic_module, "_open_projection", maps.open)
+    monkeypatch.setattr(nomic_module, "get_map_data", maps.get_map_data)
+    monkeypatch.setattr(download_module, "resumable", lambda *a, **k: contextlib.nullcontext())
+    return maps
+
+
+def test_full_data_is_fetched_once_and_shared_between_sessions(fake_maps):
+    runner = job_module.JobRunner(max_workers=2)
+    jobs = [
+        runner.submit(("session", i), "Prepare Data CSV", job_module.FULL_DATA_STAGES, job_module.run_full_data,
+                      "t", "atlas.nomic.ai", "https://atlas.nomic.ai/data/team/map")
+        for i in range(2)
+    ]
+    runner._executor.shutdown(wait=True)
+    assert [job.status for job in jobs] == ["done", "done"]
+    key = jobs[0].result["data_key"]
+    assert jobs[1].result["data_key"] == key
+    # 全列のフレームはストアに1つだけ（取得も1回）、セッションが持つのはキーだけ
+    assert fake_maps.fetched == [None]
+    assert len(store_module.get_store().stats()) == 1
+    assert list(nomic_module.map_frames(key)[2].columns) == list(fake_maps.frames[2].columns)
+
+
+def test_run_download_logs_in_once(fake_maps):
+    runner = job_module.JobRunner(max_workers=1)
+    job = runner.submit("download-test", "Download data", job_module.DOWNLOAD_STAGES, job_module.run_download,
+                        "t", "atlas.nomic.ai", "https://atlas.nomic.ai/data/team/map", COLUMNS)
+    runner._executor.shutdown(wait=True)
+    assert job.status == "done", job.error
+    # フィールド一覧とフレームの取得で、ログイン・データセットの取得は1回
+    assert fake_maps.opened == [("atlas.nomic.ai", "https://atlas.nomic.ai/data/team/map")]
+    assert fake_maps.fetched == [("row_number",) + COLUMNS]
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+import keyword_module
+import nomic_module
+from conftest import COLUMNS, make_map
+
+
+def test_tokenize_corpus_treats_missing_values_as_empty_documents():
+    texts = pd.Series(["Solar roof", np.nan, None, pd.NA, "solar panel"], dtype=object)
+    docs, terms, vocab = keyword_module.tokenize_corpus(texts)
+    words = set(vocab[terms])
+    assert "nan" not in words and "<na>" not in words and "none" not in words
+    assert sorted(set(docs.tolist())) == [0, 4]
+
+
+def test_topic_keywords_ignore_missing_values():
+    meta, topics, data = make_map(rows=200)
+    # 欠損を1つの Broad トピックに寄せる（astype(str) だけだと "nan" / "na" がそのトピックの特徴語になる）
+    broad = data["row_number"].map(topics.set_index("row_number")["topic_depth_1"])
+    data["summary"] = data["summary"].astype("string")
+    data.loc[broad == "B0", "title"] = np.nan
+    data.loc[broad == "B0", "summary"] = pd.NA
+    master = nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS, keywords=True)
+    words = set(" ".join(master["キーワード"]).replace(",", " ").lower().split())
+    assert not words & {"nan", "na", "<na>"}
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+import map_module
+
+
+def _points(seed=0):
+    """3トピックの密な塊と、塊から離れた孤立点（座標が NaN の行も含む）"""
+    rng = np.random.default_rng(seed)
+    centers = np.array([[0.0, 0.0], [10.0, 0.0], [5.0, 8.0]])
+    topic = rng.integers(0, 3, 6000)
+    xy = centers[topic] + rng.normal(scale=0.5, size=(6000, 2))
+    outliers = np.array([[-20.0, 20.0], [30.0, -15.0], [30.0, 25.0]])
+    x = np.r_[xy[:, 0], outliers[:, 0], np.nan]
+    y = np.r_[xy[:, 1], outliers[:, 1], 1.0]
+    topics = np.r_[np.array(["A", "B", "C"])[topic], ["A", "B", "C"], ["A"]]
+    return x, y, topics
+
+
+def test_pyramid_levels_count_every_point_once():
+    x, y, topics = _points()
+    pyramid = map_module.build_pyramid(x, y, topics, grid=8, max_level=4)
+
+    assert len(pyramid) == 6003
+    assert len(pyramid.levels) == 5
+    previous = None
+    for z, (cells, cell_of) in enumerate(zip(pyramid.levels, pyramid.cell_of)):
+        assert cells["count"].sum() == len(pyramid)
+        np.testing.assert_array_equal(np.bincount(cell_of, minlength=len(cells)), cells["count"])
+        assert cells["cx"].max() < 8 * 2 ** z and cells["cy"].max() < 8 * 2 ** z
+        # 1つ細かいレベルのセルを縦横半分にまとめると、粗いレベルの件数と一致する
+        if previous is not None:
+            merged = cells.assign(cx=cells["cx"] // 2, cy=cells["cy"] // 2).groupby(["cx", "cy"])["count"].sum()
+            coarse = previous.set_index(["cx", "cy"])["count"]
+            pd.testing.assert_series_equal(merged.sort_index(), coarse.sort_index(), check_names=False)
+        previous = cells
+
+
+def test_query_downsamples_to_the_mark_budget_and_keeps_outliers():
+    x, y, topics = _points()
+    pyramid = map_module.build_pyramid(x, y, topics, grid=8, max_level=4)
+
+    marks, level, n_inside = map_module.query(pyramid, max_marks=200)
+    cells = marks[marks["kind"] == "cell"]
+    points = marks[marks["kind"] == "point"]
+    assert n_inside == 6003
+    assert level is not None
+    assert len(cells) <= 200
+    # 集約セルと個別の点を合わせると範囲内の点数になり、孤立点は点のまま残る
+    assert marks["count"].sum() == n_inside
+    assert (cells["count"] > map_module.OUTLIER_MAX).all()
+    assert {(20.0, -20.0), (-15.0, 30.0), (25.0, 30.0)} <= set(zip(points["y"], points["x"]))
+
+    # 次に細かいレベルは予算を超える（予算に収まる一番細かいレベルを選んでいる）
+    if level + 1 < len(pyramid.levels):
+        assert len(pyramid.levels[level + 1]) > 200
+
+    few, few_level, _ = map_module.query(pyramid, max_marks=len(pyramid))
+    assert few_level is None
+    assert len(few) == len(pyramid) and (few["kind"] == "point").all()
+
+
+def test_query_counts_only_points_inside_the_view():
+    x = np.array([0.1, 0.2, 0.3, 0.4, 0.6, 0.7, 0.8, 0.9])
+    y = np.full(8, 0.5)
+    pyramid = map_module.build_pyramid(x, y, ["A"] * 8, grid=1, max_level=0)
+
+    marks, level, n_inside = map_module.query(pyramid, view=(0.0, 0.45, 0.0, 1.0), max_marks=1)
+    assert (level, n_inside) == (0, 4)
+    # セルの件数は範囲内の点だけで数え直す（位置はセル全体の平均のまま）
+    assert marks[["count", "topic", "kind"]].to_dict("records") == [{"count": 4, "topic": "A", "kind": "cell"}]
+    assert np.allclose(marks[["x", "y"]].to_numpy(), [[0.5, 0.5]])
@@ -0,0 +1,149 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+import dedup_module
+import nomic_module
+from conftest import COLUMNS, make_map
+
+
+def _embeddings(topics, data, seed=0):
+    """Broad トピック内で、別の Medium にまたがる重複も含む埋め込み（data の行順）"""
+    rng = np.random.default_rng(seed)
+    emb = rng.normal(size=(len(data), 8))
+    broad = data["row_number"].map(topics.set_index("row_number")["topic_depth_1"]).to_numpy()
+    for b in np.unique(broad):
+        members = np.flatnonzero(broad == b)
+        # 各 Broad で半分の行を、同じ Broad のどれかの行の近傍にする
+        for i in members[: len(members) // 2]:
+            emb[i] = emb[rng.choice(members)] + rng.normal(scale=1e-3, size=8)
+    return dedup_module.normalize_embeddings(emb)
+
+
+def _reference(joined, emb, topic_col, total, threshold):
+    """トピックごとに総当たりで求めた (重複除外アイデア数, 代表の平均スコア)"""
+    out = {}
+    for topic, group in joined.groupby(topic_col):
+        positions = group.index.to_numpy()
+        x = emb[group["_pos"].to_numpy()]
+        parent = list(range(len(positions)))
+
+        def find(i):
+            while parent[i] != i:
+                i = parent[i]
+            return i
+
+        sims = x @ x.T
+        for i in range(len(positions)):
+            for j in range(i + 1, len(positions)):
+                if sims[i, j] >= threshold:
+                    a, b = find(i), find(j)
+                    parent[max(a, b)] = min(a, b)
+        reps = [positions[i] for i in range(len(positions)) if find(i) == i]
+        out[topic] = (len(reps), round(float(total[reps].mean()), 2))
+    return out
+
+
+def test_duplicate_stats_count_and_mean_use_the_same_clusters_per_level():
+    meta, topics, data = make_map(rows=400, broad=3, medium_per_broad=3, seed=1)
+    emb = _embeddings(topics, data)
+    threshold = 0.99
+    master = nomic_module.prepare_master_dataframe(
+        meta, topics, data, *COLUMNS, embeddings=emb, dedup_threshold=threshold
+    )
+
+    joined = topics.merge(
+        pd.DataFrame({"row_number": data["row_number"], "_pos": np.arange(len(data))}), on="row_number"
+    )
+    scores = data[list(COLUMNS[:3])].to_numpy()
+    total = scores[joined["_pos"].to_numpy()].sum(axis=1)
+
+    for depth, topic_col, master_col in [
+        ("1", "topic_depth_1", "Nomic Topic: Broad"),
+        ("2", "topic_depth_2", "Nomic Topic: Medium"),
+    ]:
+        expected = _reference(joined, emb, topic_col, total, threshold)
+        rows = master[master["depth"] == depth]
+        assert len(rows) > 0
+        for _, row in rows.iterrows():
+            count, mean = expected[row[master_col]]
+            assert row["重複除外アイデア数"] == count
+            assert row["重複除外平均スコア"] == mean
+        assert rows["重複アイデア数"].sum() > 0
+
+
+def test_find_duplicate_clusters_indexes_rows_without_reordering():
+    rng = np.random.default_rng(0)
+    emb = dedup_module.normalize_embeddings(rng.normal(size=(50, 4)))
+    emb = dedup_module.normalize_embeddings(np.vstack([emb, emb[:10]]))
+    pos = rng.permutation(len(emb))
+    groups = rng.integers(0, 3, len(emb))
+
+    by_rows = dedup_module.find_duplicate_clusters(emb, groups, rows=pos, threshold=0.999)
+    copied = dedup_module.find_duplicate_clusters(emb[pos], groups, threshold=0.999)
+    np.testing.assert_array_equal(by_rows, copied)
+    assert (by_rows != np.arange(len(emb))).any()
+
+
+class FakeAtlas:
+    """nomic.login（資格情報をプロセス共通で書く）と AtlasDataset（それを読んでヘッダーを作る）の偽物"""
+
+    def __init__(self):
+        self.credentials = None
+        self.indices = [{"id": "index", "projections": [{"id": "projection"}]}]
+        self.total = 100
+
+    def login(self, token, domain=None):
+        self.credentials = token
+        time.sleep(0.01)
+
+    def dataset(self, map_id):
+        atlas = self
+        time.sleep(0.01)
+        meta = {"total_datums_in_project": atlas.total, "schema": None, "atlas_indices": atlas.indices}
+        dataset = SimpleNamespace(header={"token": atlas.credentials}, meta=meta)
+        dataset.maps = [SimpleNamespace(id="projection", dataset=dataset)]
+        return dataset
+
+
+def test_open_projection_uses_each_callers_token(monkeypatch):
+    atlas = FakeAtlas()
+    monkeypatch.setattr(nomic_module.nomic, "login", atlas.login)
+    monkeypatch.setattr(nomic_module, "AtlasDataset", atlas.dataset)
+
+    tokens = [f"token-{i}" for i in range(16)]
+    with ThreadPoolExecutor(8) as pool:
+        opened = list(pool.map(lambda t: nomic_module._open_projection(t, None, "map")[0], tokens))
+    assert [p.dataset.header["token"] for p in opened] == tokens
+
+
+def test_dataset_version_changes_when_the_index_is_rebuilt_with_the_same_count(monkeypatch):
+    atlas = FakeAtlas()
+    monkeypatch.setattr(nomic_module.nomic, "login", atlas.login)
+    monkeypatch.setattr(nomic_module, "AtlasDataset", atlas.dataset)
+
+    _, before = nomic_module._open_projection("token", None, "map")
+    _, same = nomic_module._open_projection("token", None, "map")
+    atlas.indices = [{"id": "index", "projections": [{"id": "projection"}], "updated": "later"}]
+    _, after = nomic_module._open_projection("token", None, "map")
+    assert before == same
+    assert before[:3] == after[:3] and before[3] != after[3]
+
+
+def test_master_table_parses_each_score_column_once(monkeypatch):
+    meta, topics, data = make_map(rows=200)
+    data = data.astype({col: str for col in COLUMNS[:3]})
+    calls = []
+    to_numeric = pd.to_numeric
+
+    def counting(values, *args, **kwargs):
+        calls.append(getattr(values, "name", None))
+        return to_numeric(values, *args, **kwargs)
+
+    monkeypatch.setattr(pd, "to_numeric", counting)
+    nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS, keywords=True)
+    nomic_module.build_category_crosstab(meta, topics, data, *COLUMNS[:3], COLUMNS[5])
+    assert sorted(c for c in calls if c in COLUMNS) == sorted(COLUMNS[:3])
@@ -0,0 +1,51 @@
+import numpy as np
+
+import parallel_module
+
+
+def test_group_stats_with_different_worker_counts_share_one_pool():
+    rng = np.random.default_rng(0)
+    n = 2000
+    d1 = rng.integers(0, 6, n)
+    d2 = d1 * 3 + rng.integers(0, 3, n)
+    sums = rng.random((n, 2))
+    total = sums.sum(axis=1)
+    pos = np.arange(n)
+    expected = (parallel_module.partial_stats(d1, sums, total, pos), parallel_module.partial_stats(d2, sums, total, pos))
+
+    pool = parallel_module.get_pool()
+    for workers in (2, 3):
+        result = parallel_module.group_stats(d1, d2, sums, total, pos, workers=workers)
+        for got, want in zip(result, expected):
+            for a, b in zip(got, want):
+                np.testing.assert_allclose(a, b)
+    # 並列数の違う呼び出しでプールを作り直さない（使用中の他のジョブのプールを止めない）
+    assert parallel_module.get_pool() is pool
+
+
+def test_run_limited_keeps_at_most_workers_tasks_running(monkeypatch):
+    running, peak = [0], [0]
+
+    class Future:
+        def __init__(self, value):
+            self.value = value
+
+        def result(self):
+            return self.value
+
+    class Pool:
+        def submit(self, fn, *args):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            return Future(fn(*args))
+
+    def fake_wait(futures, return_when=None):
+        done = set(list(futures)[:1]) if return_when else set(futures)
+        running[0] -= len(done)
+        return done, set(futures) - done
+
+    monkeypatch.setattr(parallel_module, "get_pool", lambda: Pool())
+    monkeypatch.setattr(parallel_module, "wait", fake_wait)
+    results = parallel_module.run_limited(lambda x: x * 2, [(i,) for i in range(10)], workers=3)
+    assert results == [i * 2 for i in range(10)]
+    assert peak[0] == 3
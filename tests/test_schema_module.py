@@ -0,0 +1,28 @@
+import pandas as pd
+
+import schema_module
+from conftest import COLUMNS, make_map
+
+
+def test_fuzzy_match_is_reported_instead_of_remapping():
+    _, _, data = make_map(rows=20)
+    data = data.rename(columns={"novelty_score": "novelty_scores"})
+    columns, report = schema_module.resolve_columns(data, COLUMNS)
+
+    assert columns == COLUMNS
+    row = report.set_index("役割").loc["novelty"]
+    assert row["一致"] == "fuzzy" and row["使用列"] is None and row["候補"] == "novelty_scores"
+    assert schema_module.has_issues(report)
+    assert "did you mean 'novelty_scores'?" in schema_module.summarize(report)
+    # 取得する列も勝手に差し替えない
+    assert schema_module.resolve_fields(list(data.columns), COLUMNS)[0] == "novelty_score"
+
+
+def test_normalized_and_candidate_matches_are_still_applied():
+    _, _, data = make_map(rows=20)
+    data = data.rename(columns={"novelty_score": "Novelty Score", "title": "タイトル"})
+    columns, report = schema_module.resolve_columns(data, COLUMNS)
+
+    assert columns[0] == "Novelty Score" and columns[3] == "タイトル"
+    assert list(report["一致"][:4]) == ["normalized", "exact", "exact", "candidate"]
+    assert report["候補"].isna().all()
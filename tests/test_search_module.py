@@ -0,0 +1,22 @@
+import nomic_module
+import search_module
+from conftest import COLUMNS, make_map
+
+
+def test_same_map_name_on_different_domains_is_kept_apart(tmp_path):
+    db = str(tmp_path / "search.sqlite")
+    url = "https://atlas.nomic.ai/data/org/ideas/map"
+    n, f, m, t, s, c = COLUMNS
+    for domain, word in [("atlas.nomic.ai", "rocket"), ("atlas.example.com", "garden")]:
+        _, topics, data = make_map(rows=50)
+        data["title"] = [f"{word} idea {i}" for i in range(len(data))]
+        added, removed = search_module.update_index(url, topics, data, t, s, c, n, f, m, domain=domain, db_path=db)
+        assert (added, removed) == (50, 0)
+
+    nomic = search_module.search(url, "idea", domain="atlas.nomic.ai", db_path=db)
+    example = search_module.search(url, "idea", domain="atlas.example.com", db_path=db)
+    assert len(nomic) == len(example) == 50
+    assert nomic["アイデア名"].str.startswith("rocket").all()
+    assert example["アイデア名"].str.startswith("garden").all()
+    assert search_module.search(url, "garden", domain="atlas.nomic.ai", db_path=db).empty
+    assert nomic_module.map_key("atlas.example.com", url) == "atlas.example.com/ideas"
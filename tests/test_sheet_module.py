@@ -0,0 +1,266 @@
+import json
+from pathlib import Path
+
+import pandas as pd
+
+import nomic_module
+import scoring_module
+import sheet_module
+from conftest import COLUMNS, make_map
+
+DESIGN = Path(__file__).resolve().parent.parent / "design" / "defalte.json"
+
+
+class RulesService(sheet_module.DryRunRecorder):
+    """spreadsheets.get に、シートごとの条件付き書式を返す Sheets サービス"""
+
+    def __init__(self, rules_by_sheet):
+        super().__init__()
+        self.rules_by_sheet = rules_by_sheet
+
+    def get(self, **kwargs):
+        response = {"sheets": [
+            {"properties": {"sheetId": sheet_id}, "conditionalFormats": [{}] * count}
+            for sheet_id, count in self.rules_by_sheet.items()
+        ]}
+        return sheet_module._RecordedCall(self, "get", kwargs, response)
+
+
+class Spreadsheet(sheet_module._DryRunSpreadsheet):
+    id = "sid"
+    url = "url"
+
+
+class Worksheet:
+    url = "url"
+
+    def __init__(self, spreadsheet, sheet_id, title="sheet"):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+
+
+def _deletes(service):
+    return [
+        request["deleteConditionalFormatRule"]
+        for call in service.calls if call["method"] == "batchUpdate"
+        for request in call["body"]["requests"] if "deleteConditionalFormatRule" in request
+    ]
+
+
+def test_rule_cleanup_counts_only_target_sheet():
+    # マスターシート（id 1）にプルダウンのルールが 5 件、クロス集計シート（id 2）にヒートマップが 2 件
+    service = RulesService({1: 5, 2: 2})
+    requests = sheet_module._rule_cleanup_requests(service, "sid", 2)
+    deletes = [r for r in requests if "deleteConditionalFormatRule" in r]
+    assert len(deletes) == 2
+    assert all(r["deleteConditionalFormatRule"]["sheetId"] == 2 for r in deletes)
+    assert "sheetId" in service.calls[0]["params"]["fields"]
+
+
+def test_clear_sheet_rules_and_reset_sheet_delete_own_rules_only():
+    service = RulesService({1: 5, 2: 2, 3: 0})
+    sheet_module.clear_sheet_rules(Worksheet(Spreadsheet(service), 1))
+    assert len(_deletes(service)) == 5
+
+    service = RulesService({1: 5, 2: 2, 3: 0})
+    sheet_module.reset_sheet(Worksheet(Spreadsheet(service), 3), num_rows=10, num_cols=3)
+    assert _deletes(service) == []
+
+
+def test_write_crosstab_sheet_next_to_master(map_frames, monkeypatch):
+    service = RulesService({1: 5, 2: 2})
+    worksheet = Worksheet(Spreadsheet(service), 2, "カテゴリー×トピック")
+    monkeypatch.setattr(sheet_module, "open_worksheet", lambda *a, **k: worksheet)
+    n, f, m, _, _, c = COLUMNS
+    df_cross = nomic_module.build_category_crosstab(*map_frames, n, f, m, c)
+
+    url, err = sheet_module.write_crosstab_sheet("u", worksheet.title, {}, df_cross)
+    assert err is None
+    assert len(_deletes(service)) == 2
+    added = [
+        request["addConditionalFormatRule"]
+        for call in service.calls if call["method"] == "batchUpdate"
+        for request in call["body"]["requests"] if "addConditionalFormatRule" in request
+    ]
+    assert len(added) == 2
+
+
+def test_write_table_sheet_diff_next_to_master(monkeypatch):
+    service = RulesService({1: 5, 7: 0})
+    worksheet = Worksheet(Spreadsheet(service), 7, "差分")
+    monkeypatch.setattr(sheet_module, "open_worksheet", lambda *a, **k: worksheet)
+    df = pd.DataFrame({"topic": ["a", "b"], "diff": [1, -2]})
+    url, err = sheet_module.write_table_sheet("u", worksheet.title, {}, df)
+    assert err is None
+    assert _deletes(service) == []
+
+
+def test_write_values_sends_user_entered_values():
+    worksheet = sheet_module.DryRunWorksheet("s")
+    df = pd.DataFrame({"depth": ["1"], "比率": ["17.4%"], "title": ["'quoted"], "score": [float("nan")]})
+    sheet_module.write_values(worksheet, df)
+    body = [c["body"] for c in worksheet.spreadsheet.recorder.calls if c["method"] == "values.batchUpdate"][0]
+    assert body["valueInputOption"] == "USER_ENTERED"
+    assert body["data"][0]["values"] == [["depth", "比率", "title", "score"], ["1", "17.4%", "''quoted", ""]]
+
+
+def _four_criteria_master():
+    """既定の3軸に、データの列を直接使う4つめの基準を足した採点モデルのマスターテーブル"""
+    meta, topics, data = make_map(rows=200)
+    data["impact_score"] = data["novelty_score"]
+    model = scoring_module.default_model_dict()
+    model["criteria"].append({"key": "impact_score", "label": "インパクト", "column": "impact_score"})
+    return nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS, model=model)
+
+
+def _styled_columns(plan, key):
+    """dry-run の style_column[key] の手順で、値の書式・列幅を当てた列番号"""
+    formats, widths = set(), set()
+    for call in plan["calls"]:
+        if call["step"] != f"style_column[{key}]":
+            continue
+        for request in call["body"]["requests"]:
+            if "repeatCell" in request:
+                target = request["repeatCell"]["range"]
+                percent = "numberFormat" in request["repeatCell"]["cell"]["userEnteredFormat"]
+                formats.update((j, percent) for j in range(target["startColumnIndex"], target["endColumnIndex"]))
+            if "updateDimensionProperties" in request:
+                target = request["updateDimensionProperties"]["range"]
+                widths.update(range(target["startIndex"], target["endIndex"]))
+    return formats, widths
+
+
+def test_column_styles_follow_the_scoring_model_columns():
+    df = _four_criteria_master()
+    style = json.loads(DESIGN.read_text(encoding="utf-8"))
+    plan, err = sheet_module.write_sheet("u", "s", {}, df, style, dry_run=True)
+    assert err is None
+
+    columns = list(df.columns)
+    ratio = {j for j, col in enumerate(columns) if "比率" in col}
+    percent = set()
+    for key in style["columns"]:
+        formats, _ = _styled_columns(plan, key)
+        percent |= {j for j, is_percent in formats if is_percent}
+    # PERCENT は比率の列（4つめの基準の分も）だけに当たる
+    assert percent == ratio and len(ratio) == 5
+
+    _, widths = _styled_columns(plan, "V")
+    assert [columns[j] for j in widths] == ["アイデア名"]
+    _, widths = _styled_columns(plan, "AB")
+    assert sorted(columns[j] for j in widths) == ["インパクトスコア", "実現性スコア"]
+
+
+def test_column_letters_keep_their_position_with_the_default_model(map_frames):
+    df = nomic_module.prepare_master_dataframe(*map_frames, *COLUMNS)
+    style = json.loads(DESIGN.read_text(encoding="utf-8"))
+    for j, key in enumerate(sorted(style["columns"], key=lambda k: (len(k), k))):
+        assert scoring_module.style_targets(key, df.columns) == [j]
+
+
+def test_dry_run_plan_counts_recorded_calls():
+    recorder = sheet_module.DryRunRecorder()
+    service = recorder.spreadsheets()
+    recorder.step = "a"
+    service.batchUpdate(spreadsheetId="sid", body={"requests": [{"repeatCell": {}}, {"repeatCell": {}}]}).execute()
+    service.get(spreadsheetId="sid", fields="sheets").execute()
+    recorder.step = "b"
+    service.values().batchUpdate(spreadsheetId="sid", body={"data": [{"values": [[1]]}] * 3}).execute()
+
+    df = pd.DataFrame({"x": range(4)})
+    plan = sheet_module.build_dry_run_plan(recorder, "s", df)
+    assert (plan["rows"], plan["cols"]) == (5, 1)
+    steps = {st["step"]: st for st in plan["steps"]}
+    assert steps["a"]["request_types"] == {"repeatCell": 2}
+    assert (steps["a"]["read_calls"], steps["a"]["write_calls"]) == (1, 1)
+    assert steps["b"]["request_types"] == {"valueRange": 3}
+    assert plan["totals"]["http_calls"] == 3 and plan["totals"]["requests"] == 5
+    assert plan["totals"]["estimated_quota_minutes"] == round(2 / sheet_module.WRITE_QUOTA_PER_MINUTE, 2)
+    assert plan["calls"][1]["params"] == {"fields": "sheets"}
+    assert plan["warnings"] == []
+
+
+def test_dry_run_with_template_plans_the_clone_instead_of_styling(map_frames):
+    df = nomic_module.prepare_master_dataframe(*map_frames, *COLUMNS)
+    style = json.loads(DESIGN.read_text(encoding="utf-8"))
+    styled, err = sheet_module.write_sheet("u", "s", {}, df, style, dry_run=True)
+    assert err is None
+    cloned, err = sheet_module.write_sheet("u", "s", {}, df, style, dry_run=True, template=True)
+    assert err is None
+
+    assert [st["step"] for st in cloned["steps"]] == ["clone_template", "write_values", "dropdowns"]
+    clone = cloned["steps"][0]["request_types"]
+    assert clone["duplicateSheet"] == 1 and clone["deleteSheet"] == 1
+    # 書式は複製で済むので、リクエストもクォータも書式を当てる場合より少ない
+    assert cloned["totals"]["write_calls"] < styled["totals"]["write_calls"]
+    assert cloned["totals"]["estimated_quota_minutes"] < styled["totals"]["estimated_quota_minutes"]
+
+
+class TemplateSpreadsheet(sheet_module._DryRunSpreadsheet):
+    """ワークシートの追加を覚える、通信しないスプレッドシート（batchUpdate は記録だけ）"""
+
+    def __init__(self):
+        super().__init__(sheet_module.DryRunRecorder())
+        self.added = []
+
+    def add_worksheet(self, title, rows, cols):
+        worksheet = sheet_module.DryRunWorksheet(title, rows, cols, sheet_id=100 + len(self.existing))
+        worksheet.spreadsheet = self
+        self.existing.append(worksheet)
+        self.added.append(title)
+        return worksheet
+
+
+def _open_or_create(spreadsheet):
+    """open_worksheet の代わり（無ければ作る）"""
+    def open_worksheet(url, title, info, rows=100, cols=26):
+        for worksheet in spreadsheet.existing:
+            if worksheet.title == title:
+                return worksheet
+        return spreadsheet.add_worksheet(title=title, rows=rows, cols=cols)
+    return open_worksheet
+
+
+def _clone_batches(spreadsheet):
+    return [
+        call["body"]["requests"] for call in spreadsheet.recorder.calls
+        if call["method"] == "batchUpdate" and "requests" in call["body"]
+        and any("duplicateSheet" in r for r in call["body"]["requests"])
+    ]
+
+
+def test_template_clone_replaces_the_sheet_in_order(map_frames, monkeypatch):
+    df = nomic_module.prepare_master_dataframe(*map_frames, *COLUMNS)
+    style = json.loads(DESIGN.read_text(encoding="utf-8"))
+    spreadsheet = TemplateSpreadsheet()
+    monkeypatch.setattr(sheet_module, "open_worksheet", _open_or_create(spreadsheet))
+
+    # 1回目：出力先のシートもテンプレートもまだ無い
+    url, err = sheet_module.write_sheet("u", "s", {}, df, style, template=True)
+    assert err is None
+    template = sheet_module.template_title(style, df)
+    assert spreadsheet.added == ["s", template]
+    target, built = spreadsheet.existing
+    hidden = {"updateSheetProperties": {"properties": {"sheetId": built.id, "hidden": True}, "fields": "hidden"}}
+    assert any(hidden in call["body"].get("requests", []) for call in spreadsheet.recorder.calls if call["body"])
+
+    # 2回目：テンプレートは作り直さず、複製だけ
+    url, err = sheet_module.write_sheet("u", "s", {}, df, style, template=True)
+    assert err is None
+    assert spreadsheet.added == ["s", template]
+
+    for requests in _clone_batches(spreadsheet):
+        kinds = [next(iter(r)) for r in requests]
+        duplicate = requests[kinds.index("duplicateSheet")]["duplicateSheet"]
+        delete = kinds.index("deleteSheet")
+        rename = next(i for i, r in enumerate(requests)
+                      if r.get("updateSheetProperties", {}).get("fields") == "title")
+        # 複製 → 元のシートを削除 → 複製に元の名前を付ける
+        assert kinds.index("duplicateSheet") < delete < rename
+        assert duplicate["sourceSheetId"] == built.id
+        assert requests[delete]["deleteSheet"]["sheetId"] == target.id
+        assert requests[rename]["updateSheetProperties"]["properties"] == {
+            "sheetId": duplicate["newSheetId"], "title": "s",
+        }
+    assert len(_clone_batches(spreadsheet)) == 2
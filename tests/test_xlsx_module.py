@@ -0,0 +1,75 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+import nomic_module
+import scoring_module
+import xlsx_module
+from conftest import COLUMNS, make_map
+
+openpyxl = pytest.importorskip("openpyxl")
+
+DESIGN = Path(__file__).resolve().parent.parent / "design" / "defalte.json"
+
+
+def _read(data):
+    return openpyxl.load_workbook(io.BytesIO(data))
+
+
+def test_column_styles_follow_the_scoring_model_columns():
+    meta, topics, data = make_map(rows=200)
+    data["impact_score"] = data["novelty_score"]
+    model = scoring_module.default_model_dict()
+    model["criteria"].append({"key": "impact_score", "label": "インパクト", "column": "impact_score"})
+    df = nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS, model=model)
+
+    style = json.loads(DESIGN.read_text(encoding="utf-8"))
+    out, err = xlsx_module.export_xlsx(df, style)
+    assert err is None
+    sheet = _read(out).worksheets[0]
+    dims = {d.min - 1: d for d in sheet.column_dimensions.values()}
+
+    columns = list(df.columns)
+    percent = {j for j, d in dims.items() if d.number_format == "0.00%"}
+    assert percent == {j for j, col in enumerate(columns) if "比率" in col}
+    # 列幅もずれない（アイデア名は 300px、4つめの基準の最優秀スコアは他の基準と同じ 110px）
+    idea = columns.index("アイデア名")
+    assert dims[idea].width > dims[idea - 1].width
+    assert dims[columns.index("インパクトスコア")].width == dims[columns.index("新規性スコア")].width
+
+
+def test_export_xlsx_writes_master_and_idea_sheets(map_frames):
+    meta, topics, data = map_frames
+    # Broad 名を長くして、プルダウンの候補を隠しシート _lists に回す
+    topics["topic_depth_1"] = topics["topic_depth_1"].str.replace("B", "Broad topic " + "x" * 100, regex=False)
+    meta["topic_depth_1"] = meta["topic_depth_1"].str.replace("B", "Broad topic " + "x" * 100, regex=False)
+    df = nomic_module.prepare_master_dataframe(meta, topics, data, *COLUMNS)
+    ideas = data[["row_number", "title", "novelty_score"]].head(20)
+
+    style = json.loads(DESIGN.read_text(encoding="utf-8"))
+    out, err = xlsx_module.export_xlsx(df, style, df_ideas=ideas, idea_sheet_name="ideas")
+    assert err is None
+    book = _read(out)
+    assert book.sheetnames == ["シート1", "_lists", "ideas"]
+    master, table, lists = book["シート1"], book["ideas"], book["_lists"]
+
+    assert [c.value for c in master[1]] == list(df.columns)
+    assert master.max_row == len(df) + 1
+    assert master.freeze_panes == "A2"
+    assert master.auto_filter.ref == f"A1:{master.cell(1, len(df.columns)).column_letter}{len(df) + 1}"
+    assert master["L1"].font.color.rgb.endswith("FFFFFF") and master["L1"].fill.fgColor.rgb.endswith("356854")
+    assert master.column_dimensions["L"].number_format == "0.00%"
+
+    # 長いプルダウン（C列の Broad）は隠しシートを参照し、短いもの（D列の Medium）は直接書く
+    assert lists.sheet_state == "hidden"
+    broad = sorted(df["Nomic Topic: Broad"].unique())
+    assert [c.value for c in lists["A"][1:]] == broad
+    validations = {str(v.sqref).split(":")[0][0]: v for v in master.data_validations.dataValidation}
+    assert validations["C"].formula1 == f"'_lists'!$A$2:$A${len(broad) + 1}"
+    assert validations["D"].formula1.startswith('"M0,')
+
+    assert [c.value for c in table[1]] == list(ideas.columns)
+    assert [c.value for c in table["B"][1:]] == ideas["title"].tolist()
+    assert table.max_row == len(ideas) + 1
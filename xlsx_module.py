@@ -0,0 +1,352 @@
+import colorsys
+import io
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+import scoring_module
+
+
+# ===============================
+# 📦 オフライン XLSX エクスポート（サービスアカウント不要）
+# ===============================
+# Excel のセル1つあたりの文字数上限
+_MAX_CELL_CHARS = 32767
+# 値を Python のオブジェクトに変換する単位（行）
+_BLOCK_ROWS = 10000
+# データ検証のリストを直接書ける長さの上限（超える分は隠しシートを参照）
+_MAX_LIST_CHARS = 255
+# base_sheet_design の交互色
+_ZEBRA_COLOR = "#F6F8F9"
+# dropdowns の D列の文字色
+_SUBTOPIC_TEXT_COLOR = "#646464"
+
+_HORIZONTAL = {"LEFT": "left", "CENTER": "center", "RIGHT": "right"}
+_VERTICAL = {"TOP": "top", "MIDDLE": "vcenter", "BOTTOM": "bottom"}
+_NUMBER_FORMATS = {"PERCENT": "0.00%", "NUMBER": "0.00", "CURRENCY": "¥#,##0.00"}
+
+
+def _column_props(params):
+    """style_column の引数 → xlsxwriter の書式プロパティ（背景は触らない）"""
+    wrap = params.get("wrap", False)
+    if not isinstance(wrap, bool):
+        wrap = str(wrap).upper() == "WRAP"
+    props = {
+        "font_name": params.get("fontFamily", "Roboto"),
+        "font_size": int(params.get("fontSize", 10)),
+        "bold": bool(params.get("bold", False)),
+        "italic": bool(params.get("italic", False)),
+        "font_color": params.get("foregroundColor", "#434343"),
+        "align": _HORIZONTAL.get(str(params.get("horizontal", "LEFT")).upper(), "left"),
+        "valign": _VERTICAL.get(str(params.get("vertical", "MIDDLE")).upper(), "vcenter"),
+        "text_wrap": wrap,
+    }
+    number_format = params.get("numberFormat")
+    if number_format:
+        props["num_format"] = _NUMBER_FORMATS.get(str(number_format).upper(), "General")
+    return props
+
+
+def _header_props(header_cfg):
+    """apply_header_style + apply_wrap_text_to_header_row と同じ見た目"""
+    return {
+        "bg_color": header_cfg.get("backgroundColor", "#356854"),
+        "font_color": header_cfg.get("textColor", "#FFFFFF"),
+        "bold": bool(header_cfg.get("bold", True)),
+        "font_size": int(header_cfg.get("fontSize", 10)),
+        "align": "center",
+        "valign": "vcenter",
+        "text_wrap": True,
+    }
+
+
+def _category_palette(categories):
+    """dropdowns の C列と同じ配色（淡い背景＋同系色の濃い文字）を {カテゴリ: (背景, 文字)} で返す"""
+    def to_hex(h, s, l):
+        r, g, b = colorsys.hls_to_rgb(h, l, s)
+        return "#{:02X}{:02X}{:02X}".format(round(r * 255), round(g * 255), round(b * 255))
+
+    n = max(1, len(categories))
+    return {
+        cat: (to_hex(i / n, 0.38, 0.94), to_hex(i / n, min(1, 0.38 + 0.25), max(0, 0.94 - 0.65)))
+        for i, cat in enumerate(categories)
+    }
+
+
+def _distinct_labels(series):
+    """プルダウン用の値一覧（空白・None・nan を除く、昇順）"""
+    return sorted({
+        s for s in (str(v).strip() for v in series.dropna())
+        if s not in ("", "None", "nan")
+    })
+
+
+# ===============================
+# 🔹 値の書き込み（列ごとに型を決めて、行順にストリーミング）
+# ===============================
+
+def _column_cells(series):
+    """
+    列を (値のリスト, 書き込み方法) にする。欠損・inf は None（セルを書かない）。
+    書き込み方法: "number" / "bool" / "string" / "mixed"
+    """
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series.tolist(), "bool"
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        values = series.to_numpy(dtype="float64", na_value=np.nan)
+        cells = values.astype(object)
+        cells[~np.isfinite(values)] = None
+        return cells.tolist(), "number"
+
+    cells = []
+    for v in series.tolist():
+        if v is None or (isinstance(v, float) and not np.isfinite(v)) or v is pd.NA or v is pd.NaT:
+            cells.append(None)
+        elif isinstance(v, (bool, np.bool_)):
+            cells.append(bool(v))
+        elif isinstance(v, (int, float, np.integer, np.floating)):
+            cells.append(float(v))
+        else:
+            cells.append(str(v)[:_MAX_CELL_CHARS])
+    kinds = {type(v) for v in cells if v is not None}
+    return cells, ("string" if kinds <= {str} else "mixed")
+
+
+def _writer_for(worksheet, kind):
+    if kind == "number":
+        return worksheet.write_number
+    if kind == "bool":
+        return worksheet.write_boolean
+    if kind == "string":
+        return worksheet.write_string
+
+    def write_mixed(row, col, value, cell_format=None):
+        if isinstance(value, str):
+            return worksheet.write_string(row, col, value, cell_format)
+        if isinstance(value, bool):
+            return worksheet.write_boolean(row, col, value, cell_format)
+        return worksheet.write_number(row, col, value, cell_format)
+    return write_mixed
+
+
+def _write_rows(worksheet, df, *, last_row_formats=None, skip_values=None, block_rows=_BLOCK_ROWS):
+    """
+    2行目以降に df の値を行順に書く（constant_memory のため行の順序は崩さない）。
+    Python の値への変換は block_rows 行ずつ行い、行数に比例したリストを持たない。
+    書式は列の既定書式に任せ、最終行だけ last_row_formats（下枠線つき）を明示する。
+    skip_values: {列番号: 書かない文字列の集合}
+    """
+    skip_values = skip_values or {}
+    last = len(df) - 1
+
+    for lo in range(0, len(df), block_rows):
+        block = df.iloc[lo:lo + block_rows]
+        columns = [_column_cells(block.iloc[:, j]) for j in range(block.shape[1])]
+        writers = [_writer_for(worksheet, kind) for _, kind in columns]
+
+        for r, row in enumerate(zip(*(cells for cells, _ in columns)), start=lo):
+            formats = last_row_formats if r == last else None
+            for j, value in enumerate(row):
+                if value is None or (j in skip_values and value in skip_values[j]):
+                    if formats is not None:
+                        worksheet.write_blank(r + 1, j, None, formats[j])
+                    continue
+                if formats is not None:
+                    writers[j](r + 1, j, value, formats[j])
+                else:
+                    writers[j](r + 1, j, value)
+
+
+def _list_sources(workbook, lists):
+    """
+    ONE_OF_LIST のデータ検証の source を {名前: source} で返す。
+    長いリストは隠しシート "_lists" に1列ずつ置いて参照する（constant_memory なので行順にまとめて書く）。
+    """
+    sources, long_lists = {}, {}
+    for name, values in lists.items():
+        if sum(len(v) + 1 for v in values) <= _MAX_LIST_CHARS:
+            sources[name] = values
+        else:
+            long_lists[name] = values
+    if not long_lists:
+        return sources
+
+    sheet = workbook.add_worksheet("_lists")
+    sheet.hide()
+    names = list(long_lists)
+    for j, name in enumerate(names):
+        sheet.write_string(0, j, str(name))
+        letter = xlsxwriter.utility.xl_col_to_name(j)
+        sources[name] = f"='_lists'!${letter}$2:${letter}${len(long_lists[name]) + 1}"
+    for i in range(max(len(v) for v in long_lists.values())):
+        for j, name in enumerate(names):
+            if i < len(long_lists[name]):
+                sheet.write_string(i + 1, j, long_lists[name][i])
+    return sources
+
+
+# ===============================
+# 🪐 マスターシート（write_sheet と同じ見た目）
+# ===============================
+
+def _write_master_sheet(workbook, sheet_name, df, style_config):
+    worksheet = workbook.add_worksheet(sheet_name)
+    columns = [str(c) for c in df.columns]
+    num_rows, num_cols = len(df), len(columns)
+
+    header_cfg = style_config.get("header", {})
+    planet_cfg = style_config.get("planet", {})
+    column_cfg = style_config.get("columns", {})
+
+    # --- 列ごとの書式（style_column）と列幅 ---
+    col_props = [{"valign": "vcenter"} for _ in range(num_cols)]
+    header_extra = [{} for _ in range(num_cols)]
+    widths = {}
+    for col_key, params in column_cfg.items():
+        props = _column_props(params)
+        # 列記号は既定の3軸モデルの並びでの位置（採点モデルで列がずれても同じ種類の列に当てる）
+        for j in scoring_module.style_targets(col_key, columns):
+            col_props[j] = props
+            if not params.get("exclude_header", True):
+                header_extra[j] = props
+            if params.get("columnWidth"):
+                widths[j] = int(params["columnWidth"])
+    if num_cols > 3:
+        # D列：値のあるセルはグレーの太字（空セルは見た目が変わらない）
+        col_props[3] = {**col_props[3], "font_color": _SUBTOPIC_TEXT_COLOR, "bold": True}
+
+    # --- 惑星の枠線（外枠＋グループ境界） ---
+    borders = [{} for _ in range(num_cols)]
+    # apply_planet_border と同じグループ境界（この列の左に線を引く、0始まり）
+    group_edges = scoring_module.group_right_edges(df.columns)
+    top_row = bottom_row = None
+    if planet_cfg.get("has_planet", True):
+        color = planet_cfg.get("planet_color", "#356854")
+        line = {"border_color": color}
+        left = planet_cfg.get("start_col", 1) - 1
+        right = left + num_cols - 1
+        top_row = planet_cfg.get("start_row", 1) - 1
+        bottom_row = top_row + num_rows
+        for j in range(num_cols):
+            if j == left or j in group_edges:
+                borders[j] = {**borders[j], "left": 2, **line}
+            if j == right:
+                borders[j] = {**borders[j], "right": 2, **line}
+
+    header_base = _header_props(header_cfg)
+    outline = {"border_color": planet_cfg.get("planet_color", "#356854")}
+    header_formats = [
+        workbook.add_format({
+            **header_base, **header_extra[j], **borders[j],
+            **({"top": 2, **outline} if top_row == 0 else {}),
+            **({"bottom": 2, **outline} if bottom_row == 0 else {}),
+        })
+        for j in range(num_cols)
+    ]
+    body_formats = [workbook.add_format({**col_props[j], **borders[j]}) for j in range(num_cols)]
+    last_row_formats = [
+        workbook.add_format({**col_props[j], **borders[j],
+                             **({"bottom": 2, **outline} if bottom_row == num_rows else {})})
+        for j in range(num_cols)
+    ]
+
+    # 列の既定書式（値を書くセルは明示しなくてもこの書式になる）は行を書く前に設定する
+    for j in range(num_cols):
+        if j in widths:
+            worksheet.set_column_pixels(j, j, widths[j], body_formats[j])
+        else:
+            worksheet.set_column(j, j, None, body_formats[j])
+    worksheet.set_row_pixels(0, int(header_cfg.get("header_height_px", 40)))
+    worksheet.freeze_panes(1, 0)
+
+    for j, name in enumerate(columns):
+        worksheet.write_string(0, j, name, header_formats[j])
+    if num_rows == 0:
+        return worksheet
+    _write_rows(worksheet, df, last_row_formats=last_row_formats,
+                skip_values={3: {"nan", "None", "NaN"}} if num_cols > 3 else None)
+
+    last_col = num_cols - 1
+    worksheet.autofilter(0, 0, num_rows, last_col)
+
+    # --- C列：カテゴリーごとの色（条件付き書式）、C列・D列：プルダウン ---
+    categories = _distinct_labels(df.iloc[:, 2]) if num_cols > 2 else []
+    subtopics = _distinct_labels(df.iloc[:, 3]) if num_cols > 3 else []
+    sources = _list_sources(workbook, {"C": categories, "D": subtopics})
+    dropdown = {"validate": "list", "ignore_blank": True, "dropdown": True}
+
+    for cat, (bg, fg) in _category_palette(categories).items():
+        worksheet.conditional_format(1, 2, num_rows, 2, {
+            "type": "cell", "criteria": "==", "value": '"' + cat.replace('"', '""') + '"',
+            "format": workbook.add_format({"bg_color": bg, "font_color": fg, "bold": True}),
+        })
+    if categories:
+        worksheet.data_validation(1, 2, num_rows, 2, {**dropdown, "source": sources["C"]})
+
+    # D列は値のある行だけ（連続ブロックをまとめて1つの検証に）
+    if subtopics:
+        d_values = df.iloc[:, 3]
+        filled = d_values.notna() & ~d_values.astype(str).str.strip().isin(["", "None", "nan"])
+        rows = np.flatnonzero(filled.to_numpy()) + 1
+        breaks = np.flatnonzero(np.diff(rows) != 1)
+        starts = np.r_[rows[0], rows[breaks + 1]]
+        ends = np.r_[rows[breaks], rows[-1]]
+        ranges = " ".join(
+            xlsxwriter.utility.xl_range(int(a), 3, int(b), 3) for a, b in zip(starts, ends)
+        )
+        worksheet.data_validation(int(starts[0]), 3, int(ends[0]), 3, {
+            **dropdown, "source": sources["D"], "multi_range": ranges,
+        })
+
+    # --- 交互の背景色（条件付き書式なのでセルごとの書式は不要。カテゴリー色が優先） ---
+    worksheet.conditional_format(1, 0, num_rows, last_col, {
+        "type": "formula", "criteria": "=MOD(ROW(),2)=1",
+        "format": workbook.add_format({"bg_color": _ZEBRA_COLOR}),
+    })
+    return worksheet
+
+
+# ===============================
+# 📄 アイデア一覧シート（write_table_sheet と同じ見た目）
+# ===============================
+
+def _write_table_sheet(workbook, sheet_name, df, style_config):
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_cfg = (style_config or {}).get("header", {})
+    header_format = workbook.add_format(_header_props(header_cfg))
+    worksheet.set_row_pixels(0, int(header_cfg.get("header_height_px", 40)))
+    worksheet.freeze_panes(1, 0)
+    for j, name in enumerate(df.columns):
+        worksheet.write_string(0, j, str(name), header_format)
+    if len(df):
+        _write_rows(worksheet, df)
+        worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+    return worksheet
+
+
+def export_xlsx(df_master, style_config, *, df_ideas=None, output=None,
+                master_sheet_name="シート1", idea_sheet_name="アイデア一覧"):
+    """
+    df_master（と任意で df_ideas）を design の書式つき XLSX にする。
+    constant_memory モードで1行ずつ書き出すので、行数が増えてもメモリは一定。
+
+    Args:
+        output: 出力先のパスまたはファイルオブジェクト（None ならバイト列を返す）
+
+    Returns:
+        (出力先 or バイト列, エラーメッセージ or None)
+    """
+    buffer = io.BytesIO() if output is None else output
+    try:
+        workbook = xlsxwriter.Workbook(buffer, {"constant_memory": True})
+        _write_master_sheet(workbook, master_sheet_name, df_master, style_config or {})
+        if df_ideas is not None:
+            _write_table_sheet(workbook, idea_sheet_name, df_ideas, style_config)
+        workbook.close()
+    except Exception as e:
+        print(f"❌ Failed to build XLSX: {e}")
+        return None, str(e)
+
+    print(f"✅ XLSX built ({len(df_master)} topics" + (f", {len(df_ideas)} ideas)" if df_ideas is not None else ")"))
+    return (buffer.getvalue() if output is None else output), None